@@ -1,22 +1,45 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+from cache import TTLCache
+from profiling import record_offloaded
 
 # Secret key for JWT (in production, use a strong random secret from environment)
 SECRET_KEY = os.getenv("SECRET_KEY", "vidhya-ai-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30  # Token valid for 30 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing (changing BCRYPT_ROUNDS rehashes each user's password at their next login)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt is CPU-bound by design, so it runs in worker processes instead of on the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash/verify calls allowed to wait for a worker before new ones are turned away with 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
 
 # HTTP Bearer token scheme
 security = HTTPBearer()
 
+# Accounts allowed to use admin-only endpoints (comma-separated emails)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Tokens whose signature was already verified, keyed by SHA-256 digest and kept no longer than their exp
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "4096"))
+token_cache = TTLCache(maxsize=TOKEN_CACHE_MAX_ENTRIES, ttl=ACCESS_TOKEN_EXPIRE_DAYS * 86400)
+# user_id -> digests of that user's cached tokens, so a changed user's entries can be dropped
+_user_tokens: Dict[int, Set[str]] = {}
+_user_tokens_lock = threading.Lock()
+
 def hash_password(password: str) -> str:
     """Hash a password (bcrypt has 72 byte limit)"""
     # Truncate password to 72 bytes (bcrypt limitation)
@@ -29,6 +52,70 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     password_bytes = plain_password.encode('utf-8')[:72]
     return pwd_context.verify(password_bytes, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return a new hash if the stored one uses outdated settings"""
+    password_bytes = plain_password.encode('utf-8')[:72]
+    valid, new_hash = pwd_context.verify_and_update(password_bytes, hashed_password)
+    return valid, new_hash
+
+_hash_executor: Optional[ProcessPoolExecutor] = None
+_hash_pending = 0
+_hash_stats = {"hashed": 0, "verified": 0, "rejected": 0}
+
+def _password_executor() -> ProcessPoolExecutor:
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _hash_executor
+
+async def _run_password_job(func, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        _hash_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-in attempts in progress, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    started = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_password_executor(), func, *args)
+    finally:
+        _hash_pending -= 1
+        # bcrypt runs in another process, out of sight of a request profile
+        record_offloaded(f"bcrypt.{func.__name__}", time.perf_counter() - started)
+
+async def hash_password_async(password: str) -> str:
+    """hash_password in the worker pool (503 when too many are queued)"""
+    hashed = await _run_password_job(hash_password, password)
+    _hash_stats["hashed"] += 1
+    return hashed
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """verify_and_update_password in the worker pool (503 when too many are queued)"""
+    result = await _run_password_job(verify_and_update_password, plain_password, hashed_password)
+    _hash_stats["verified"] += 1
+    return result
+
+def password_hashing_stats() -> Dict:
+    """Worker pool settings, queue depth and call counters"""
+    return {
+        "rounds": BCRYPT_ROUNDS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": _hash_pending,
+        **_hash_stats,
+    }
+
+def shutdown():
+    """Stop the password hashing worker processes"""
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=True)
+        _hash_executor = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -51,6 +138,11 @@ def decode_token(token: str) -> Optional[dict]:
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """Dependency to get current user from JWT token"""
     token = credentials.credentials
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = token_cache.get(digest)
+    if cached is not None:
+        return dict(cached)
+
     payload = decode_token(token)
 
     if payload is None:
@@ -70,4 +162,26 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    return {"user_id": user_id, "email": email}
+    current_user = {"user_id": user_id, "email": email}
+    # jose has already rejected expired tokens; one without exp is cached for the default lifetime
+    expires_at = payload.get("exp")
+    token_cache.set(digest, current_user, ttl=expires_at - time.time() if expires_at else None)
+    with _user_tokens_lock:
+        # Digests the cache has since evicted or expired are dropped along the way
+        digests = {d for d in _user_tokens.get(user_id, ()) if token_cache.peek(d) is not None}
+        digests.add(digest)
+        _user_tokens[user_id] = digests
+    return dict(current_user)
+
+def invalidate_user_tokens(user_id: int):
+    """Drop the cached tokens of a user whose record changed, so they are verified afresh (on_user_changed hook)"""
+    with _user_tokens_lock:
+        digests = _user_tokens.pop(user_id, set())
+    for digest in digests:
+        token_cache.invalidate(digest)
+
+async def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
+    """Dependency for admin-only endpoints: the current user, if their email is in ADMIN_EMAILS"""
+    if current_user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
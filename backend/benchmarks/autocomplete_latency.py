@@ -0,0 +1,76 @@
+"""Autocomplete latency: symptom/condition and medicine completions at a large vocabulary
+
+Run from the backend directory:  python benchmarks/autocomplete_latency.py [distinct_terms]
+
+Seeds one doctor with prescriptions covering `distinct_terms` distinct symptoms (default
+100000) in a throwaway SQLite database, then times the in-memory lookups behind
+/api/terms/autocomplete and /api/medicines/autocomplete for random 1-4 letter prefixes.
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.pop("DATABASE_URL", None)
+os.environ.setdefault("DB_VERIFY_QUERY_PLANS", "false")
+os.chdir(tempfile.mkdtemp(prefix="vidhya-bench-"))
+
+from database import Database
+
+LOOKUPS = 20000
+TERMS_PER_PRESCRIPTION = 5
+BATCH = 500
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+
+def seed(db: Database, user_id: int, distinct_terms: int, rng: random.Random):
+    terms = list({f"{word(rng)} {word(rng)}" for _ in range(distinct_terms * 2)})[:distinct_terms]
+    prescriptions = [terms[i:i + TERMS_PER_PRESCRIPTION] for i in range(0, len(terms), TERMS_PER_PRESCRIPTION)]
+    # Repeat some prescriptions so usage counts differ
+    prescriptions += rng.choices(prescriptions, k=len(prescriptions) // 2)
+    for start in range(0, len(prescriptions), BATCH):
+        db.create_prescriptions_batch(user_id, [
+            {
+                "patient_name": "Patient",
+                "patient_age": 40,
+                "patient_gender": "Female",
+                "symptoms": symptoms,
+                "health_conditions": [],
+                "diagnosis": {"primary_condition": "Benchmark"},
+                "medicines": [{"medicine_name": f"{word(rng).title()} Vati"}],
+            }
+            for symptoms in prescriptions[start:start + BATCH]
+        ])
+
+def report(name: str, lookup, rng: random.Random):
+    prefixes = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(1, 4))) for _ in range(LOOKUPS)]
+    started = time.perf_counter()
+    lookup("a")
+    print(f"  {name:10} built in {(time.perf_counter() - started) * 1000:8.1f} ms")
+    latencies = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        lookup(prefix)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(f"  {name:10} p50 {latencies[len(latencies) // 2] * 1e6:7.1f} us   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e6:7.1f} us")
+
+def main_cli():
+    distinct_terms = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(distinct_terms)
+    db = Database(db_path="autocomplete.db")
+    user_id = db.create_user("bench@example.com", "x", "Bench")
+    started = time.perf_counter()
+    seed(db, user_id, distinct_terms, rng)
+    print(f"{distinct_terms} distinct symptoms (seeded in {time.perf_counter() - started:.1f} s)")
+    report("symptoms", lambda prefix: db.autocomplete_terms(prefix, "symptom", user_id), rng)
+    report("medicines", lambda prefix: db.autocomplete_medicines(prefix), rng)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,267 @@
+"""Load test: concurrent virtual doctors against the API, with per-endpoint latency percentiles
+
+Self-contained run (throwaway SQLite database, stub OpenAI server and uvicorn started here):
+    python benchmarks/loadtest/run.py --spawn [--doctors 20] [--prescriptions 1000] [--users 32] [--duration 60]
+
+Against a server that is already running (seeded with seed.py, OPENAI_BASE_URL at the stub):
+    python benchmarks/loadtest/run.py --base-url http://127.0.0.1:8000 --doctors 20
+
+Results are written to benchmarks/loadtest/results/<timestamp>.json; --compare <file> prints
+the change against an earlier run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(os.path.dirname(LOADTEST_DIR))
+RESULTS_DIR = os.path.join(LOADTEST_DIR, "results")
+sys.path.insert(0, LOADTEST_DIR)
+
+import httpx
+from seed import CONDITIONS, MEDICINES, PASSWORD, SYMPTOMS, doctor_email, zipf_pick
+
+# Relative weight of each request in a virtual doctor's mix
+SCENARIO = {
+    "login": 1,
+    "medicines_search": 6,
+    "prescription_generate": 3,
+    "patients_list": 3,
+    "prescriptions_list": 3,
+}
+PERCENTILES = (50, 90, 95, 99)
+
+class VirtualDoctor:
+    """One logged-in doctor issuing the scenario's requests back to back"""
+
+    def __init__(self, client: httpx.AsyncClient, n: int, rng: random.Random, novel_rate: float):
+        self.client = client
+        self.n = n
+        self.rng = rng
+        self.novel_rate = novel_rate
+        self.headers = {}
+
+    async def login(self) -> httpx.Response:
+        response = await self.client.post(
+            "/api/auth/login", json={"email": doctor_email(self.n), "password": PASSWORD}
+        )
+        if response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return response
+
+    def symptoms(self) -> list:
+        # Mostly the seeded vocabulary (historical matches, cached suggestions); sometimes unseen terms (a model call)
+        if self.rng.random() < self.novel_rate:
+            return [f"novel symptom {self.rng.getrandbits(32)}"]
+        return zipf_pick(self.rng, SYMPTOMS, self.rng.randint(1, 3))
+
+    async def medicines_search(self) -> httpx.Response:
+        return await self.client.post("/api/medicines/search", headers=self.headers, json={
+            "symptoms": self.symptoms(),
+            "health_conditions": zipf_pick(self.rng, CONDITIONS, self.rng.randint(0, 1)),
+        })
+
+    async def prescription_generate(self) -> httpx.Response:
+        patient = self.rng.randrange(1000)
+        return await self.client.post("/api/prescription/generate", headers=self.headers, json={
+            "patient_name": f"Patient {patient}",
+            "patient_age": 20 + patient % 60,
+            "patient_gender": "Female" if patient % 2 else "Male",
+            "symptoms": self.symptoms(),
+            "health_conditions": zipf_pick(self.rng, CONDITIONS, self.rng.randint(0, 1)),
+            "medicines": [
+                {"medicine_name": name, "dosage": "1 tablet twice daily", "timing": "After meals"}
+                for name in zipf_pick(self.rng, MEDICINES, self.rng.randint(2, 4))
+            ],
+            "doctor_name": f"Load Test Doctor {self.n}",
+        })
+
+    async def patients_list(self) -> httpx.Response:
+        return await self.client.get("/api/patients", headers=self.headers, params={"limit": 50})
+
+    async def prescriptions_list(self) -> httpx.Response:
+        return await self.client.get("/api/prescriptions", headers=self.headers, params={"limit": 50})
+
+async def run_load(base_url: str, doctors: int, users: int, duration: float, warmup: float,
+                   novel_rate: float, seed: int) -> dict:
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    timeout = httpx.Timeout(60.0)
+    samples = {name: [] for name in SCENARIO}
+    errors = {name: {} for name in SCENARIO}
+    names, weights = list(SCENARIO), list(SCENARIO.values())
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        rng = random.Random(seed)
+        vdocs = [VirtualDoctor(client, i % doctors, random.Random(rng.random()), novel_rate) for i in range(users)]
+        await asyncio.gather(*(vdoc.login() for vdoc in vdocs))
+
+        started = time.perf_counter()
+        measure_from, stop_at = started + warmup, started + warmup + duration
+
+        async def user_loop(vdoc: VirtualDoctor):
+            while True:
+                name = vdoc.rng.choices(names, weights)[0]
+                sent = time.perf_counter()
+                if sent >= stop_at:
+                    return
+                try:
+                    response = await getattr(vdoc, name)()
+                    outcome = None if response.status_code < 400 else str(response.status_code)
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                if sent < measure_from:
+                    continue
+                if outcome is None:
+                    samples[name].append(time.perf_counter() - sent)
+                else:
+                    errors[name][outcome] = errors[name].get(outcome, 0) + 1
+
+        await asyncio.gather(*(user_loop(vdoc) for vdoc in vdocs))
+
+    return {name: summarize(samples[name], errors[name], duration) for name in SCENARIO}
+
+def percentile(ordered: list, p: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(latencies: list, errors: dict, duration: float) -> dict:
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / duration,
+    }
+    if latencies:
+        summary.update({f"p{p}_ms": percentile(latencies, p) * 1000 for p in PERCENTILES})
+        summary["max_ms"] = latencies[-1] * 1000
+    return summary
+
+def print_report(results: dict, baseline: dict = None):
+    columns = ["throughput"] + [f"p{p}_ms" for p in PERCENTILES] + ["max_ms"]
+    print(f"{'endpoint':24}{'req/s':>10}" + "".join(f"{c[:-3]:>10}" for c in columns[1:]) + f"{'errors':>10}")
+    for name, summary in results.items():
+        cells = "".join(f"{summary.get(c, float('nan')):>10.1f}" for c in columns)
+        print(f"{name:24}{cells}{sum(summary['errors'].values()):>10}")
+        if baseline and name in baseline:
+            deltas = []
+            for c in columns:
+                before, after = baseline[name].get(c), summary.get(c)
+                deltas.append(f"{(after - before) / before * 100:>+9.0f}%" if before and after is not None else f"{'':>10}")
+            print(f"{'  vs baseline':24}" + "".join(deltas))
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f} s")
+
+def spawn(args, workdir: str, processes: list) -> str:
+    """Start the OpenAI stub and a backend seeded into a SQLite database in `workdir`, returning its URL"""
+    stub_port, api_port = free_port(), free_port()
+    env = {**os.environ, "OPENAI_API_KEY": "loadtest", "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1"}
+    env.pop("DATABASE_URL", None)
+
+    subprocess.run([sys.executable, os.path.join(LOADTEST_DIR, "seed.py"), "--doctors", str(args.doctors),
+                    "--patients", str(args.patients), "--prescriptions", str(args.prescriptions),
+                    "--seed", str(args.seed)], cwd=workdir, env=env, check=True)
+    stub = subprocess.Popen([sys.executable, os.path.join(LOADTEST_DIR, "stub_openai.py"), "--port", str(stub_port),
+                             "--latency-ms", str(args.llm_latency_ms), "--jitter-ms", str(args.llm_jitter_ms)],
+                            cwd=workdir, env=env, start_new_session=True)
+    processes.append(stub)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+                               "--host", "127.0.0.1", "--port", str(api_port), "--workers", str(args.workers),
+                               "--log-level", "warning"], cwd=workdir, env=env, start_new_session=True)
+    processes.append(server)
+    wait_until_up(f"http://127.0.0.1:{stub_port}/stats", stub)
+    wait_until_up(f"http://127.0.0.1:{api_port}/", server)
+    return f"http://127.0.0.1:{api_port}"
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", help="server to test (default: start one with --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="start stub, seeded database and server locally")
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=200, help="--spawn: distinct patients per doctor")
+    parser.add_argument("--prescriptions", type=int, default=1000, help="--spawn: prescriptions per doctor")
+    parser.add_argument("--workers", type=int, default=1, help="--spawn: uvicorn worker processes")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="--spawn: stub completion latency")
+    parser.add_argument("--llm-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual doctors")
+    parser.add_argument("--duration", type=float, default=60.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds first")
+    parser.add_argument("--novel-rate", type=float, default=0.1, help="share of searches with unseen symptoms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--output", help="results file (default: results/<timestamp>.json)")
+    args = parser.parse_args()
+    if not args.base_url and not args.spawn:
+        parser.error("pass --base-url or --spawn")
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="vidhya-loadtest-") if args.spawn else None
+    try:
+        base_url = args.base_url
+        if args.spawn:
+            base_url = spawn(args, workdir, processes)
+        results = asyncio.run(run_load(base_url, args.doctors, args.users, args.duration, args.warmup,
+                                       args.novel_rate, args.seed))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+            # Pool workers forked by the server inherit uvicorn's SIGTERM handler and would outlive it
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+    print_report(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+            "endpoints": results,
+        }, f, indent=2)
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,77 @@
+"""Seed the configured database with synthetic doctors, patients and prescriptions
+
+Run from the directory the backend runs in (SQLite creates vidhya.db there), or with DATABASE_URL set:
+    python <backend>/benchmarks/loadtest/seed.py [--doctors 20] [--patients 200] [--prescriptions 1000] [--seed 1]
+
+--patients and --prescriptions are per doctor. Doctors are loadtest-doctor-<n>@example.com,
+all with the password in PASSWORD, so the load driver can log in as any of them.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+
+from auth import hash_password
+
+PASSWORD = "loadtest-password"
+SYMPTOMS = [f"symptom {i}" for i in range(400)]
+CONDITIONS = [f"condition {i}" for i in range(120)]
+MEDICINES = [f"Medicine {i} Vati" for i in range(300)]
+BATCH = 500
+
+def doctor_email(n: int) -> str:
+    return f"loadtest-doctor-{n}@example.com"
+
+def zipf_pick(rng: random.Random, vocabulary: list, count: int) -> list:
+    """A few very common terms and a long tail of rare ones, like real complaints"""
+    picked = set()
+    while len(picked) < count:
+        picked.add(vocabulary[min(int(rng.paretovariate(1.1)) - 1, len(vocabulary) - 1)])
+    return sorted(picked)
+
+def prescription(rng: random.Random, patient: int) -> dict:
+    return {
+        "patient_name": f"Patient {patient}",
+        "patient_age": 20 + patient % 60,
+        "patient_gender": "Female" if patient % 2 else "Male",
+        "symptoms": zipf_pick(rng, SYMPTOMS, rng.randint(2, 5)),
+        "health_conditions": zipf_pick(rng, CONDITIONS, rng.randint(0, 2)),
+        "diagnosis": {"primary_condition": f"Condition {rng.randrange(50)}"},
+        "medicines": [
+            {"medicine_name": name, "dosage": "1 tablet twice daily", "timing": "After meals", "duration": "15 days"}
+            for name in zipf_pick(rng, MEDICINES, rng.randint(2, 5))
+        ],
+    }
+
+def seed(db, doctors: int, patients: int, prescriptions: int, rng: random.Random):
+    password_hash = hash_password(PASSWORD)
+    for n in range(doctors):
+        user_id = db.create_user(doctor_email(n), password_hash, f"Load Test Doctor {n}", registration_number=f"LT-{n}")
+        if user_id is None:
+            user_id = db.get_user_by_email(doctor_email(n))["id"]
+        items = [prescription(rng, rng.randrange(patients)) for _ in range(prescriptions)]
+        for start in range(0, len(items), BATCH):
+            db.create_prescriptions_batch(user_id, items[start:start + BATCH])
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=200, help="distinct patients per doctor")
+    parser.add_argument("--prescriptions", type=int, default=1000, help="prescriptions per doctor")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Imported here: the database module opens its connection on import, and run.py only needs the vocabulary
+    from database import db
+    started = time.perf_counter()
+    seed(db, args.doctors, args.patients, args.prescriptions, random.Random(args.seed))
+    print(f"Seeded {args.doctors} doctors x {args.prescriptions} prescriptions "
+          f"({args.patients} patients each) in {time.perf_counter() - started:.1f} s")
+
+if __name__ == "__main__":
+    main_cli()
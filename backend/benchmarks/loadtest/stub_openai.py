@@ -0,0 +1,121 @@
+"""Local stand-in for the OpenAI chat completions API, for load tests
+
+Run:  python benchmarks/loadtest/stub_openai.py [--port 8900] [--latency-ms 800] [--jitter-ms 200]
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1. Every completion
+returns a well-formed diagnosis and medicine list after the configured latency; streamed
+completions spread that latency over their chunks.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="OpenAI stub")
+settings = {"latency_ms": 800.0, "jitter_ms": 200.0, "chunks": 20}
+stats = {"completions": 0, "streamed": 0}
+
+def suggestion(prompt: str) -> str:
+    """A plausible suggestion JSON with as many medicines as the prompt asks for"""
+    count = 8
+    marker = "EXACTLY "
+    if marker in prompt:
+        digits = prompt.rsplit(marker, 1)[1].split(" ", 1)[0]
+        count = int(digits) if digits.isdigit() else count
+    rng = random.Random(prompt)
+    return json.dumps({
+        "diagnosis": {
+            "primary_condition": f"Condition {rng.randrange(100)}",
+            "secondary_conditions": [f"Condition {rng.randrange(100)}"],
+            "ayurvedic_analysis": "Vata imbalance (load test stub)",
+        },
+        "medicines": [
+            {
+                "name": f"Stub Vati {rng.randrange(500)}",
+                "description": "Polyherbal formulation (load test stub)",
+                "recommended_dosage": "1 tablet twice daily",
+                "timing": "After meals",
+                "precautions": None,
+            }
+            for _ in range(count)
+        ],
+    })
+
+def latency() -> float:
+    return max(0.0, settings["latency_ms"] + random.uniform(-1, 1) * settings["jitter_ms"]) / 1000
+
+def completion_id() -> str:
+    return f"chatcmpl-stub-{random.getrandbits(48):012x}"
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    content = suggestion(prompt)
+    model = body.get("model", "gpt-4o")
+    created = int(time.time())
+    usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+             "total_tokens": (len(prompt) + len(content)) // 4}
+
+    if not body.get("stream"):
+        stats["completions"] += 1
+        await asyncio.sleep(latency())
+        return JSONResponse({
+            "id": completion_id(),
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    stats["streamed"] += 1
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+    chunk_id = completion_id()
+    pieces = settings["chunks"]
+    size = -(-len(content) // pieces)
+
+    async def events():
+        delay = latency() / pieces
+        for start in range(0, len(content), size):
+            await asyncio.sleep(delay)
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        done = {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(done)}\n\n"
+        if include_usage:
+            final = {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/stats")
+async def stub_stats():
+    return stats
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=settings["jitter_ms"])
+    args = parser.parse_args()
+    settings.update(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,78 @@
+"""Login throughput benchmark: concurrent logins against the app in-process
+
+Run from the backend directory:  python benchmarks/login_throughput.py [logins] [concurrency] [--inline]
+
+--inline verifies passwords on the event loop (the old behaviour) for comparison. Uses a
+throwaway SQLite database in a temporary directory; BCRYPT_ROUNDS etc. are read from the env.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.pop("DATABASE_URL", None)
+os.chdir(tempfile.mkdtemp(prefix="vidhya-bench-"))
+
+import httpx
+import auth
+import main
+
+async def event_loop_lag(stop: asyncio.Event, samples: list):
+    """Record how late a 10 ms timer fires while the burst runs"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(time.perf_counter() - started - 0.01)
+
+async def run(logins: int, concurrency: int):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"email": "bench@example.com", "password": "benchmark-password"}
+        await client.post("/api/auth/register", json={**credentials, "name": "Bench"})
+        await client.post("/api/auth/login", json=credentials)  # start the worker processes
+
+        gate = asyncio.Semaphore(concurrency)
+        latencies, statuses = [], []
+
+        async def login():
+            async with gate:
+                started = time.perf_counter()
+                response = await client.post("/api/auth/login", json=credentials)
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+
+        stop, lag = asyncio.Event(), []
+        ticker = asyncio.create_task(event_loop_lag(stop, lag))
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+
+    latencies.sort()
+    print(f"{logins} logins, concurrency {concurrency}, bcrypt rounds {auth.BCRYPT_ROUNDS}, "
+          f"{auth.PASSWORD_HASH_WORKERS} hash workers")
+    print(f"  throughput: {logins / elapsed:8.1f} logins/s")
+    print(f"  latency:    p50 {statistics.median(latencies) * 1000:7.1f} ms   "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms")
+    print(f"  event loop: max stall {max(lag, default=0) * 1000:7.1f} ms")
+    print(f"  statuses:   { {code: statuses.count(code) for code in sorted(set(statuses))} }")
+
+def main_cli():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    logins = int(args[0]) if args else 40
+    concurrency = int(args[1]) if len(args) > 1 else 8
+    if "--inline" in sys.argv:
+        async def verify_inline(plain_password, hashed_password):
+            return auth.verify_and_update_password(plain_password, hashed_password)
+        main.verify_and_update_password_async = verify_inline
+        print("verifying passwords on the event loop")
+    asyncio.run(run(logins, concurrency))
+
+if __name__ == "__main__":
+    main_cli()
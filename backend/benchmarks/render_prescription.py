@@ -0,0 +1,40 @@
+"""Micro-benchmark: time to render one prescription page
+
+Run from the backend directory:  python benchmarks/render_prescription.py [iterations]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from renderer import render_prescription, PRESCRIPTION_CSS
+
+def sample(medicine_count: int) -> dict:
+    return {
+        "patient_name": "Asha <Sharma> & family",
+        "patient_age": 42,
+        "patient_gender": "Female",
+        "symptoms": ["Cough", "Fever", "Headache", "Fatigue"],
+        "health_conditions": ["Asthma", "Hypertension"],
+        "medicines": [
+            {"medicine_name": f"Medicine {i}", "dosage": "1 tablet twice daily", "timing": "After meals"}
+            for i in range(medicine_count)
+        ],
+        "doctor_name": "Vaidya Rao",
+        "doctor_registration": "AYU-12345",
+        "now": datetime(2024, 1, 1),
+    }
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"stylesheet inlined into each stored page (linked when served): {len(PRESCRIPTION_CSS.encode('utf-8'))} bytes")
+    for medicine_count in (1, 8, 32):
+        data = sample(medicine_count)
+        html = render_prescription(**data)
+        best = min(timeit.repeat(lambda: render_prescription(**data), number=iterations, repeat=5))
+        print(f"{medicine_count:>3} medicines: {best / iterations * 1e6:8.2f} us/render, {len(html.encode('utf-8'))} bytes")
+
+if __name__ == "__main__":
+    main()
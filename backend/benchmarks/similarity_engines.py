@@ -0,0 +1,92 @@
+"""Similar-prescription search: SQL overlap scorer vs the in-memory TF-IDF index
+
+Run from the backend directory:  python benchmarks/similarity_engines.py [prescriptions ...]
+
+Seeds one doctor with each number of synthetic prescriptions (default 10000 100000 1000000;
+the large case takes a while to seed) in a throwaway SQLite database and times the same
+random searches with ranking="overlap" and ranking="tfidf".
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.pop("DATABASE_URL", None)
+os.environ.setdefault("DB_VERIFY_QUERY_PLANS", "false")
+os.chdir(tempfile.mkdtemp(prefix="vidhya-bench-"))
+
+from database import Database
+
+SYMPTOMS = [f"symptom {i}" for i in range(2000)]
+CONDITIONS = [f"condition {i}" for i in range(500)]
+QUERIES = 200
+BATCH = 500
+
+def zipf_pick(rng: random.Random, vocabulary: list, count: int) -> list:
+    """A few very common terms and a long tail of rare ones, like real complaints"""
+    picked = set()
+    while len(picked) < count:
+        picked.add(vocabulary[min(int(rng.paretovariate(1.1)) - 1, len(vocabulary) - 1)])
+    return sorted(picked)
+
+def seed(db: Database, user_id: int, count: int, rng: random.Random):
+    for start in range(0, count, BATCH):
+        db.create_prescriptions_batch(user_id, [
+            {
+                "patient_name": f"Patient {rng.randrange(5000)}",
+                "patient_age": 40,
+                "patient_gender": "Female",
+                "symptoms": zipf_pick(rng, SYMPTOMS, rng.randint(2, 5)),
+                "health_conditions": zipf_pick(rng, CONDITIONS, rng.randint(0, 2)),
+                "diagnosis": {"primary_condition": "Benchmark"},
+                "medicines": [{"medicine_name": f"Medicine {rng.randrange(300)}", "dosage": "1 tablet"}],
+            }
+            for _ in range(min(BATCH, count - start))
+        ])
+
+def timed(search, queries: list) -> list:
+    latencies = []
+    for symptoms, conditions in queries:
+        started = time.perf_counter()
+        search(symptoms, conditions)
+        latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+def report(name: str, latencies: list):
+    print(f"  {name:8} p50 {statistics.median(latencies) * 1000:8.2f} ms   "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.2f} ms")
+
+def run(count: int):
+    rng = random.Random(count)
+    db = Database(db_path=f"similarity-{count}.db")
+    user_id = db.create_user(f"bench{count}@example.com", "x", "Bench")
+
+    started = time.perf_counter()
+    seed(db, user_id, count, rng)
+    print(f"{count} prescriptions (seeded in {time.perf_counter() - started:.1f} s)")
+
+    queries = [
+        (zipf_pick(rng, SYMPTOMS, rng.randint(2, 4)), zipf_pick(rng, CONDITIONS, rng.randint(0, 1)))
+        for _ in range(QUERIES)
+    ]
+    started = time.perf_counter()
+    db.tfidf.index(user_id)
+    print(f"  tfidf    index built in {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+    for ranking in ("overlap", "tfidf"):
+        report(ranking, timed(
+            lambda s, c: db.find_similar_prescriptions(s, c, user_id=user_id, limit=10, ranking=ranking),
+            queries
+        ))
+
+def main_cli():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for count in sizes:
+        run(count)
+
+if __name__ == "__main__":
+    main_cli()
@@ -4,11 +4,20 @@ import sqlite3
 conn = sqlite3.connect('vidhya.db')
 cursor = conn.cursor()
 
-# Delete all prescriptions first (due to foreign key constraint)
+# Delete the rows that reference prescriptions first (due to foreign key constraints)
+for table in ('prescription_terms', 'prescription_medicines', 'prescription_documents'):
+    cursor.execute(f"DELETE FROM {table}")
+    print(f"Deleted {cursor.rowcount} rows from {table}")
+
+# Delete all prescriptions
 cursor.execute("DELETE FROM prescriptions")
 print(f"Deleted {cursor.rowcount} prescriptions")
 
-# Delete all patients
+# The medicine catalog's prescription counts referred to the deleted prescriptions
+cursor.execute("UPDATE medicines SET prescription_count = 0")
+
+# Delete the patient search postings, then all patients
+cursor.execute("DELETE FROM patient_trigrams")
 cursor.execute("DELETE FROM patients")
 print(f"Deleted {cursor.rowcount} patients")
 
@@ -1,7 +1,24 @@
 import os
+import asyncio
+import base64
+import functools
+import hashlib
+import math
+import threading
+import time
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 import json
-from typing import Optional, List, Dict
+from typing import Callable, Optional, List, Dict, Set, Tuple
+from cache import SingleFlight
+from metrics import registry
+from profiling import current_profile
+from pool import ConnectionPool, ThreadLocalConnection
+from tfidf import TfidfEngine
+from trie import PrefixTrie, TermCompleter
 
 # Check if PostgreSQL URL is provided (production)
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -9,33 +26,431 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL:
     # Production: Use PostgreSQL
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import Json, RealDictCursor
     USE_POSTGRES = True
 else:
     # Development: Use SQLite
     import sqlite3
     USE_POSTGRES = False
+    # Columns tagged "[json]" in a select list are decoded by the driver itself
+    sqlite3.register_converter("json", json.loads)
+
+# Connection pool sizing (PostgreSQL only; SQLite reuses one connection per thread)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+
+# Worker threads for AsyncDatabase; by default one per pooled connection so threads never queue on the pool
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX_SIZE)))
+
+db_call_seconds = registry.histogram(
+    "vidhya_db_call_seconds", "Time a Database method ran on its AsyncDatabase worker thread", ("method",)
+)
+db_executor_wait_seconds = registry.histogram(
+    "vidhya_db_executor_wait_seconds", "Time a Database call queued for a free AsyncDatabase worker thread", ("method",)
+)
+
+def _ping_postgres(conn):
+    """Health check for a PostgreSQL connection that has been sitting idle"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1")
+    cursor.close()
+    conn.rollback()
+
+# Parameter marker for dynamically built statements (e.g. IN lists)
+PARAM = "%s" if USE_POSTGRES else "?"
+
+def _placeholders(count: int) -> str:
+    """Comma-separated parameter markers for an IN (...) list"""
+    return ", ".join([PARAM] * count)
+
+# JSON-valued prescription columns: JSONB on PostgreSQL (psycopg2 decodes them), JSON text on SQLite
+PRESCRIPTION_JSON_FIELDS = ('symptoms', 'health_conditions', 'diagnosis_secondary', 'medicines')
+PRESCRIPTION_FIELDS = (
+    'id', 'user_id', 'patient_id', 'symptoms', 'health_conditions', 'diagnosis_primary',
+    'diagnosis_secondary', 'diagnosis_ayurvedic', 'medicines', 'notes', 'created_at'
+)
+
+def prescription_columns(alias: str = "prescriptions") -> str:
+    """Select list for prescription rows that come back with their JSON fields already decoded"""
+    if USE_POSTGRES:
+        return f"{alias}.*"
+    return ", ".join(
+        f'{alias}.{field} AS "{field} [json]"' if field in PRESCRIPTION_JSON_FIELDS else f"{alias}.{field}"
+        for field in PRESCRIPTION_FIELDS
+    )
+
+def _json_param(value):
+    """Bind a Python structure to a JSON-valued prescription column"""
+    return Json(value) if USE_POSTGRES else json.dumps(value)
+
+# Keyset pagination for listings ordered by (created_at, id) DESC
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+_TIMESTAMP_PARAM = "%s::timestamp" if USE_POSTGRES else "?"
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+def encode_cursor(row: Dict) -> str:
+    """Opaque cursor that resumes a listing right after `row`"""
+    created_at = row['created_at']
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat(sep=' ')
+    payload = json.dumps([created_at, row['id']], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """(created_at, id) position encoded by encode_cursor"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(payload)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError("Invalid pagination cursor") from e
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise InvalidCursorError("Invalid pagination cursor")
+    return created_at, row_id
+
+def _page_size(limit: Optional[int]) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def _keyset_clause(alias: str = "") -> str:
+    """WHERE fragment selecting rows strictly after a (created_at, id) position"""
+    prefix = f"{alias}." if alias else ""
+    return f"AND ({prefix}created_at, {prefix}id) < ({_TIMESTAMP_PARAM}, {PARAM})"
+
+def _keyset(after: Optional[str], alias: str = "") -> Tuple[str, list]:
+    """Keyset WHERE fragment and its parameters for a cursor (empty for the first page)"""
+    if not after:
+        return "", []
+    created_at, row_id = decode_cursor(after)
+    return _keyset_clause(alias), [created_at, row_id]
+
+def _page(rows, page_size: int) -> Tuple[List[Dict], Optional[str]]:
+    """Split a LIMIT page_size + 1 result into (items, next_cursor)"""
+    items = [dict(row) for row in rows[:page_size]]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > page_size else None
+    return items, next_cursor
+
+def normalize_term(term: str) -> str:
+    """Canonical form of a symptom/condition used for indexing and matching"""
+    return term.lower().strip()
+
+# Fuzzy term matching: terms whose trigram sets overlap at least this much (Jaccard) count as the same
+FUZZY_MATCH_THRESHOLD = float(os.getenv("FUZZY_MATCH_THRESHOLD", "0.5"))
+
+# Ranking for find_similar_prescriptions: weighted term overlap (SQL) or TF-IDF cosine (in-memory index)
+SIMILARITY_RANKINGS = ("overlap", "tfidf")
+TFIDF_REFRESH_SECONDS = float(os.getenv("TFIDF_REFRESH_SECONDS", "60"))
+# TF-IDF indexes kept in memory (one per doctor plus the all-doctors one), least recently searched dropped first
+TFIDF_INDEX_MAX_ENTRIES = int(os.getenv("TFIDF_INDEX_MAX_ENTRIES", "256"))
+# "fetch" includes decoding the JSON columns, which the driver does while building rows
+similarity_stage_seconds = registry.histogram(
+    "vidhya_similar_prescriptions_stage_seconds", "Time spent in each stage of find_similar_prescriptions",
+    ("ranking", "stage")
+)
+
+def word_starts(term: str) -> List[str]:
+    """The term from each of its words onwards, so 'kayakalp' also completes 'divya kayakalp vati'"""
+    return [term[i:] for i in range(len(term)) if term[i] != " " and (i == 0 or term[i - 1] == " ")]
+
+# Medicine autocomplete: results per prefix kept in the trie, and how often it is rebuilt from the catalog table
+AUTOCOMPLETE_MAX_RESULTS = int(os.getenv("AUTOCOMPLETE_MAX_RESULTS", "10"))
+MEDICINE_CATALOG_REFRESH_SECONDS = float(os.getenv("MEDICINE_CATALOG_REFRESH_SECONDS", "300"))
+# Symptom/condition autocomplete: one trie per (doctor, kind) in memory, reading other workers' writes this often
+TERM_KINDS = ('symptom', 'condition')
+TERM_INDEX_MAX_ENTRIES = int(os.getenv("TERM_INDEX_MAX_ENTRIES", "512"))
+TERM_INDEX_REFRESH_SECONDS = float(os.getenv("TERM_INDEX_REFRESH_SECONDS", "30"))
+
+def term_trigrams(term: str) -> set:
+    """Character trigrams of a term with spacing and punctuation removed ("head ache" == "headache")"""
+    compact = "".join(ch for ch in normalize_term(term) if unicodedata.category(ch)[0] in "LMN")
+    if not compact:
+        return set()
+    padded = f"  {compact} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Statements on the hot paths, shared by the Database methods and verify_query_plans
+def _user_patients_sql(keyset: str) -> str:
+    return f"""SELECT * FROM patients
+               WHERE user_id = {PARAM} {keyset}
+               ORDER BY created_at DESC, id DESC
+               LIMIT {PARAM}"""
+
+def _patient_prescriptions_sql(keyset: str) -> str:
+    return f"""SELECT {prescription_columns()} FROM prescriptions
+               WHERE patient_id = {PARAM} AND user_id = {PARAM} {keyset}
+               ORDER BY created_at DESC, id DESC
+               LIMIT {PARAM}"""
+
+def _user_prescriptions_sql(keyset: str) -> str:
+    return f"""SELECT {prescription_columns('p')}, pt.name as patient_name, pt.age as patient_age, pt.gender as patient_gender
+               FROM prescriptions p
+               JOIN patients pt ON p.patient_id = pt.id
+               WHERE p.user_id = {PARAM} {keyset}
+               ORDER BY p.created_at DESC, p.id DESC
+               LIMIT {PARAM}"""
+
+def _similar_prescriptions_sql(term_count: int, by_user: bool) -> str:
+    # q holds one row per (query term, vocabulary term it matches); qid identifies the query term
+    query_values = ", ".join(["(" + _placeholders(4) + ")"] * term_count)
+    user_filter = f"WHERE pt.user_id = {PARAM}" if by_user else ""
+    return f"""WITH q (qid, term, kind, weight) AS (VALUES {query_values})
+               SELECT {prescription_columns('p')}, s.similarity_score, s.symptom_matches, s.condition_matches
+               FROM (
+                   SELECT m.prescription_id,
+                          SUM(CASE WHEN m.kind = 'symptom' THEN m.weight ELSE 0 END) AS symptom_matches,
+                          SUM(CASE WHEN m.kind = 'condition' THEN m.weight ELSE 0 END) AS condition_matches,
+                          SUM(CASE WHEN m.kind = 'symptom' THEN 2 * m.weight ELSE m.weight END) AS similarity_score
+                   FROM (
+                       SELECT DISTINCT pt.prescription_id, q.qid, q.kind, q.weight
+                       FROM q
+                       JOIN terms t ON t.term = q.term
+                       JOIN prescription_terms pt ON pt.term_id = t.id AND pt.kind = q.kind
+                       {user_filter}
+                   ) m
+                   GROUP BY m.prescription_id
+                   ORDER BY similarity_score DESC, m.prescription_id DESC
+                   LIMIT {PARAM}
+               ) s
+               JOIN prescriptions p ON p.id = s.prescription_id
+               ORDER BY s.similarity_score DESC, p.id DESC"""
+
+def _fuzzy_terms_sql(trigram_count: int) -> str:
+    # Vocabulary terms sharing trigrams with each query term, found through the trigram index;
+    # terms with too few or too many trigrams to ever reach the threshold are skipped
+    query_values = ", ".join(["(" + _placeholders(4) + ")"] * trigram_count)
+    return f"""WITH q (qid, trigram, min_count, max_count) AS (VALUES {query_values})
+               SELECT q.qid, t.term, t.trigram_count, COUNT(*) AS shared
+               FROM q
+               JOIN term_trigrams tt ON tt.trigram = q.trigram
+               JOIN terms t ON t.id = tt.term_id
+               WHERE t.trigram_count BETWEEN q.min_count AND q.max_count
+               GROUP BY q.qid, t.id, t.term, t.trigram_count"""
+
+# How a doctor recognises a returning patient: case-insensitive name and gender, same age and phone
+# (NULLs compare equal), so two people sharing a name, age and gender but not a phone stay apart
+PATIENT_IDENTITY = "user_id, lower(name), COALESCE(age, -1), lower(COALESCE(gender, '')), COALESCE(phone, '')"
+
+def _same_patient(a: str, b: str, phone: bool = False) -> str:
+    """Join condition matching two patients aliases with the same name, age and gender (and phone, if asked)"""
+    condition = (
+        f"{b}.user_id = {a}.user_id AND lower({b}.name) = lower({a}.name) "
+        f"AND COALESCE({b}.age, -1) = COALESCE({a}.age, -1) "
+        f"AND lower(COALESCE({b}.gender, '')) = lower(COALESCE({a}.gender, ''))"
+    )
+    if phone:
+        condition += f" AND COALESCE({b}.phone, '') = COALESCE({a}.phone, '')"
+    return condition
+
+def _match_patient(candidates: List[Dict], phone: Optional[str]) -> Optional[Dict]:
+    """Which of the patients sharing a name, age and gender (oldest first) is this one, or None for a new patient
+
+    A phone picks the patient with that phone, else the record without a phone if no one else has
+    one. Without a phone: the record without a phone, else the only record there is.
+    """
+    with_phone = [patient for patient in candidates if patient['phone']]
+    without_phone = [patient for patient in candidates if not patient['phone']]
+    if phone:
+        for patient in with_phone:
+            if patient['phone'] == phone:
+                return patient
+        return without_phone[0] if without_phone and not with_phone else None
+    if without_phone:
+        return without_phone[0]
+    return with_phone[0] if len(with_phone) == 1 else None
+
+def _find_patient_sql(phone: bool = False) -> str:
+    """The user's patients with a name, age and gender (and phone, if asked), oldest first"""
+    phone_filter = f"AND COALESCE(phone, '') = COALESCE({PARAM}, '')" if phone else ""
+    return f"""SELECT * FROM patients
+               WHERE user_id = {PARAM} AND lower(name) = lower({PARAM})
+               AND COALESCE(age, -1) = COALESCE({PARAM}, -1)
+               AND lower(COALESCE(gender, '')) = lower(COALESCE({PARAM}, ''))
+               {phone_filter}
+               ORDER BY id"""
+
+# Patient search: share of the query's trigrams a name or phone must contain (word similarity on PostgreSQL)
+PATIENT_SEARCH_THRESHOLD = float(os.getenv("PATIENT_SEARCH_THRESHOLD", "0.4"))
+PATIENT_SEARCH_INDEX = "idx_patients_name_trgm" if USE_POSTGRES else "idx_patient_trigrams"
+
+def patient_trigrams(name: str, phone: Optional[str]) -> set:
+    """Trigrams a patient is found by: those of the name and of the phone number"""
+    return term_trigrams(name) | term_trigrams(phone or "")
+
+def _patient_search(user_id: int, query: str, limit: int, offset: int, threshold: float) -> Tuple[str, tuple]:
+    """Ranked, typo-tolerant patient search statement and its parameters"""
+    if USE_POSTGRES:
+        # pg_trgm: word_similarity finds the query within longer names; phones match on a digit substring
+        digits = "".join(ch for ch in query if ch.isdigit())
+        phone_pattern = f"%{digits}%" if len(digits) >= 3 else None
+        sql = """SELECT *, GREATEST(word_similarity(%s, lower(name)), CASE WHEN phone LIKE %s THEN 1 ELSE 0 END) AS score
+                 FROM patients
+                 WHERE user_id = %s AND (%s <%% lower(name) OR phone LIKE %s)
+                 ORDER BY score DESC, length(name), id DESC
+                 LIMIT %s OFFSET %s"""
+        return sql, (query.lower(), phone_pattern, user_id, query.lower(), phone_pattern, limit, offset)
+    trigrams = sorted(term_trigrams(query))
+    sql = f"""WITH q (trigram) AS (VALUES {', '.join(['(?)'] * len(trigrams))})
+              SELECT p.*, CAST(m.shared AS REAL) / ? AS score
+              FROM (
+                  SELECT pt.patient_id, COUNT(*) AS shared
+                  FROM q JOIN patient_trigrams pt ON pt.user_id = ? AND pt.trigram = q.trigram
+                  GROUP BY pt.patient_id
+                  HAVING COUNT(*) >= ?
+              ) m
+              JOIN patients p ON p.id = m.patient_id
+              ORDER BY score DESC, length(p.name), p.id DESC
+              LIMIT ? OFFSET ?"""
+    min_shared = max(1, math.ceil(threshold * len(trigrams)))
+    return sql, (*trigrams, len(trigrams), user_id, min_shared, limit, offset)
+
+# (name, statement, sample parameters, index the plan must use)
+_SAMPLE_CURSOR = ["2024-01-01 00:00:00", 1]
+HOT_QUERIES = [
+    ("get_user_patients", _user_patients_sql(""), (1, 51), "idx_patients_user_created"),
+    ("get_user_patients (next page)", _user_patients_sql(_keyset_clause()), (1, *_SAMPLE_CURSOR, 51), "idx_patients_user_created"),
+    ("find_or_create_patient", _find_patient_sql(), (1, "Asha", 42, "Female"), "idx_patients_identity"),
+    ("search_patients", *_patient_search(1, "asha", 51, 0, PATIENT_SEARCH_THRESHOLD), PATIENT_SEARCH_INDEX),
+    ("get_patient_prescriptions", _patient_prescriptions_sql(""), (1, 1, 51), "idx_prescriptions_patient_created"),
+    ("get_patient_prescriptions (next page)", _patient_prescriptions_sql(_keyset_clause("prescriptions")), (1, 1, *_SAMPLE_CURSOR, 51), "idx_prescriptions_patient_created"),
+    ("get_user_prescriptions", _user_prescriptions_sql(""), (1, 51), "idx_prescriptions_user_created"),
+    ("get_user_prescriptions (next page)", _user_prescriptions_sql(_keyset_clause("p")), (1, *_SAMPLE_CURSOR, 51), "idx_prescriptions_user_created"),
+    ("find_similar_prescriptions", _similar_prescriptions_sql(2, True), (0, "cough", "symptom", 1, 1, "fever", "symptom", 1, 1, 5), "idx_prescription_terms_user_term"),
+    ("find_similar_prescriptions (all doctors)", _similar_prescriptions_sql(1, False), (0, "fever", "symptom", 1, 5), "idx_prescription_terms_term"),
+    ("find_similar_prescriptions (fuzzy terms)", _fuzzy_terms_sql(2), (0, "  f", 3, 12, 0, " fe", 3, 12), "idx_term_trigrams"),
+]
+
+# Advisory lock key serializing schema migrations across workers (PostgreSQL)
+MIGRATION_LOCK_ID = 7_301_946
+DB_VERIFY_QUERY_PLANS = os.getenv("DB_VERIFY_QUERY_PLANS", "true").lower() in ("1", "true", "yes")
 
 class Database:
     def __init__(self, db_path: str = "vidhya.db"):
         self.db_path = db_path
         self.db_url = DATABASE_URL
+        self.pool = self._create_pool()
+        self._user_change_hooks: List[Callable[[int], None]] = []
+        self.tfidf = TfidfEngine(self._load_term_features, TFIDF_REFRESH_SECONDS, TFIDF_INDEX_MAX_ENTRIES)
+        self._medicine_trie: Optional[PrefixTrie] = None
+        self._medicine_names: Dict[str, str] = {}
+        self._medicine_trie_built = float("-inf")
+        # Highest prescription id the trie was built from, and those above it already counted in memory
+        self._medicine_trie_upto = 0
+        self._medicine_trie_applied: Set[int] = set()
+        self._medicine_trie_lock = threading.Lock()
+        self.term_completer = TermCompleter(
+            self._load_term_counts, self._load_terms_since, word_starts,
+            TERM_INDEX_REFRESH_SECONDS, TERM_INDEX_MAX_ENTRIES, AUTOCOMPLETE_MAX_RESULTS
+        )
         self.init_db()
+        if DB_VERIFY_QUERY_PLANS:
+            for result in self.verify_query_plans():
+                if not result["uses_index"]:
+                    print(f"WARNING: {result['query']} does not use {result['index']}:\n{result['plan']}")
 
-    def get_connection(self):
+    def _create_pool(self):
         if USE_POSTGRES:
-            conn = psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
-            return conn
-        else:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            return ConnectionPool(
+                lambda: psycopg2.connect(self.db_url, cursor_factory=RealDictCursor),
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_idle=DB_POOL_MAX_IDLE,
+                validate=_ping_postgres
+            )
+        return ThreadLocalConnection(self._connect_sqlite)
+
+    def _connect_sqlite(self):
+        conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_COLNAMES)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_connection(self):
+        """Check a connection out of the pool (hand it back with release_connection)"""
+        return self.pool.acquire()
+
+    def release_connection(self, conn, discard: bool = False):
+        """Return a connection obtained from get_connection to the pool"""
+        self.pool.release(conn, discard=discard)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection, committing on success and rolling back on error"""
+        conn = self.pool.acquire()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.pool.release(conn, discard=broken)
+
+    def pool_stats(self) -> Dict:
+        """Connection pool occupancy and exhaustion counters"""
+        return self.pool.stats()
+
+    def close(self):
+        """Close the pooled connections (SQLite: this thread's; worker threads' close as the threads exit)"""
+        self.pool.close()
 
     def init_db(self):
-        """Initialize database tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Initialize database tables by applying any pending schema migrations"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+        # Each migration runs in its own transaction, serialized across workers starting together
+        for version, name, migrate in self._migrations():
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                self._lock_schema(conn, cursor)
+                cursor.execute(f"SELECT version FROM schema_migrations WHERE version = {PARAM}", (version,))
+                if cursor.fetchone():
+                    continue
+                migrate(cursor)
+                cursor.execute(
+                    f"INSERT INTO schema_migrations (version, name) VALUES ({PARAM}, {PARAM})",
+                    (version, name)
+                )
+                print(f"Applied database migration {version}: {name}")
+
+    def _migrations(self):
+        """Ordered (version, name, apply) schema migrations; never edit or reorder released ones"""
+        return [
+            (1, "baseline schema", self._migration_001_baseline),
+            (2, "indexes for hot query paths", self._migration_002_hot_path_indexes),
+            (3, "unique patient identity per doctor", self._migration_003_unique_patient_identity),
+            (4, "stored prescription documents", self._migration_004_prescription_documents),
+            (5, "trigram index over the term vocabulary", self._migration_005_term_trigrams),
+            (6, "medicine catalog usage counts", self._migration_006_medicine_catalog),
+            (7, "trigram index for patient search", self._migration_007_patient_search),
+        ]
 
+    def _lock_schema(self, conn, cursor):
+        """Take the migration lock for the current transaction"""
+        if USE_POSTGRES:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        elif not conn.in_transaction:
+            # Grab SQLite's write lock up front (DDL alone would not open a transaction)
+            cursor.execute("BEGIN IMMEDIATE")
+
+    def _migration_001_baseline(self, cursor):
+        """Tables as they existed before versioned migrations (idempotent on older databases)"""
         if USE_POSTGRES:
             # PostgreSQL syntax
             cursor.execute('''
@@ -68,18 +483,90 @@ class Database:
                     id SERIAL PRIMARY KEY,
                     user_id INTEGER NOT NULL,
                     patient_id INTEGER NOT NULL,
-                    symptoms TEXT NOT NULL,
-                    health_conditions TEXT,
+                    symptoms JSONB NOT NULL,
+                    health_conditions JSONB,
                     diagnosis_primary TEXT,
-                    diagnosis_secondary TEXT,
+                    diagnosis_secondary JSONB,
                     diagnosis_ayurvedic TEXT,
-                    medicines TEXT NOT NULL,
+                    medicines JSONB NOT NULL,
                     notes TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(id),
                     FOREIGN KEY (patient_id) REFERENCES patients(id)
                 )
             ''')
+
+            # Databases created before JSONB stored these columns as JSON text
+            cursor.execute(
+                """SELECT column_name FROM information_schema.columns
+                   WHERE table_name = 'prescriptions' AND data_type = 'text' AND column_name IN %s""",
+                (PRESCRIPTION_JSON_FIELDS,)
+            )
+            text_columns = [row['column_name'] for row in cursor.fetchall()]
+            if text_columns:
+                cursor.execute(
+                    "ALTER TABLE prescriptions " +
+                    ", ".join(f"ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb" for column in text_columns)
+                )
+
+            # GIN indexes for JSONB containment queries (e.g. symptoms @> '["fever"]')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_symptoms_gin ON prescriptions USING GIN (symptoms jsonb_path_ops)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_conditions_gin ON prescriptions USING GIN (health_conditions jsonb_path_ops)")
+
+            # Dictionary of normalized symptom/condition terms
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS terms (
+                    id SERIAL PRIMARY KEY,
+                    term TEXT UNIQUE NOT NULL
+                )
+            ''')
+
+            # Junction: prescription <-> term (kind is 'symptom' or 'condition')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prescription_terms (
+                    prescription_id INTEGER NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    kind VARCHAR(20) NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (prescription_id, kind, term_id),
+                    FOREIGN KEY (prescription_id) REFERENCES prescriptions(id),
+                    FOREIGN KEY (term_id) REFERENCES terms(id)
+                )
+            ''')
+
+            # Dictionary of medicines keyed on their normalized name
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS medicines (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    normalized_name TEXT UNIQUE NOT NULL
+                )
+            ''')
+
+            # Junction: prescription <-> medicine, in prescribed order
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prescription_medicines (
+                    prescription_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    medicine_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    dosage TEXT,
+                    timing TEXT,
+                    duration TEXT,
+                    PRIMARY KEY (prescription_id, position),
+                    FOREIGN KEY (prescription_id) REFERENCES prescriptions(id),
+                    FOREIGN KEY (medicine_id) REFERENCES medicines(id)
+                )
+            ''')
+
+            # Persistent tier of the LLM response cache (expires_at is a Unix timestamp)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    cache_key VARCHAR(64) PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL
+                )
+            ''')
         else:
             # SQLite syntax
             cursor.execute('''
@@ -125,344 +612,1221 @@ class Database:
                 )
             ''')
 
-        conn.commit()
-        conn.close()
+            # Dictionary of normalized symptom/condition terms
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS terms (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    term TEXT UNIQUE NOT NULL
+                )
+            ''')
+
+            # Junction: prescription <-> term (kind is 'symptom' or 'condition')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prescription_terms (
+                    prescription_id INTEGER NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (prescription_id, kind, term_id),
+                    FOREIGN KEY (prescription_id) REFERENCES prescriptions(id),
+                    FOREIGN KEY (term_id) REFERENCES terms(id)
+                )
+            ''')
+
+            # Dictionary of medicines keyed on their normalized name
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS medicines (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    normalized_name TEXT UNIQUE NOT NULL
+                )
+            ''')
+
+            # Junction: prescription <-> medicine, in prescribed order
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prescription_medicines (
+                    prescription_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    medicine_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    dosage TEXT,
+                    timing TEXT,
+                    duration TEXT,
+                    PRIMARY KEY (prescription_id, position),
+                    FOREIGN KEY (prescription_id) REFERENCES prescriptions(id),
+                    FOREIGN KEY (medicine_id) REFERENCES medicines(id)
+                )
+            ''')
+
+            # Persistent tier of the LLM response cache (expires_at is a Unix timestamp)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+        # Covering indexes for similarity scoring (per doctor and across all doctors)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescription_terms_user_term ON prescription_terms (user_id, term_id, kind, prescription_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescription_terms_term ON prescription_terms (term_id, kind, prescription_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescription_medicines_medicine ON prescription_medicines (medicine_id)")
+
+        self._backfill_normalized_prescriptions(cursor)
+
+    def _migration_002_hot_path_indexes(self, cursor):
+        """Composite indexes matching the WHERE/ORDER BY of every listing and lookup"""
+        # Patient listings: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_user_created ON patients (user_id, created_at, id)")
+        # Doctor's prescriptions (also drives the JOIN patients listing): WHERE user_id = ? ORDER BY created_at DESC, id DESC
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_user_created ON prescriptions (user_id, created_at, id)")
+        # Patient history: WHERE patient_id = ? AND user_id = ? ORDER BY created_at DESC, id DESC
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_patient_created ON prescriptions (patient_id, user_id, created_at, id)")
+        # LLM cache purge: WHERE expires_at <= ?
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)")
+
+    def _migration_003_unique_patient_identity(self, cursor):
+        """Merge duplicate patients into the oldest record, then enforce one record per identity
+
+        Records with different phones are different people and are kept (and reported); a record
+        without a phone joins the others only when they all have the same phone.
+        """
+        # Step 1: Give records without a phone the phone of the rest, if they agree on one
+        cursor.execute(f"""
+            UPDATE patients SET phone = (
+                SELECT MIN(d.phone) FROM patients d WHERE {_same_patient('patients', 'd')}
+            )
+            WHERE phone IS NULL AND (
+                SELECT COUNT(DISTINCT d.phone) FROM patients d WHERE {_same_patient('patients', 'd')}
+            ) = 1
+        """)
+        # Step 2: Report the look-alikes left apart because their phones differ
+        cursor.execute(f"""
+            SELECT d.id AS patient_id, d.phone, MIN(k.id) AS other_id
+            FROM patients d JOIN patients k ON {_same_patient('d', 'k')} AND k.id < d.id
+            WHERE COALESCE(k.phone, '') <> COALESCE(d.phone, '')
+            GROUP BY d.id, d.phone ORDER BY d.id
+        """)
+        for row in cursor.fetchall():
+            print(f"Keeping patient {row['patient_id']} (phone {row['phone'] or 'none'}) apart from patient "
+                  f"{row['other_id']}: same name, age and gender but a different phone")
+        # Step 3: Repoint prescriptions of duplicates at the oldest matching patient
+        cursor.execute(f"""
+            SELECT d.id AS duplicate_id, MIN(k.id) AS patient_id
+            FROM patients d JOIN patients k ON {_same_patient('d', 'k', phone=True)} AND k.id < d.id
+            GROUP BY d.id ORDER BY d.id
+        """)
+        for row in cursor.fetchall():
+            print(f"Merging duplicate patient {row['duplicate_id']} into patient {row['patient_id']}")
+        cursor.execute(f"""
+            UPDATE prescriptions SET patient_id = (
+                SELECT MIN(k.id) FROM patients d JOIN patients k ON {_same_patient('d', 'k', phone=True)}
+                WHERE d.id = prescriptions.patient_id
+            )
+            WHERE patient_id IN (
+                SELECT d.id FROM patients d JOIN patients k ON {_same_patient('d', 'k', phone=True)} AND k.id < d.id
+            )
+        """)
+        # Step 4: Drop the now unreferenced duplicates
+        cursor.execute(f"""
+            DELETE FROM patients WHERE EXISTS (
+                SELECT 1 FROM patients k WHERE {_same_patient('patients', 'k', phone=True)} AND k.id < patients.id
+            )
+        """)
+        # Step 5: Unique functional index backing find_or_create_patient
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_identity ON patients ({PATIENT_IDENTITY})")
+
+    def _migration_004_prescription_documents(self, cursor):
+        """Rendered prescription documents (zlib-compressed; HTML with its stylesheet inlined), one per prescription and format"""
+        if USE_POSTGRES:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prescription_documents (
+                    prescription_id INTEGER NOT NULL,
+                    format VARCHAR(10) NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    etag VARCHAR(64) NOT NULL,
+                    content BYTEA NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (prescription_id, format),
+                    FOREIGN KEY (prescription_id) REFERENCES prescriptions(id)
+                )
+            ''')
+        else:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prescription_documents (
+                    prescription_id INTEGER NOT NULL,
+                    format TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    etag TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (prescription_id, format),
+                    FOREIGN KEY (prescription_id) REFERENCES prescriptions(id)
+                )
+            ''')
+
+    def _migration_005_term_trigrams(self, cursor):
+        """Trigram postings for fuzzy symptom/condition matching, filled for the existing vocabulary"""
+        if 'trigram_count' not in self._table_columns(cursor, 'terms'):
+            cursor.execute("ALTER TABLE terms ADD COLUMN trigram_count INTEGER")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS term_trigrams (
+                trigram TEXT NOT NULL,
+                term_id INTEGER NOT NULL,
+                FOREIGN KEY (term_id) REFERENCES terms(id)
+            )
+        ''')
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_term_trigrams ON term_trigrams (trigram, term_id)")
+        cursor.execute("SELECT id, term FROM terms WHERE trigram_count IS NULL")
+        self._index_term_trigrams(cursor, {row['term']: row['id'] for row in cursor.fetchall()})
+
+    def _migration_006_medicine_catalog(self, cursor):
+        """Usage counts on the medicine dictionary, making it the autocomplete catalog"""
+        columns = self._table_columns(cursor, 'medicines')
+        for column in ('prescription_count', 'ai_suggestion_count'):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE medicines ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("""
+            UPDATE medicines SET prescription_count = (
+                SELECT COUNT(DISTINCT pm.prescription_id) FROM prescription_medicines pm WHERE pm.medicine_id = medicines.id
+            )
+        """)
+
+    def _migration_007_patient_search(self, cursor):
+        """Trigram indexes on patient name and phone: pg_trgm on PostgreSQL, a postings table on SQLite"""
+        if USE_POSTGRES:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_name_trgm ON patients USING gin (lower(name) gin_trgm_ops)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_phone_trgm ON patients USING gin (phone gin_trgm_ops)")
+            return
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS patient_trigrams (
+                user_id INTEGER NOT NULL,
+                trigram TEXT NOT NULL,
+                patient_id INTEGER NOT NULL,
+                FOREIGN KEY (patient_id) REFERENCES patients(id)
+            )
+        ''')
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_patient_trigrams ON patient_trigrams (user_id, trigram, patient_id)")
+        cursor.execute("SELECT id, user_id, name, phone FROM patients")
+        self._index_patients(cursor, [dict(row) for row in cursor.fetchall()])
+
+    def verify_query_plans(self) -> List[Dict]:
+        """EXPLAIN the module's hot statements and report whether each uses its intended index"""
+        results = []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                # Tiny tables make sequential scans cheapest; ask which plan is chosen when an index is usable
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, sql, params, index in HOT_QUERIES:
+                if USE_POSTGRES:
+                    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                    plan = json.dumps(cursor.fetchone()['QUERY PLAN'])
+                    uses_index = f'"Index Name": "{index}"' in plan
+                else:
+                    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                    plan = "\n".join(row['detail'] for row in cursor.fetchall())
+                    uses_index = f"INDEX {index} " in plan + " "
+                results.append({"query": name, "index": index, "uses_index": uses_index, "plan": plan})
+        return results
+
+    def _table_columns(self, cursor, table: str) -> set:
+        """Column names of an existing table (empty if it does not exist)"""
+        if USE_POSTGRES:
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = %s",
+                (table,)
+            )
+            return {row['column_name'] for row in cursor.fetchall()}
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {row['name'] for row in cursor.fetchall()}
+
+    def _backfill_normalized_prescriptions(self, cursor):
+        """Populate the term/medicine junction tables for prescriptions stored before they existed"""
+        cursor.execute(
+            f"SELECT {prescription_columns()} FROM prescriptions "
+            "WHERE id > (SELECT MIN(indexed) FROM ("
+            "  SELECT COALESCE(MAX(prescription_id), 0) AS indexed FROM prescription_terms"
+            "  UNION ALL"
+            "  SELECT COALESCE(MAX(prescription_id), 0) AS indexed FROM prescription_medicines"
+            ") watermarks) "
+            "ORDER BY id"
+        )
+        rows = cursor.fetchall()
+        # Runs inside migration 1, before term_trigrams and the catalog counts exist; migrations 5 and 6 fill them
+        self._store_normalized_prescriptions(cursor, [
+            (row['id'], row['user_id'], row['symptoms'], row['health_conditions'] or [], row['medicines'])
+            for row in rows
+        ], derived=False)
+
+    def _intern(self, cursor, table: str, column: str, values: List[str], display: Dict[str, str] = None) -> Dict[str, int]:
+        """Get-or-create dictionary rows, returning value -> id"""
+        if not values:
+            return {}
+        if display is None:
+            cursor.execute(
+                f"INSERT INTO {table} ({column}) VALUES {', '.join(['(' + PARAM + ')'] * len(values))} "
+                f"ON CONFLICT ({column}) DO NOTHING",
+                tuple(values)
+            )
+        else:
+            cursor.execute(
+                f"INSERT INTO {table} (name, {column}) VALUES {', '.join(['(' + _placeholders(2) + ')'] * len(values))} "
+                f"ON CONFLICT ({column}) DO NOTHING",
+                tuple(item for value in values for item in (display[value], value))
+            )
+        cursor.execute(
+            f"SELECT id, {column} FROM {table} WHERE {column} IN ({_placeholders(len(values))})",
+            tuple(values)
+        )
+        return {row[column]: row['id'] for row in cursor.fetchall()}
+
+    def _index_new_terms(self, cursor, term_ids: Dict[str, int]):
+        """Add trigram postings for any of these terms not indexed yet"""
+        cursor.execute(
+            f"SELECT id, term FROM terms WHERE id IN ({_placeholders(len(term_ids))}) AND trigram_count IS NULL",
+            tuple(term_ids.values())
+        )
+        self._index_term_trigrams(cursor, {row['term']: row['id'] for row in cursor.fetchall()})
+
+    def _index_term_trigrams(self, cursor, term_ids: Dict[str, int]):
+        if not term_ids:
+            return
+        postings = []
+        counts = []
+        for term, term_id in term_ids.items():
+            trigrams = term_trigrams(term)
+            postings.extend((trigram, term_id) for trigram in sorted(trigrams))
+            counts.append((len(trigrams), term_id))
+        if postings:
+            cursor.executemany(
+                f"INSERT INTO term_trigrams (trigram, term_id) VALUES ({_placeholders(2)}) ON CONFLICT DO NOTHING",
+                postings
+            )
+        cursor.executemany(f"UPDATE terms SET trigram_count = {PARAM} WHERE id = {PARAM}", counts)
+
+    def _store_normalized_prescription(self, cursor, prescription_id: int, user_id: int,
+                                       symptoms: List[str], health_conditions: List[str],
+                                       medicines: List[Dict]):
+        """Write a prescription's terms and medicines into the dictionary/junction tables"""
+        return self._store_normalized_prescriptions(
+            cursor, [(prescription_id, user_id, symptoms, health_conditions, medicines)]
+        )
+
+    def _store_normalized_prescriptions(self, cursor, prescriptions: List[Tuple], derived: bool = True) -> List[Tuple]:
+        """Batch form of _store_normalized_prescription over (id, user_id, symptoms, conditions, medicines)
+
+        Returns the (prescription_id, [(kind, term_id), ...]) features written, for the TF-IDF index.
+        """
+        term_rows = set()
+        medicine_rows = []
+        display = {}
+        for prescription_id, user_id, symptoms, health_conditions, medicines in prescriptions:
+            term_rows |= {(prescription_id, 'symptom', normalize_term(s), user_id) for s in symptoms}
+            term_rows |= {(prescription_id, 'condition', normalize_term(c), user_id) for c in health_conditions}
+            for position, med in enumerate(medicines):
+                name = (med.get('medicine_name') or med.get('name') or '').strip()
+                if name:
+                    display.setdefault(normalize_term(name), name)
+                    medicine_rows.append((prescription_id, position, normalize_term(name), user_id, med))
+
+        features = {prescription_id: [] for prescription_id, *_ in prescriptions}
+        if term_rows:
+            term_ids = self._intern(cursor, 'terms', 'term', sorted({term for _, _, term, _ in term_rows}))
+            if derived:
+                self._index_new_terms(cursor, term_ids)
+            cursor.executemany(
+                f"INSERT INTO prescription_terms (prescription_id, term_id, kind, user_id) VALUES ({_placeholders(4)}) "
+                "ON CONFLICT DO NOTHING",
+                [
+                    (prescription_id, term_ids[term], kind, user_id)
+                    for prescription_id, kind, term, user_id in sorted(term_rows)
+                ]
+            )
+            for prescription_id, kind, term, _ in term_rows:
+                features[prescription_id].append((kind, term_ids[term]))
+
+        if medicine_rows:
+            medicine_ids = self._intern(cursor, 'medicines', 'normalized_name', sorted(display), display)
+            cursor.executemany(
+                f"INSERT INTO prescription_medicines (prescription_id, position, medicine_id, user_id, dosage, timing, duration) "
+                f"VALUES ({_placeholders(7)}) ON CONFLICT DO NOTHING",
+                [
+                    (prescription_id, position, medicine_ids[normalized], user_id,
+                     med.get('dosage'), med.get('timing'), med.get('duration'))
+                    for prescription_id, position, normalized, user_id, med in medicine_rows
+                ]
+            )
+            if derived:
+                # Catalog usage: once per prescription, however often it lists the medicine
+                uses = {}
+                for prescription_id, normalized in {(row[0], row[2]) for row in medicine_rows}:
+                    uses[medicine_ids[normalized]] = uses.get(medicine_ids[normalized], 0) + 1
+                cursor.executemany(
+                    f"UPDATE medicines SET prescription_count = prescription_count + {PARAM} WHERE id = {PARAM}",
+                    [(count, medicine_id) for medicine_id, count in sorted(uses.items())]
+                )
+        return sorted(features.items())
+
+    def on_user_changed(self, hook: Callable[[int], None]):
+        """Register hook(user_id), called after a change to that user's record is committed"""
+        self._user_change_hooks.append(hook)
+
+    def _user_changed(self, user_id: int):
+        for hook in self._user_change_hooks:
+            try:
+                hook(user_id)
+            except Exception as e:
+                print(f"User change hook failed for user {user_id}: {e}")
 
     # User methods
     def create_user(self, email: str, password: str, name: str, phone: str = None, registration_number: str = None) -> Optional[int]:
         """Create a new user"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            if USE_POSTGRES:
-                cursor.execute(
-                    "INSERT INTO users (email, password, name, phone, registration_number) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                    (email, password, name, phone, registration_number)
-                )
-                user_id = cursor.fetchone()['id']
-            else:
-                cursor.execute(
-                    "INSERT INTO users (email, password, name, phone, registration_number) VALUES (?, ?, ?, ?, ?)",
-                    (email, password, name, phone, registration_number)
-                )
-                user_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                if USE_POSTGRES:
+                    cursor.execute(
+                        "INSERT INTO users (email, password, name, phone, registration_number) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                        (email, password, name, phone, registration_number)
+                    )
+                    user_id = cursor.fetchone()['id']
+                else:
+                    cursor.execute(
+                        "INSERT INTO users (email, password, name, phone, registration_number) VALUES (?, ?, ?, ?, ?)",
+                        (email, password, name, phone, registration_number)
+                    )
+                    user_id = cursor.lastrowid
             return user_id
         except (sqlite3.IntegrityError if not USE_POSTGRES else Exception):
             return None
 
     def get_user_by_email(self, email: str) -> Optional[Dict]:
         """Get user by email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        else:
-            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+            else:
+                cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         return None
 
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        else:
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+            else:
+                cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         return None
 
-    # Patient methods
-    def create_patient(self, user_id: int, name: str, age: int, gender: str, phone: str = None) -> int:
-        """Create a new patient"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute(
-                "INSERT INTO patients (user_id, name, age, gender, phone) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (user_id, name, age, gender, phone)
-            )
-            patient_id = cursor.fetchone()['id']
-        else:
+    def update_user_password(self, user_id: int, password: str):
+        """Replace a user's password hash"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "INSERT INTO patients (user_id, name, age, gender, phone) VALUES (?, ?, ?, ?, ?)",
-                (user_id, name, age, gender, phone)
+                f"UPDATE users SET password = {PARAM} WHERE id = {PARAM}",
+                (password, user_id)
             )
-            patient_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return patient_id
+        self._user_changed(user_id)
+
+    def list_users(self) -> List[Dict]:
+        """Get all users without their password hashes (admin/debug)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, email, name, phone, registration_number, created_at FROM users ORDER BY created_at DESC")
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+
+    # Patient methods
+    def find_or_create_patient(self, user_id: int, name: str, age: Optional[int], gender: Optional[str],
+                               phone: str = None) -> Tuple[Dict, bool]:
+        """Atomically get the user's patient with this name/age/gender (case-insensitive) or create it
+
+        Returns the patient and whether it was created. A phone no patient of that name, age and
+        gender has means a new patient, unless the only one has no phone yet: then it is recorded.
+        """
+        phone = phone or None
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_find_patient_sql(), (user_id, name, age, gender))
+            row = _match_patient([dict(candidate) for candidate in cursor.fetchall()], phone)
+            created = False
+            if row is None:
+                # A concurrent insert of the same patient makes this a no-op instead of a duplicate
+                cursor.execute(
+                    f"INSERT INTO patients (user_id, name, age, gender, phone) VALUES ({_placeholders(5)}) "
+                    f"ON CONFLICT ({PATIENT_IDENTITY}) DO NOTHING",
+                    (user_id, name, age, gender, phone)
+                )
+                created = cursor.rowcount == 1
+                cursor.execute(_find_patient_sql(phone=True), (user_id, name, age, gender, phone))
+                row = dict(cursor.fetchone())
+            elif phone and not row['phone']:
+                cursor.execute(f"UPDATE patients SET phone = {PARAM} WHERE id = {PARAM}", (phone, row['id']))
+                row['phone'] = phone
+            self._index_patients(cursor, [row])
+        return row, created
 
     def get_patient(self, patient_id: int, user_id: int) -> Optional[Dict]:
         """Get patient by ID (must belong to user)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute(
-                "SELECT * FROM patients WHERE id = %s AND user_id = %s",
-                (patient_id, user_id)
-            )
-        else:
-            cursor.execute(
-                "SELECT * FROM patients WHERE id = ? AND user_id = ?",
-                (patient_id, user_id)
-            )
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute(
+                    "SELECT * FROM patients WHERE id = %s AND user_id = %s",
+                    (patient_id, user_id)
+                )
+            else:
+                cursor.execute(
+                    "SELECT * FROM patients WHERE id = ? AND user_id = ?",
+                    (patient_id, user_id)
+                )
+            row = cursor.fetchone()
         if row:
             return dict(row)
         return None
 
-    def get_user_patients(self, user_id: int) -> List[Dict]:
-        """Get all patients for a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute(
-                "SELECT * FROM patients WHERE user_id = %s ORDER BY created_at DESC",
-                (user_id,)
-            )
-        else:
+    def get_user_patients(self, user_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                          after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's patients (newest first) and the cursor for the next page"""
+        page_size = _page_size(limit)
+        keyset, keyset_params = _keyset(after)
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "SELECT * FROM patients WHERE user_id = ? ORDER BY created_at DESC",
-                (user_id,)
+                _user_patients_sql(keyset),
+                (user_id, *keyset_params, page_size + 1)
             )
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+            rows = cursor.fetchall()
+        return _page(rows, page_size)
 
-    def search_patients(self, user_id: int, query: str) -> List[Dict]:
-        """Search patients by name"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute(
-                "SELECT * FROM patients WHERE user_id = %s AND name LIKE %s ORDER BY created_at DESC",
-                (user_id, f"%{query}%")
-            )
-        else:
-            cursor.execute(
-                "SELECT * FROM patients WHERE user_id = ? AND name LIKE ? ORDER BY created_at DESC",
-                (user_id, f"%{query}%")
-            )
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    def search_patients(self, user_id: int, query: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0,
+                        threshold: float = PATIENT_SEARCH_THRESHOLD) -> Tuple[List[Dict], Optional[int]]:
+        """One page of the user's patients whose name or phone resembles `query`, best match first
+
+        Matches survive typos and partial names ("rmesh" finds "Ramesh Kumar"). Returns the
+        page and the offset of the next one (None on the last page).
+        """
+        page_size = _page_size(limit)
+        query = query.strip()
+        if not term_trigrams(query):
+            return [], None
+        sql, params = _patient_search(user_id, query, page_size + 1, max(offset, 0), threshold)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute("SET LOCAL pg_trgm.word_similarity_threshold = %s", (threshold,))
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        items = [dict(row) for row in rows[:page_size]]
+        return items, (max(offset, 0) + page_size if len(rows) > page_size else None)
+
+    def _index_patients(self, cursor, patients: List[Dict]):
+        """Add trigram postings for these patients' names and phones (SQLite; pg_trgm indexes itself)"""
+        if USE_POSTGRES or not patients:
+            return
+        cursor.executemany(
+            "INSERT INTO patient_trigrams (user_id, trigram, patient_id) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+            sorted({
+                (patient['user_id'], trigram, patient['id'])
+                for patient in patients
+                for trigram in patient_trigrams(patient['name'], patient.get('phone'))
+            })
+        )
 
     # Prescription methods
     def create_prescription(self, user_id: int, patient_id: int, symptoms: List[str],
                            health_conditions: List[str], diagnosis: Dict,
-                           medicines: List[Dict], notes: str = None) -> int:
-        """Create a new prescription"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
-            cursor.execute(
-                """INSERT INTO prescriptions
-                   (user_id, patient_id, symptoms, health_conditions,
-                    diagnosis_primary, diagnosis_secondary, diagnosis_ayurvedic,
-                    medicines, notes)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
-                (
-                    user_id,
-                    patient_id,
-                    json.dumps(symptoms),
-                    json.dumps(health_conditions),
-                    diagnosis.get('primary_condition', ''),
-                    json.dumps(diagnosis.get('secondary_conditions', [])),
-                    diagnosis.get('ayurvedic_analysis', ''),
-                    json.dumps(medicines),
-                    notes
+                           medicines: List[Dict], notes: str = None, document_html: str = None) -> int:
+        """Create a new prescription (and store its rendered HTML, if given)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute(
+                    """INSERT INTO prescriptions
+                       (user_id, patient_id, symptoms, health_conditions,
+                        diagnosis_primary, diagnosis_secondary, diagnosis_ayurvedic,
+                        medicines, notes)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                    (
+                        user_id,
+                        patient_id,
+                        _json_param(symptoms),
+                        _json_param(health_conditions),
+                        diagnosis.get('primary_condition', ''),
+                        _json_param(diagnosis.get('secondary_conditions', [])),
+                        diagnosis.get('ayurvedic_analysis', ''),
+                        _json_param(medicines),
+                        notes
+                    )
                 )
+                prescription_id = cursor.fetchone()['id']
+            else:
+                cursor.execute(
+                    """INSERT INTO prescriptions
+                       (user_id, patient_id, symptoms, health_conditions,
+                        diagnosis_primary, diagnosis_secondary, diagnosis_ayurvedic,
+                        medicines, notes)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        user_id,
+                        patient_id,
+                        _json_param(symptoms),
+                        _json_param(health_conditions),
+                        diagnosis.get('primary_condition', ''),
+                        _json_param(diagnosis.get('secondary_conditions', [])),
+                        diagnosis.get('ayurvedic_analysis', ''),
+                        _json_param(medicines),
+                        notes
+                    )
+                )
+                prescription_id = cursor.lastrowid
+
+            # Keep the normalized term/medicine tables in step within the same transaction
+            features = self._store_normalized_prescription(
+                cursor, prescription_id, user_id, symptoms, health_conditions, medicines
             )
-            prescription_id = cursor.fetchone()['id']
-        else:
-            cursor.execute(
-                """INSERT INTO prescriptions
-                   (user_id, patient_id, symptoms, health_conditions,
-                    diagnosis_primary, diagnosis_secondary, diagnosis_ayurvedic,
-                    medicines, notes)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            if document_html is not None:
+                self._store_document(cursor, prescription_id, user_id, "html", document_html.encode("utf-8"))
+        # Only once committed, so a rolled-back insert never reaches the indexes
+        self.tfidf.add(user_id, features)
+        self._medicines_used([medicines], prescription_ids=[prescription_id])
+        self._terms_used(user_id, [(prescription_id, symptoms, health_conditions)])
+        return prescription_id
+
+    def create_prescriptions_batch(self, user_id: int, items: List[Dict]) -> List[Dict]:
+        """Find-or-create the patients and insert every item's prescription (and HTML) in one transaction"""
+        if not items:
+            return []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Step 1: Resolve every item to its patient through the identity index
+            patient_values = [
+                (user_id, item['patient_name'], item['patient_age'], item['patient_gender']) for item in items
+            ]
+            patients = self._match_batch_patients(cursor, patient_values)
+
+            # Step 2: Create the missing patients with one multi-row insert, then resolve those
+            missing = list(dict.fromkeys(patient_values[idx] for idx in range(len(items)) if idx not in patients))
+            if missing:
+                cursor.execute(
+                    f"INSERT INTO patients (user_id, name, age, gender) "
+                    f"VALUES {', '.join(['(' + _placeholders(4) + ')'] * len(missing))} "
+                    f"ON CONFLICT ({PATIENT_IDENTITY}) DO NOTHING",
+                    tuple(value for row in missing for value in row)
+                )
+                patients = self._match_batch_patients(cursor, patient_values)
+            self._index_patients(cursor, list({patient['id']: patient for patient in patients.values()}.values()))
+
+            # Step 3: Insert the prescriptions with one multi-row insert and work out their ids
+            columns = ("user_id, patient_id, symptoms, health_conditions, diagnosis_primary, "
+                       "diagnosis_secondary, diagnosis_ayurvedic, medicines, notes")
+            rows = [
                 (
                     user_id,
-                    patient_id,
-                    json.dumps(symptoms),
-                    json.dumps(health_conditions),
-                    diagnosis.get('primary_condition', ''),
-                    json.dumps(diagnosis.get('secondary_conditions', [])),
-                    diagnosis.get('ayurvedic_analysis', ''),
-                    json.dumps(medicines),
-                    notes
+                    patients[idx]['id'],
+                    _json_param(item['symptoms']),
+                    _json_param(item['health_conditions']),
+                    item['diagnosis'].get('primary_condition', ''),
+                    _json_param(item['diagnosis'].get('secondary_conditions', [])),
+                    item['diagnosis'].get('ayurvedic_analysis', ''),
+                    _json_param(item['medicines']),
+                    item.get('notes')
                 )
-            )
-            prescription_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return prescription_id
+                for idx, item in enumerate(items)
+            ]
+            if USE_POSTGRES:
+                # Reserve the ids up front so they map onto items regardless of insert order
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence('prescriptions', 'id')) AS id FROM generate_series(1, %s)",
+                    (len(items),)
+                )
+                prescription_ids = [row['id'] for row in cursor.fetchall()]
+                cursor.execute(
+                    f"INSERT INTO prescriptions (id, {columns}) VALUES "
+                    + ", ".join(["(" + _placeholders(10) + ")"] * len(items)),
+                    tuple(value for pid, row in zip(prescription_ids, rows) for value in (pid, *row))
+                )
+            else:
+                cursor.execute(
+                    f"INSERT INTO prescriptions ({columns}) VALUES "
+                    + ", ".join(["(" + _placeholders(9) + ")"] * len(items)),
+                    tuple(value for row in rows for value in row)
+                )
+                # The write lock is held, so one statement's AUTOINCREMENT ids are consecutive
+                first_id = cursor.lastrowid - len(items) + 1
+                prescription_ids = list(range(first_id, cursor.lastrowid + 1))
+
+            # Step 4: Normalized terms/medicines and rendered documents
+            features = self._store_normalized_prescriptions(cursor, [
+                (pid, user_id, item['symptoms'], item['health_conditions'], item['medicines'])
+                for pid, item in zip(prescription_ids, items)
+            ])
+            for pid, item in zip(prescription_ids, items):
+                if item.get('document_html') is not None:
+                    self._store_document(cursor, pid, user_id, "html", item['document_html'].encode("utf-8"))
+
+        self.tfidf.add(user_id, features)
+        self._medicines_used([item['medicines'] for item in items], prescription_ids=prescription_ids)
+        self._terms_used(user_id, [
+            (pid, item['symptoms'], item['health_conditions']) for pid, item in zip(prescription_ids, items)
+        ])
+        return [
+            {"prescription_id": pid, "patient": patients[idx]}
+            for idx, pid in enumerate(prescription_ids)
+        ]
 
     def get_prescription(self, prescription_id: int, user_id: int) -> Optional[Dict]:
         """Get prescription by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute(
+                    f"SELECT {prescription_columns()} FROM prescriptions WHERE id = %s AND user_id = %s",
+                    (prescription_id, user_id)
+                )
+            else:
+                cursor.execute(
+                    f"SELECT {prescription_columns()} FROM prescriptions WHERE id = ? AND user_id = ?",
+                    (prescription_id, user_id)
+                )
+            row = cursor.fetchone()
+        if row:
+            return dict(row)
+        return None
+
+    def get_printable_prescription(self, prescription_id: int, user_id: int) -> Optional[Dict]:
+        """Get a prescription with the patient and doctor details printed on it"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "SELECT * FROM prescriptions WHERE id = %s AND user_id = %s",
+                f"""SELECT {prescription_columns('p')}, pa.name as patient_name, pa.age as patient_age,
+                           pa.gender as patient_gender, u.name as doctor_name,
+                           u.registration_number as doctor_registration
+                    FROM prescriptions p
+                    JOIN patients pa ON pa.id = p.patient_id
+                    JOIN users u ON u.id = p.user_id
+                    WHERE p.id = {PARAM} AND p.user_id = {PARAM}""",
                 (prescription_id, user_id)
             )
-        else:
+            row = cursor.fetchone()
+        if row:
+            return dict(row)
+        return None
+
+    def _match_batch_patients(self, cursor, patient_values: List[Tuple]) -> Dict[int, Dict]:
+        """Item index -> patient for the (user_id, name, age, gender) items that match one (see _match_patient)"""
+        cursor.execute(
+            f"""WITH q (idx, user_id, name, age, gender) AS (
+                    VALUES {', '.join([f'({PARAM}, {PARAM}, {PARAM}, CAST({PARAM} AS INTEGER), {PARAM})'] * len(patient_values))}
+                )
+                SELECT q.idx AS item_index, p.* FROM q JOIN patients p ON {_same_patient('q', 'p')}
+                ORDER BY q.idx, p.id""",
+            tuple(value for idx, row in enumerate(patient_values) for value in (idx, *row))
+        )
+        candidates = {}
+        for row in cursor.fetchall():
+            row = dict(row)
+            candidates.setdefault(row.pop('item_index'), []).append(row)
+        patients = {}
+        for idx, found in candidates.items():
+            patient = _match_patient(found, None)
+            if patient is not None:
+                patients[idx] = patient
+        return patients
+
+    def _store_document(self, cursor, prescription_id: int, user_id: int, fmt: str, content: bytes):
+        """Insert a rendered document unless one is already stored (documents never change once written)"""
+        cursor.execute(
+            f"INSERT INTO prescription_documents (prescription_id, format, user_id, etag, content) "
+            f"VALUES ({_placeholders(5)}) ON CONFLICT (prescription_id, format) DO NOTHING",
+            (prescription_id, fmt, user_id, hashlib.sha256(content).hexdigest(), zlib.compress(content))
+        )
+
+    def save_prescription_document(self, prescription_id: int, user_id: int, fmt: str, content: bytes) -> Dict:
+        """Store a rendered document and return the stored one (an earlier concurrent save wins)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._store_document(cursor, prescription_id, user_id, fmt, content)
+        return self.get_prescription_document(prescription_id, user_id, fmt)
+
+    def get_prescription_document(self, prescription_id: int, user_id: int, fmt: str) -> Optional[Dict]:
+        """Get a stored document (etag and decompressed content) by primary key"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "SELECT * FROM prescriptions WHERE id = ? AND user_id = ?",
-                (prescription_id, user_id)
+                f"""SELECT etag, content FROM prescription_documents
+                    WHERE prescription_id = {PARAM} AND format = {PARAM} AND user_id = {PARAM}""",
+                (prescription_id, fmt, user_id)
             )
-        row = cursor.fetchone()
-        conn.close()
+            row = cursor.fetchone()
         if row:
-            data = dict(row)
-            # Parse JSON fields
-            data['symptoms'] = json.loads(data['symptoms'])
-            data['health_conditions'] = json.loads(data['health_conditions'])
-            data['diagnosis_secondary'] = json.loads(data['diagnosis_secondary'])
-            data['medicines'] = json.loads(data['medicines'])
-            return data
+            return {"etag": row['etag'], "content": zlib.decompress(bytes(row['content']))}
         return None
 
-    def get_patient_prescriptions(self, patient_id: int, user_id: int) -> List[Dict]:
-        """Get all prescriptions for a patient"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
+    def get_patient_prescriptions(self, patient_id: int, user_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                  after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's prescriptions (newest first) and the cursor for the next page"""
+        page_size = _page_size(limit)
+        keyset, keyset_params = _keyset(after, "prescriptions")
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                """SELECT * FROM prescriptions
-                   WHERE patient_id = %s AND user_id = %s
-                   ORDER BY created_at DESC""",
-                (patient_id, user_id)
+                _patient_prescriptions_sql(keyset),
+                (patient_id, user_id, *keyset_params, page_size + 1)
             )
-        else:
+            rows = cursor.fetchall()
+        return _page(rows, page_size)
+
+    def get_user_prescriptions(self, user_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                               after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's recent prescriptions and the cursor for the next page"""
+        page_size = _page_size(limit)
+        keyset, keyset_params = _keyset(after, "p")
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                """SELECT * FROM prescriptions
-                   WHERE patient_id = ? AND user_id = ?
-                   ORDER BY created_at DESC""",
-                (patient_id, user_id)
+                _user_prescriptions_sql(keyset),
+                (user_id, *keyset_params, page_size + 1)
             )
-        rows = cursor.fetchall()
-        conn.close()
-
-        prescriptions = []
-        for row in rows:
-            data = dict(row)
-            # Parse JSON fields
-            data['symptoms'] = json.loads(data['symptoms'])
-            data['health_conditions'] = json.loads(data['health_conditions'])
-            data['diagnosis_secondary'] = json.loads(data['diagnosis_secondary'])
-            data['medicines'] = json.loads(data['medicines'])
-            prescriptions.append(data)
-        return prescriptions
-
-    def get_user_prescriptions(self, user_id: int, limit: int = 50) -> List[Dict]:
-        """Get recent prescriptions for a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if USE_POSTGRES:
+            rows = cursor.fetchall()
+        return _page(rows, page_size)
+
+    def find_similar_prescriptions(self, symptoms: List[str], health_conditions: List[str],
+                                   user_id: int = None, limit: int = 10, fuzzy: bool = False,
+                                   threshold: float = FUZZY_MATCH_THRESHOLD, ranking: str = "overlap") -> List[Dict]:
+        """Find similar prescriptions based on symptoms and health conditions
+
+        With fuzzy=True a query term also matches stored terms whose trigram similarity
+        reaches `threshold` ("headache" ~ "head ache" ~ "headaches"), still counting once.
+        ranking="tfidf" scores by TF-IDF cosine similarity instead of weighted overlap, so
+        rare terms count for more than ones that appear on most prescriptions.
+        """
+        if ranking not in SIMILARITY_RANKINGS:
+            raise ValueError(f"Unknown ranking: {ranking}")
+        # Each distinct query term weighs as often as it was asked for
+        weights = {}
+        for s in symptoms:
+            key = (normalize_term(s), 'symptom')
+            weights[key] = weights.get(key, 0) + 1
+        for c in health_conditions:
+            key = (normalize_term(c), 'condition')
+            weights[key] = weights.get(key, 0) + 1
+        if not weights or limit <= 0:
+            return []
+
+        if ranking == "tfidf":
+            return self._rank_tfidf(weights, user_id, limit, fuzzy, threshold)
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            queries = sorted(weights.items())
+            matches = {}
+            if fuzzy:
+                with similarity_stage_seconds.time("overlap", "match_terms"):
+                    matches = self._fuzzy_match_terms(cursor, [term for (term, _), _ in queries], threshold)
+            params = []
+            rows_in_q = 0
+            for qid, ((term, kind), weight) in enumerate(queries):
+                for matched in sorted(matches.get(term, set()) | {term}):
+                    params.extend((qid, matched, kind, weight))
+                    rows_in_q += 1
+            if user_id:
+                params.append(user_id)
+            params.append(limit)
+
+            # Score in SQL (weighted: symptoms more important), newest first on ties
+            with similarity_stage_seconds.time("overlap", "score"):
+                cursor.execute(_similar_prescriptions_sql(rows_in_q, bool(user_id)), tuple(params))
+            with similarity_stage_seconds.time("overlap", "fetch"):
+                rows = [dict(row) for row in cursor.fetchall()]
+
+        return rows
+
+    def _rank_tfidf(self, weights: Dict[Tuple[str, str], int], user_id: Optional[int], limit: int,
+                    fuzzy: bool, threshold: float) -> List[Dict]:
+        """find_similar_prescriptions ranked by cosine similarity against the in-memory TF-IDF index"""
+        # Step 1: Resolve query terms (and their fuzzy matches) to vocabulary ids
+        with self.connection() as conn, similarity_stage_seconds.time("tfidf", "match_terms"):
+            cursor = conn.cursor()
+            queries = sorted(weights.items())
+            matches = self._fuzzy_match_terms(cursor, [term for (term, _), _ in queries], threshold) if fuzzy else {}
+            expanded = [
+                (matched, kind, weight)
+                for (term, kind), weight in queries
+                for matched in sorted(matches.get(term, set()) | {term})
+            ]
+            vocabulary = sorted({term for term, _, _ in expanded})
             cursor.execute(
-                """SELECT p.*, pt.name as patient_name, pt.age as patient_age, pt.gender as patient_gender
-                   FROM prescriptions p
-                   JOIN patients pt ON p.patient_id = pt.id
-                   WHERE p.user_id = %s
-                   ORDER BY p.created_at DESC
-                   LIMIT %s""",
-                (user_id, limit)
+                f"SELECT id, term FROM terms WHERE term IN ({_placeholders(len(vocabulary))})",
+                tuple(vocabulary)
             )
-        else:
+            term_ids = {row['term']: row['id'] for row in cursor.fetchall()}
+        query = {}
+        for term, kind, weight in expanded:
+            if term in term_ids:
+                feature = (kind, term_ids[term])
+                query[feature] = query.get(feature, 0) + weight
+        if not query:
+            return []
+
+        # Step 2: Score against the doctor's index (loaded on first use)
+        with similarity_stage_seconds.time("tfidf", "load_index"):
+            index = self.tfidf.index(user_id or None)
+        with similarity_stage_seconds.time("tfidf", "score"):
+            ranked = index.rank(query, limit)
+        if not ranked:
+            return []
+
+        # Step 3: Fetch the winning prescriptions in rank order
+        with self.connection() as conn, similarity_stage_seconds.time("tfidf", "fetch"):
+            cursor = conn.cursor()
             cursor.execute(
-                """SELECT p.*, pt.name as patient_name, pt.age as patient_age, pt.gender as patient_gender
-                   FROM prescriptions p
-                   JOIN patients pt ON p.patient_id = pt.id
-                   WHERE p.user_id = ?
-                   ORDER BY p.created_at DESC
-                   LIMIT ?""",
-                (user_id, limit)
+                f"SELECT {prescription_columns()} FROM prescriptions WHERE id IN ({_placeholders(len(ranked))})",
+                tuple(prescription_id for prescription_id, _, _, _ in ranked)
             )
-        rows = cursor.fetchall()
-        conn.close()
-
-        prescriptions = []
-        for row in rows:
-            data = dict(row)
-            # Parse JSON fields
-            data['symptoms'] = json.loads(data['symptoms'])
-            data['health_conditions'] = json.loads(data['health_conditions'])
-            data['diagnosis_secondary'] = json.loads(data['diagnosis_secondary'])
-            data['medicines'] = json.loads(data['medicines'])
-            prescriptions.append(data)
-        return prescriptions
+            rows = {row['id']: dict(row) for row in cursor.fetchall()}
+        return [
+            {**rows[prescription_id], "similarity_score": round(score, 4),
+             "symptom_matches": symptom_matches, "condition_matches": condition_matches}
+            for prescription_id, score, symptom_matches, condition_matches in ranked
+            if prescription_id in rows
+        ]
 
-    def find_similar_prescriptions(self, symptoms: List[str], health_conditions: List[str],
-                                   user_id: int = None, limit: int = 10) -> List[Dict]:
-        """Find similar prescriptions based on symptoms and health conditions"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _load_term_features(self, user_id: Optional[int], after_id: int):
+        """Yield (prescription_id, term_id, kind) past `after_id`, by prescription, to build a TF-IDF index"""
+        user_filter = f"user_id = {PARAM} AND " if user_id else ""
+        params = (user_id, after_id) if user_id else (after_id,)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT prescription_id, term_id, kind FROM prescription_terms "
+                f"WHERE {user_filter}prescription_id > {PARAM} ORDER BY prescription_id",
+                params
+            )
+            while True:
+                batch = cursor.fetchmany(10000)
+                if not batch:
+                    break
+                for row in batch:
+                    yield row['prescription_id'], row['term_id'], row['kind']
+
+    def _fuzzy_match_terms(self, cursor, terms: List[str], threshold: float) -> Dict[str, set]:
+        """Stored vocabulary terms within `threshold` trigram similarity of each query term"""
+        query_trigrams = {term: term_trigrams(term) for term in set(terms)}
+        ordered = [term for term in sorted(query_trigrams) if query_trigrams[term]]
+        params = []
+        for qid, term in enumerate(ordered):
+            size = len(query_trigrams[term])
+            # Jaccard >= threshold needs threshold * size <= other size <= size / threshold
+            min_count, max_count = int(threshold * size), int(size / threshold) + 1
+            for trigram in sorted(query_trigrams[term]):
+                params.extend((qid, trigram, min_count, max_count))
+        if not params:
+            return {}
+        cursor.execute(_fuzzy_terms_sql(len(params) // 4), tuple(params))
+        matches = {}
+        for row in cursor.fetchall():
+            term = ordered[row['qid']]
+            # Jaccard similarity of the two trigram sets
+            union = len(query_trigrams[term]) + row['trigram_count'] - row['shared']
+            if row['shared'] / union >= threshold:
+                matches.setdefault(term, set()).add(row['term'])
+        return matches
+
+    # Medicine catalog methods
+    def record_ai_medicines(self, names: List[str]):
+        """Add AI-suggested medicines to the catalog, counting one more suggestion for each"""
+        display = {}
+        for name in names:
+            if name and name.strip():
+                display.setdefault(normalize_term(name), name.strip())
+        if not display:
+            return
+        # Suggestions carry no id to tell whether a rebuild has read them, so none may run until the trie is bumped
+        with self._medicine_trie_lock:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                medicine_ids = self._intern(cursor, 'medicines', 'normalized_name', sorted(display), display)
+                cursor.execute(
+                    f"UPDATE medicines SET ai_suggestion_count = ai_suggestion_count + 1 "
+                    f"WHERE id IN ({_placeholders(len(medicine_ids))})",
+                    tuple(sorted(medicine_ids.values()))
+                )
+            self._bump_medicine_trie({normalized: (0, 1) for normalized in display}, display)
+
+    def autocomplete_medicines(self, prefix: str, limit: int = AUTOCOMPLETE_MAX_RESULTS) -> List[Dict]:
+        """Catalog medicines with a word starting with `prefix`, most prescribed (then suggested) first"""
+        prefix = normalize_term(prefix)
+        if not prefix:
+            return []
+        trie = self._medicine_catalog()
+        return [
+            {
+                "name": self._medicine_names[normalized],
+                "prescription_count": prescription_count,
+                "ai_suggestion_count": ai_suggestion_count,
+                "source": "historical" if prescription_count else "ai"
+            }
+            for normalized, (prescription_count, ai_suggestion_count) in trie.complete(prefix, limit)
+        ]
+
+    def _medicine_catalog(self) -> PrefixTrie:
+        """The catalog's autocomplete trie, rebuilt from the table every MEDICINE_CATALOG_REFRESH_SECONDS
+
+        Between rebuilds it is kept current by this process's own writes; the rebuild brings
+        in other workers' writes.
+        """
+        with self._medicine_trie_lock:
+            if time.monotonic() - self._medicine_trie_built < MEDICINE_CATALOG_REFRESH_SECONDS:
+                return self._medicine_trie
+            started = time.monotonic()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                # One statement, so the counts and the last prescription id come from the same snapshot
+                cursor.execute("""
+                    SELECT m.name, m.normalized_name, m.prescription_count, m.ai_suggestion_count, u.upto
+                    FROM (SELECT COALESCE(MAX(id), 0) AS upto FROM prescriptions) u
+                    LEFT JOIN medicines m ON 1 = 1
+                """)
+                rows = cursor.fetchall()
+            upto = rows[0]['upto']
+            rows = [row for row in rows if row['normalized_name'] is not None]
+            trie = PrefixTrie.build(
+                (
+                    (row['normalized_name'], (row['prescription_count'], row['ai_suggestion_count']),
+                     word_starts(row['normalized_name']))
+                    for row in rows
+                ),
+                k=AUTOCOMPLETE_MAX_RESULTS
+            )
+            names = {row['normalized_name']: row['name'] for row in rows}
+            self._medicine_trie, self._medicine_names = trie, names
+            self._medicine_trie_upto = upto
+            self._medicine_trie_applied = {pid for pid in self._medicine_trie_applied if pid > upto}
+            self._medicine_trie_built = started
+            return trie
+
+    def _medicines_used(self, medicine_lists: List[List[Dict]], prescription_ids: List[int]):
+        """Count committed prescriptions' medicines in the autocomplete trie, unless its last rebuild already read them"""
+        if self._medicine_trie is None:
+            return
+        with self._medicine_trie_lock:
+            display, uses = {}, {}
+            for pid, medicines in zip(prescription_ids, medicine_lists):
+                if pid <= self._medicine_trie_upto or pid in self._medicine_trie_applied:
+                    continue
+                self._medicine_trie_applied.add(pid)
+                listed = set()
+                for med in medicines:
+                    name = (med.get('medicine_name') or med.get('name') or '').strip()
+                    if name:
+                        display.setdefault(normalize_term(name), name)
+                        listed.add(normalize_term(name))
+                for normalized in listed:
+                    uses[normalized] = uses.get(normalized, 0) + 1
+            self._bump_medicine_trie({normalized: (count, 0) for normalized, count in uses.items()}, display)
+
+    def _bump_medicine_trie(self, increments: Dict[str, Tuple[int, int]], display: Dict[str, str]):
+        """Add (prescriptions, suggestions) to each normalized name's score (caller holds _medicine_trie_lock)"""
+        trie = self._medicine_trie
+        if trie is None:
+            return
+        for normalized, (prescriptions, suggestions) in increments.items():
+            self._medicine_names.setdefault(normalized, display[normalized])
+            prescription_count, ai_suggestion_count = trie.score(normalized, (0, 0))
+            trie.update(
+                normalized,
+                (prescription_count + prescriptions, ai_suggestion_count + suggestions),
+                word_starts(normalized)
+            )
+
+    # Symptom/condition autocomplete methods
+    def autocomplete_terms(self, prefix: str, kind: str, user_id: int = None,
+                           limit: int = AUTOCOMPLETE_MAX_RESULTS) -> List[Dict]:
+        """Symptoms or conditions with a word starting with `prefix`, most used first
+
+        Completes from one doctor's prescriptions, or from every doctor's with user_id=None.
+        """
+        if kind not in TERM_KINDS:
+            raise ValueError(f"Unknown term kind: {kind}")
+        prefix = normalize_term(prefix)
+        if not prefix:
+            return []
+        return [
+            {"term": term, "count": count}
+            for term, count in self.term_completer.complete(user_id, kind, prefix, limit)
+        ]
+
+    def _load_term_counts(self, user_id: Optional[int], kind: str) -> List[Tuple[str, int, int]]:
+        """(term, prescriptions using it, newest such prescription id) to build an autocomplete trie"""
+        user_filter = f" AND pt.user_id = {PARAM}" if user_id else ""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""SELECT t.term, COUNT(*) AS uses, MAX(pt.prescription_id) AS last_id
+                    FROM prescription_terms pt
+                    JOIN terms t ON t.id = pt.term_id
+                    WHERE pt.kind = {PARAM}{user_filter}
+                    GROUP BY t.id, t.term""",
+                (kind, user_id) if user_id else (kind,)
+            )
+            return [(row['term'], row['uses'], row['last_id']) for row in cursor.fetchall()]
+
+    def _load_terms_since(self, user_id: Optional[int], kind: str, after_id: int) -> List[Tuple[int, str]]:
+        """(prescription_id, term) written after `after_id`, to bring an autocomplete trie up to date"""
+        user_filter = f" AND pt.user_id = {PARAM}" if user_id else ""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""SELECT pt.prescription_id, t.term
+                    FROM prescription_terms pt
+                    JOIN terms t ON t.id = pt.term_id
+                    WHERE pt.prescription_id > {PARAM} AND pt.kind = {PARAM}{user_filter}""",
+                (after_id, kind, user_id) if user_id else (after_id, kind)
+            )
+            return [(row['prescription_id'], row['term']) for row in cursor.fetchall()]
+
+    def _terms_used(self, user_id: int, prescriptions: List[Tuple[int, List[str], List[str]]]):
+        """Count a doctor's committed (id, symptoms, conditions) in the autocomplete tries already built"""
+        rows = set()
+        for prescription_id, symptoms, health_conditions in prescriptions:
+            rows |= {(prescription_id, 'symptom', normalize_term(t)) for t in symptoms}
+            rows |= {(prescription_id, 'condition', normalize_term(t)) for t in health_conditions}
+        self.term_completer.add(user_id, sorted(rows))
 
-        # Get all prescriptions (optionally filtered by user)
-        if user_id:
+    # LLM response cache methods
+    def get_llm_cache(self, cache_key: str) -> Optional[Dict]:
+        """Get a cached LLM response (with its expiry) that has not expired"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
             if USE_POSTGRES:
                 cursor.execute(
-                    """SELECT * FROM prescriptions WHERE user_id = %s ORDER BY created_at DESC""",
-                    (user_id,)
+                    "SELECT response, expires_at FROM llm_cache WHERE cache_key = %s AND expires_at > %s",
+                    (cache_key, time.time())
                 )
             else:
                 cursor.execute(
-                    """SELECT * FROM prescriptions WHERE user_id = ? ORDER BY created_at DESC""",
-                    (user_id,)
+                    "SELECT response, expires_at FROM llm_cache WHERE cache_key = ? AND expires_at > ?",
+                    (cache_key, time.time())
                 )
-        else:
-            cursor.execute("SELECT * FROM prescriptions ORDER BY created_at DESC")
+            row = cursor.fetchone()
+        if row:
+            return dict(row)
+        return None
 
-        rows = cursor.fetchall()
-        conn.close()
+    def set_llm_cache(self, cache_key: str, response: str, ttl: float):
+        """Store (or refresh) an LLM response for `ttl` seconds"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute(
+                    """INSERT INTO llm_cache (cache_key, response, expires_at) VALUES (%s, %s, %s)
+                       ON CONFLICT (cache_key) DO UPDATE SET response = excluded.response, expires_at = excluded.expires_at""",
+                    (cache_key, response, time.time() + ttl)
+                )
+            else:
+                cursor.execute(
+                    """INSERT INTO llm_cache (cache_key, response, expires_at) VALUES (?, ?, ?)
+                       ON CONFLICT (cache_key) DO UPDATE SET response = excluded.response, expires_at = excluded.expires_at""",
+                    (cache_key, response, time.time() + ttl)
+                )
 
-        # Calculate similarity scores
-        similar_prescriptions = []
-        symptoms_lower = [s.lower().strip() for s in symptoms]
-        conditions_lower = [c.lower().strip() for c in health_conditions]
+    def purge_llm_cache(self) -> int:
+        """Delete expired LLM responses"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if USE_POSTGRES:
+                cursor.execute("DELETE FROM llm_cache WHERE expires_at <= %s", (time.time(),))
+            else:
+                cursor.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
 
-        for row in rows:
-            data = dict(row)
-            # Parse JSON fields
-            data['symptoms'] = json.loads(data['symptoms'])
-            data['health_conditions'] = json.loads(data['health_conditions'])
-            data['diagnosis_secondary'] = json.loads(data['diagnosis_secondary'])
-            data['medicines'] = json.loads(data['medicines'])
+class AsyncDatabase:
+    """Awaitable view of Database: every public method runs on a bounded worker thread pool"""
 
-            # Calculate similarity score
-            prescription_symptoms = [s.lower().strip() for s in data['symptoms']]
-            prescription_conditions = [c.lower().strip() for c in data['health_conditions']]
+    # Connection handles must stay on the thread that borrowed them
+    _SYNC_ONLY = {"connection", "get_connection", "release_connection", "pool_stats", "on_user_changed"}
 
-            # Count matching symptoms
-            symptom_matches = sum(1 for s in symptoms_lower if s in prescription_symptoms)
-            # Count matching conditions
-            condition_matches = sum(1 for c in conditions_lower if c in prescription_conditions)
+    def __init__(self, database: Database, max_workers: int = DB_EXECUTOR_WORKERS):
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self.similar_flight = SingleFlight()
 
-            # Calculate total similarity (weighted: symptoms more important)
-            total_score = (symptom_matches * 2) + condition_matches
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if name.startswith("_") or name in self._SYNC_ONLY or not callable(attr):
+            return attr
 
-            if total_score > 0:  # Only include if there's at least one match
-                data['similarity_score'] = total_score
-                data['symptom_matches'] = symptom_matches
-                data['condition_matches'] = condition_matches
-                similar_prescriptions.append(data)
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, self._timed, name, functools.partial(attr, *args, **kwargs), time.perf_counter(),
+                current_profile.get()
+            )
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+
+    async def find_similar_prescriptions(self, symptoms: List[str], health_conditions: List[str],
+                                         user_id: int = None, limit: int = 10, fuzzy: bool = False,
+                                         threshold: float = FUZZY_MATCH_THRESHOLD, ranking: str = "overlap") -> List[Dict]:
+        """Coalesced find_similar_prescriptions: identical concurrent searches share one query
 
-        # Sort by similarity score (highest first)
-        similar_prescriptions.sort(key=lambda x: x['similarity_score'], reverse=True)
+        The returned list may be shared between callers and must be treated as read-only.
+        """
+        key = (
+            user_id,
+            limit,
+            ranking,
+            threshold if fuzzy else None,
+            tuple(sorted(normalize_term(s) for s in symptoms)),
+            tuple(sorted(normalize_term(c) for c in health_conditions))
+        )
+        loop = asyncio.get_running_loop()
+        return await self.similar_flight.do(
+            key,
+            loop.run_in_executor,
+            self.executor,
+            self._timed,
+            "find_similar_prescriptions",
+            functools.partial(
+                self.database.find_similar_prescriptions, symptoms, health_conditions, user_id, limit, fuzzy, threshold,
+                ranking
+            ),
+            time.perf_counter(),
+            current_profile.get()
+        )
+
+    @staticmethod
+    def _timed(method: str, func: Callable, queued_at: float, profile=None):
+        """Run a Database call on a worker thread, recording its queueing and run time (and profile, if sampled)"""
+        started = time.perf_counter()
+        db_executor_wait_seconds.labels(method).observe(started - queued_at)
+        try:
+            if profile is not None:
+                return profile.run_in_thread(f"db.{method}", func)
+            return func()
+        finally:
+            db_call_seconds.labels(method).observe(time.perf_counter() - started)
 
-        return similar_prescriptions[:limit]
+    def shutdown(self):
+        """Stop the worker threads once in-flight calls finish, then close the connection pool"""
+        self.executor.shutdown(wait=True)
+        self.database.close()
 
 # Global database instance
 db = Database()
+adb = AsyncDatabase(db)
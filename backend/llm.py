@@ -0,0 +1,337 @@
+import copy
+import hashlib
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, List, Tuple
+from openai import AsyncOpenAI
+from cache import SingleFlight, TTLCache
+from database import adb, normalize_term
+from metrics import registry
+from profiling import record_offloaded
+
+# Initialize OpenAI client
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+MEDICINE_MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are an expert Ayurvedic doctor. Always respond with valid JSON only."
+
+# Medicine suggestion cache: in-process LRU tier plus an optional tier in the database shared by all workers
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_PERSISTENT = os.getenv("LLM_CACHE_PERSISTENT", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PURGE_EVERY = 100  # persistent writes between purges of expired rows
+
+suggestion_cache = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL)
+persistent_cache_stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+# Identical suggestion requests arriving together share one cache lookup / completion
+suggestion_flight = SingleFlight()
+
+llm_request_seconds = registry.histogram(
+    "vidhya_llm_request_seconds", "OpenAI completion latency (streamed: until the last chunk)", ("model", "mode")
+)
+llm_first_token_seconds = registry.histogram(
+    "vidhya_llm_first_token_seconds", "Time until a streamed completion produced its first content", ("model",)
+)
+llm_tokens = registry.counter("vidhya_llm_tokens_total", "Tokens used by OpenAI completions", ("model", "kind"))
+
+def record_usage(usage):
+    """Count the prompt and completion tokens OpenAI reports for a completion"""
+    if usage is None:
+        return
+    llm_tokens.labels(MEDICINE_MODEL, "prompt").inc(usage.prompt_tokens)
+    llm_tokens.labels(MEDICINE_MODEL, "completion").inc(usage.completion_tokens)
+
+def suggestion_cache_key(symptoms: List[str], health_conditions: List[str], count: int) -> str:
+    """Cache key for the canonical (sorted, lowercased, trimmed) symptom/condition sets and count"""
+    canonical = {
+        "symptoms": sorted({normalize_term(s) for s in symptoms} - {""}),
+        "health_conditions": sorted({normalize_term(c) for c in health_conditions} - {""}),
+        "count": count,
+    }
+    return hashlib.sha256(json.dumps(canonical, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def build_medicine_prompt(symptoms: List[str], health_conditions: List[str], count: int) -> str:
+    """Prompt asking for a diagnosis and `count` Ayurvedic medicines"""
+    return f"""You are an expert Ayurvedic doctor. Based on the following patient information, first diagnose the possible disease(s), then suggest appropriate Ayurvedic medicines.
+
+Symptoms: {', '.join(symptoms)}
+Health Conditions: {', '.join(health_conditions)}
+
+STEP 1: DIAGNOSIS
+Based on the symptoms, provide:
+1. Primary possible disease/condition (most likely)
+2. Secondary possible diseases (if applicable)
+3. Brief explanation in Ayurvedic terms (Vata/Pitta/Kapha imbalance if relevant)
+
+STEP 2: MEDICINE RECOMMENDATIONS
+Please provide EXACTLY 8 Ayurvedic medicines (both proprietary branded and classical formulations) that would be appropriate for the diagnosed condition and symptoms.
+
+IMPORTANT GUIDELINES:
+- Include PROPRIETARY BRANDED medicines from companies like:
+  * Acharya Shushruta (e.g vahinil)
+  * Himalaya (e.g., Liv.52, Mentat, Brahmi, Ashvagandha)
+  * Dabur (e.g., Chyawanprash, Honitus, Stresscom)
+  * Baidyanath (e.g., Kesari Kalp, Ashwagandharishta, Brahmi Vati)
+  * Patanjali (e.g., Divya medicines)
+  * Zandu (e.g., Pancharishta, Chyawanprash)
+  * Other well-known brands
+- Also include CLASSICAL Ayurvedic formulations (e.g., Triphala, Dashamularishta, Ashwagandharishta)
+- Each medicine should be a POLYHERBAL/MULTI-INGREDIENT FORMULATION (combination of multiple herbs/drugs)
+- Include the brand name AND main constituent herbs/drugs in the description
+- Focus on medicines commonly prescribed and easily available in the market
+- Provide a good mix of different dosage forms: tablets, syrups, churnas (powders), capsules, etc.
+
+For each medicine, provide:
+1. Brand/Product name with company if proprietary (e.g., "Himalaya Liv.52", "Dabur Chyawanprash", or "Triphala Churna")
+2. Brief description including main herbs/constituents and what it treats
+3. Recommended dosage with specific form (tablets, syrup, churna, capsules)
+4. Best timing to take (e.g., "Before meals", "After meals", "Before bedtime")
+5. Any important precautions or contraindications
+
+Format your response as a JSON object with diagnosis and medicines:
+{{
+  "diagnosis": {{
+    "primary_condition": "Primary disease/condition name",
+    "secondary_conditions": ["Secondary condition 1", "Secondary condition 2"],
+    "ayurvedic_analysis": "Brief explanation of dosha imbalance and Ayurvedic perspective"
+  }},
+  "medicines": [
+    {{
+      "name": "Brand/Company Name + Product Name (if branded)",
+      "description": "What it treats, benefits, and key ingredients/herbs",
+      "recommended_dosage": "Specific dosage with form (e.g., 2 tablets, 10ml syrup, 3g churna)",
+      "timing": "When to take",
+      "precautions": "Important precautions if any"
+    }}
+  ]
+}}
+
+IMPORTANT: Return ONLY the JSON object with diagnosis and EXACTLY {count} medicines, no additional text."""
+
+def parse_suggestion(response_text: str) -> Dict:
+    """Extract the diagnosis and medicines from a model response"""
+    # Extract JSON from response
+    start_idx = response_text.find('{')
+    end_idx = response_text.rfind('}') + 1
+    json_text = response_text[start_idx:end_idx]
+
+    result = json.loads(json_text)
+    return {
+        "diagnosis": result.get("diagnosis", {}),
+        "medicines": result.get("medicines", []),
+    }
+
+async def _load_persistent(cache_key: str):
+    try:
+        stored = await adb.get_llm_cache(cache_key)
+    except Exception as e:
+        persistent_cache_stats["errors"] += 1
+        print(f"WARNING: LLM cache read failed: {str(e)}")
+        return None
+    if not stored:
+        persistent_cache_stats["misses"] += 1
+        return None
+    persistent_cache_stats["hits"] += 1
+    return stored
+
+async def _store_persistent(cache_key: str, result: Dict):
+    try:
+        await adb.set_llm_cache(cache_key, json.dumps(result), LLM_CACHE_TTL)
+        persistent_cache_stats["writes"] += 1
+        if persistent_cache_stats["writes"] % LLM_CACHE_PURGE_EVERY == 0:
+            await adb.purge_llm_cache()
+    except Exception as e:
+        persistent_cache_stats["errors"] += 1
+        print(f"WARNING: LLM cache write failed: {str(e)}")
+
+async def _record_catalog(result: Dict, count: int):
+    """Add freshly suggested medicines to the catalog (a failure here never fails the search)"""
+    try:
+        await adb.record_ai_medicines([med.get('name', '') for med in result["medicines"][:count]])
+    except Exception as e:
+        print(f"Failed to record AI medicines in the catalog: {e}")
+
+async def _cached_suggestion(cache_key: str):
+    """Look a suggestion up in the in-process tier, then the persistent tier"""
+    result = suggestion_cache.get(cache_key)
+    if result is None and LLM_CACHE_PERSISTENT:
+        stored = await _load_persistent(cache_key)
+        if stored:
+            result = json.loads(stored["response"])
+            # Don't let the in-process copy outlive the persistent entry
+            remaining = stored["expires_at"] - time.time()
+            suggestion_cache.set(cache_key, result, ttl=min(remaining, LLM_CACHE_TTL))
+    return result
+
+async def _fetch_suggestion(cache_key: str, symptoms: List[str], health_conditions: List[str], count: int) -> Dict:
+    result = await _cached_suggestion(cache_key)
+    if result is None:
+        # Call OpenAI API
+        started = time.perf_counter()
+        response = await client.chat.completions.create(
+            model=MEDICINE_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_medicine_prompt(symptoms, health_conditions, count)}
+            ],
+            temperature=0.7,
+            max_tokens=2000
+        )
+        elapsed = time.perf_counter() - started
+        llm_request_seconds.labels(MEDICINE_MODEL, "complete").observe(elapsed)
+        record_offloaded("openai.chat.completions", elapsed)
+        record_usage(response.usage)
+        result = parse_suggestion(response.choices[0].message.content)
+
+        suggestion_cache.set(cache_key, result)
+        if LLM_CACHE_PERSISTENT:
+            await _store_persistent(cache_key, result)
+        # Only a new completion counts as a suggestion, not cache hits or requests coalesced onto it
+        await _record_catalog(result, count)
+    return result
+
+async def suggest_medicines(symptoms: List[str], health_conditions: List[str], count: int) -> Dict:
+    """AI diagnosis plus `count` medicine suggestions, served from cache when possible"""
+    cache_key = suggestion_cache_key(symptoms, health_conditions, count)
+    result = await suggestion_flight.do(cache_key, _fetch_suggestion, cache_key, symptoms, health_conditions, count)
+
+    # Callers annotate the medicines, so never hand out the cached/shared objects themselves
+    return copy.deepcopy(result)
+
+class SuggestionStreamParser:
+    """Incrementally pulls the diagnosis and each medicine out of a streamed suggestion JSON object
+
+    Only tracks string/escape state and nesting depth, so every chunk is scanned once.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._value_start = None
+        self._in_medicines = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Dict]]:
+        """Consume more model output, returning ("diagnosis" | "medicine", value) for each completed item"""
+        self.buffer += chunk
+        completed = []
+        text = self.buffer
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = json.loads(text[self._string_start:i + 1])
+                continue
+
+            if self._depth == 0:
+                # Skip anything (e.g. a code fence) before the top-level object
+                if ch == "{":
+                    self._depth = 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif ch in "{[":
+                if self._depth == 1 and self._key == "diagnosis" and ch == "{":
+                    self._value_start = i
+                elif self._depth == 1 and self._key == "medicines" and ch == "[":
+                    self._in_medicines = True
+                elif self._depth == 2 and self._in_medicines and ch == "{":
+                    self._value_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._value_start is not None and ch == "}":
+                    if self._depth == 1 and self._key == "diagnosis":
+                        completed.append(("diagnosis", json.loads(text[self._value_start:i + 1])))
+                        self._value_start = None
+                    elif self._depth == 2 and self._in_medicines:
+                        completed.append(("medicine", json.loads(text[self._value_start:i + 1])))
+                        self._value_start = None
+                elif self._depth == 1 and ch == "]":
+                    self._in_medicines = False
+        self._pos = len(text)
+        return completed
+
+async def stream_medicine_suggestions(symptoms: List[str], health_conditions: List[str],
+                                      count: int) -> AsyncIterator[Tuple[str, Dict]]:
+    """Yield ("diagnosis", dict) and up to `count` ("medicine", dict) as soon as each is complete
+
+    Cached suggestions are replayed immediately; a fresh completion is streamed and then cached.
+    """
+    cache_key = suggestion_cache_key(symptoms, health_conditions, count)
+    cached = await _cached_suggestion(cache_key)
+    if cached is not None:
+        cached = copy.deepcopy(cached)
+        yield "diagnosis", cached["diagnosis"]
+        for med in cached["medicines"][:count]:
+            yield "medicine", med
+        return
+
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model=MEDICINE_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_medicine_prompt(symptoms, health_conditions, count)}
+        ],
+        temperature=0.7,
+        max_tokens=2000,
+        stream=True,
+        # Token counts arrive in a final chunk without choices
+        stream_options={"include_usage": True}
+    )
+
+    parser = SuggestionStreamParser()
+    emitted = 0
+    async for chunk in stream:
+        if chunk.usage:
+            record_usage(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if not parser.buffer:
+            llm_first_token_seconds.labels(MEDICINE_MODEL).observe(time.perf_counter() - started)
+        for kind, value in parser.feed(delta):
+            if kind == "medicine":
+                if emitted >= count:
+                    continue
+                emitted += 1
+            yield kind, value
+
+    elapsed = time.perf_counter() - started
+    llm_request_seconds.labels(MEDICINE_MODEL, "stream").observe(elapsed)
+    record_offloaded("openai.chat.completions.stream", elapsed)
+
+    # Cache the complete answer so the next request (streamed or not) skips the model
+    result = parse_suggestion(parser.buffer)
+    suggestion_cache.set(cache_key, result)
+    if LLM_CACHE_PERSISTENT:
+        await _store_persistent(cache_key, result)
+    await _record_catalog(result, count)
+
+def cache_stats() -> Dict:
+    """Hit/miss counters for both cache tiers and collapsed upstream calls"""
+    return {
+        "memory": suggestion_cache.stats(),
+        "persistent": {"enabled": LLM_CACHE_PERSISTENT, **persistent_cache_stats},
+        "coalescing": suggestion_flight.stats(),
+    }
@@ -1,16 +1,39 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
-from openai import OpenAI
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+import json
 import os
 from dotenv import load_dotenv
-from database import db
-from auth import hash_password, verify_password, create_access_token, get_current_user
 
+# Load .env before the modules below read their configuration at import time
 load_dotenv()
 
-app = FastAPI(title="AyurvedaGPT API")
+from database import db, adb, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, AUTOCOMPLETE_MAX_RESULTS, InvalidCursorError
+from auth import (
+    hash_password_async, verify_and_update_password_async, create_access_token, get_current_user, require_admin,
+    password_hashing_stats, token_cache, invalidate_user_tokens, shutdown as shutdown_password_workers
+)
+from cache import TTLCache
+from metrics import registry, PROMETHEUS_CONTENT_TYPE
+from profiling import ProfilingMiddleware, RequestProfiler
+from llm import suggest_medicines, stream_medicine_suggestions, cache_stats as llm_cache_stats
+from pdf import prescription_pdf, render_executor, PDF_RENDER_WORKERS, shutdown as shutdown_render_workers
+from renderer import render_prescription, render_prescriptions, link_stylesheet, PRESCRIPTION_CSS, STYLESHEET_PATH, STYLESHEET_HASH, STYLESHEET_CACHE_CONTROL
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Stop the worker pools and close database connections when the server shuts down"""
+    yield
+    shutdown_render_workers()
+    shutdown_password_workers()
+    adb.shutdown()
+
+app = FastAPI(title="AyurvedaGPT API", lifespan=lifespan)
 
 # CORS middleware for React Native
 app.add_middleware(
@@ -21,12 +44,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Sampled requests run under cProfile (switched on and off at /api/admin/profiling)
+request_profiler = RequestProfiler()
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+
+# Count near-identical terms ("headache" / "head ache" / "headaches") as matches unless a request opts out
+FUZZY_TERM_MATCHING = os.getenv("FUZZY_TERM_MATCHING", "true").lower() in ("1", "true", "yes")
+# How past prescriptions are ranked: "overlap" (weighted shared terms) or "tfidf" (cosine, rare terms weigh more)
+SIMILARITY_RANKING = os.getenv("SIMILARITY_RANKING", "overlap")
 
 class MedicineRequest(BaseModel):
     symptoms: List[str]
     health_conditions: List[str]
+    fuzzy: bool = FUZZY_TERM_MATCHING
+    ranking: Literal["overlap", "tfidf"] = SIMILARITY_RANKING
 
 class Medicine(BaseModel):
     name: str
@@ -57,6 +88,12 @@ class GeneratePrescriptionRequest(BaseModel):
     doctor_registration: Optional[str] = None
     diagnosis: Optional[DiagnosisData] = None
 
+# Upper bound on one batch, keeping a single transaction and its statements reasonably sized
+MAX_BATCH_SIZE = 500
+
+class BatchGeneratePrescriptionRequest(BaseModel):
+    items: List[GeneratePrescriptionRequest] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
 # Auth models
 class RegisterRequest(BaseModel):
     email: str
@@ -87,20 +124,77 @@ class PrescriptionCreate(BaseModel):
 async def root():
     return {"message": "AyurvedaGPT API is running"}
 
+# Short-lived cache of the public profile returned by the auth endpoints, dropped when the user record changes
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "60"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "1024"))
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_MAX_ENTRIES, ttl=PROFILE_CACHE_TTL)
+db.on_user_changed(profile_cache.invalidate)
+db.on_user_changed(invalidate_user_tokens)
+
+# Stage timings of the endpoints doctors wait on, and cache effectiveness, for GET /metrics
+request_stage_seconds = registry.histogram(
+    "vidhya_request_stage_seconds", "Time spent in each stage of an endpoint", ("endpoint", "stage")
+)
+
+def cache_statistics() -> Dict[str, Dict]:
+    """Hit/miss counters of every cache, by name"""
+    llm = llm_cache_stats()
+    return {
+        "llm_suggestions": llm["memory"],
+        "llm_persistent": llm["persistent"],
+        "auth_tokens": token_cache.stats(),
+        "profiles": profile_cache.stats(),
+        "term_tries": db.term_completer.stats(),
+    }
+
+def cache_hit_ratios():
+    """Share of lookups each cache answered since the process started"""
+    for name, stats in cache_statistics().items():
+        lookups = stats["hits"] + stats["misses"]
+        yield (name,), stats["hits"] / lookups if lookups else 0.0
+
+registry.callback("vidhya_cache_hits_total", "counter", "Lookups answered by the cache", ("cache",),
+                  lambda: [((name,), stats["hits"]) for name, stats in cache_statistics().items()])
+registry.callback("vidhya_cache_misses_total", "counter", "Lookups the cache could not answer", ("cache",),
+                  lambda: [((name,), stats["misses"]) for name, stats in cache_statistics().items()])
+registry.callback("vidhya_cache_hit_ratio", "gauge", "Share of lookups answered by the cache since start", ("cache",),
+                  cache_hit_ratios)
+
+def user_profile(user: Dict) -> Dict:
+    """User data safe to return to the client (excludes password)"""
+    return {
+        "id": user["id"],
+        "email": user["email"],
+        "name": user["name"],
+        "phone": user["phone"],
+        "registration_number": user["registration_number"]
+    }
+
+async def get_user_profile(user_id: int) -> Optional[Dict]:
+    """Profile for a user id, from the profile cache when fresh"""
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        user = await adb.get_user_by_id(user_id)
+        if not user:
+            return None
+        profile = user_profile(user)
+        profile_cache.set(user_id, profile)
+    return dict(profile)
+
 # Authentication endpoints
 @app.post("/api/auth/register")
 async def register(request: RegisterRequest):
     """Register a new doctor/user"""
     # Check if user already exists
-    existing_user = db.get_user_by_email(request.email)
+    existing_user = await adb.get_user_by_email(request.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    # Hash password
-    hashed_password = hash_password(request.password)
+    # Hash password (in the password worker pool, off the event loop)
+    hashed_password = await hash_password_async(request.password)
 
     # Create user
-    user_id = db.create_user(
+    user_id = await adb.create_user(
         email=request.email,
         password=hashed_password,
         name=request.name,
@@ -115,14 +209,7 @@ async def register(request: RegisterRequest):
     access_token = create_access_token(data={"user_id": user_id, "email": request.email})
 
     # Get user data
-    user = db.get_user_by_id(user_id)
-    user_data = {
-        "id": user["id"],
-        "email": user["email"],
-        "name": user["name"],
-        "phone": user["phone"],
-        "registration_number": user["registration_number"]
-    }
+    user_data = await get_user_profile(user_id)
 
     return {
         "success": True,
@@ -135,25 +222,25 @@ async def register(request: RegisterRequest):
 async def login(request: LoginRequest):
     """Login user"""
     # Get user
-    user = db.get_user_by_email(request.email)
+    user = await adb.get_user_by_email(request.email)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    # Verify password
-    if not verify_password(request.password, user["password"]):
+    # Verify password (in the password worker pool, off the event loop)
+    valid, new_hash = await verify_and_update_password_async(request.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
+    # Stored hash predates the current BCRYPT_ROUNDS: upgrade it now that we know the password
+    if new_hash:
+        await adb.update_user_password(user["id"], new_hash)
+
     # Create access token
     access_token = create_access_token(data={"user_id": user["id"], "email": user["email"]})
 
-    # User data (exclude password)
-    user_data = {
-        "id": user["id"],
-        "email": user["email"],
-        "name": user["name"],
-        "phone": user["phone"],
-        "registration_number": user["registration_number"]
-    }
+    # User data (exclude password); the row was just read, so refresh the profile cache with it
+    user_data = user_profile(user)
+    profile_cache.set(user["id"], dict(user_data))
 
     return {
         "success": True,
@@ -165,93 +252,181 @@ async def login(request: LoginRequest):
 @app.get("/api/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Get current logged-in user"""
-    user = db.get_user_by_id(current_user["user_id"])
-    if not user:
+    user_data = await get_user_profile(current_user["user_id"])
+    if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_data = {
-        "id": user["id"],
-        "email": user["email"],
-        "name": user["name"],
-        "phone": user["phone"],
-        "registration_number": user["registration_number"]
-    }
-
     return {"success": True, "user": user_data}
 
 # Admin/Debug endpoints
 @app.get("/api/admin/users")
-async def list_all_users():
+async def list_all_users(admin: dict = Depends(require_admin)):
     """Debug endpoint to view all users in database (for checking PostgreSQL)"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
+    # Import USE_POSTGRES from database module
+    from database import USE_POSTGRES
 
-    try:
-        # Import USE_POSTGRES from database module
-        from database import USE_POSTGRES
+    users_list = await adb.list_users()
 
-        if USE_POSTGRES:
-            cursor.execute("SELECT id, email, name, phone, registration_number, created_at FROM users ORDER BY created_at DESC")
-        else:
-            cursor.execute("SELECT id, email, name, phone, registration_number, created_at FROM users ORDER BY created_at DESC")
+    return {
+        "success": True,
+        "database_type": "PostgreSQL" if USE_POSTGRES else "SQLite",
+        "user_count": len(users_list),
+        "users": users_list
+    }
 
-        users = cursor.fetchall()
-        users_list = [dict(user) for user in users]
+@app.get("/api/admin/db-pool")
+async def db_pool_stats(admin: dict = Depends(require_admin)):
+    """Debug endpoint to inspect connection pool occupancy and exhaustion counters"""
+    return {"success": True, "pool": db.pool_stats()}
 
-        return {
-            "success": True,
-            "database_type": "PostgreSQL" if USE_POSTGRES else "SQLite",
-            "user_count": len(users_list),
-            "users": users_list
-        }
-    finally:
-        conn.close()
+@app.get("/api/admin/query-plans")
+async def query_plans(admin: dict = Depends(require_admin)):
+    """Debug endpoint to check that the hot statements are planned onto their indexes"""
+    plans = await adb.verify_query_plans()
+    return {"success": True, "all_indexed": all(p["uses_index"] for p in plans), "queries": plans}
+
+@app.get("/api/admin/coalescing")
+async def coalescing_statistics(admin: dict = Depends(require_admin)):
+    """Debug endpoint to see how many identical in-flight searches were collapsed"""
+    return {
+        "success": True,
+        "similar_prescriptions": adb.similar_flight.stats(),
+        "medicine_suggestions": llm_cache_stats()["coalescing"]
+    }
+
+@app.get("/api/admin/password-hashing")
+async def password_hashing_statistics(admin: dict = Depends(require_admin)):
+    """Debug endpoint to inspect the password hashing queue depth and counters"""
+    return {"success": True, "password_hashing": password_hashing_stats()}
+
+@app.get("/api/admin/auth-cache")
+async def auth_cache_statistics(admin: dict = Depends(require_admin)):
+    """Debug endpoint to inspect verified-token and profile cache hit/miss counters"""
+    return {"success": True, "tokens": token_cache.stats(), "profiles": profile_cache.stats()}
+
+@app.get("/api/admin/similarity-index")
+async def similarity_index_statistics(admin: dict = Depends(require_admin)):
+    """Debug endpoint to inspect the loaded TF-IDF similarity indexes"""
+    return {"success": True, "tfidf": db.tfidf.stats()}
+
+@app.get("/api/admin/autocomplete")
+async def autocomplete_statistics(admin: dict = Depends(require_admin)):
+    """Debug endpoint to inspect the symptom/condition autocomplete tries held in memory"""
+    return {"success": True, "term_tries": db.term_completer.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint: stage, database, LLM and cache metrics of this worker process"""
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float = Field(..., ge=0.0, le=1.0)
+    route_pattern: str = ""
+
+@app.get("/api/admin/profiling")
+async def profiling_status(route: Optional[str] = None, admin: dict = Depends(require_admin)):
+    """Profiling switch, counters and the stored profiles (newest first, optionally of one route)"""
+    profiles = await asyncio.to_thread(request_profiler.profiles, route)
+    return {
+        "success": True,
+        "settings": request_profiler.settings(),
+        "stats": request_profiler.stats(),
+        "profiles": profiles
+    }
+
+@app.put("/api/admin/profiling")
+async def configure_profiling(settings: ProfilingSettings, admin: dict = Depends(require_admin)):
+    """Profile this share of requests (of those whose path matches route_pattern, if set); 0 switches it off"""
+    try:
+        applied = request_profiler.configure(settings.sample_rate, settings.route_pattern)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "settings": applied}
+
+@app.get("/api/admin/profiling/{request_id}")
+async def download_profile(request_id: str, admin: dict = Depends(require_admin)):
+    """A stored profile as a pstats file (python -m pstats, snakeviz)"""
+    path = request_profiler.profile_path(request_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{request_id}.prof")
+
+@app.get("/api/admin/llm-cache")
+async def llm_cache_statistics(admin: dict = Depends(require_admin)):
+    """Debug endpoint to inspect medicine suggestion cache hit/miss counters"""
+    return {"success": True, "cache": llm_cache_stats()}
 
 # Patient endpoints
 @app.post("/api/patients")
 async def create_patient(patient: PatientCreate, current_user: dict = Depends(get_current_user)):
-    """Create a new patient"""
-    patient_id = db.create_patient(
+    """Create a new patient; an existing one with the same name, age, gender and phone is returned instead, with existing: true"""
+    patient_data, created = await adb.find_or_create_patient(
         user_id=current_user["user_id"],
         name=patient.name,
         age=patient.age,
         gender=patient.gender,
         phone=patient.phone
     )
-
-    patient_data = db.get_patient(patient_id, current_user["user_id"])
-    return {"success": True, "patient": patient_data}
+    return {"success": True, "patient": patient_data, "existing": not created}
 
 @app.get("/api/patients")
-async def get_patients(current_user: dict = Depends(get_current_user)):
-    """Get all patients for current user"""
-    patients = db.get_user_patients(current_user["user_id"])
-    return {"success": True, "patients": patients}
+async def get_patients(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get patients for current user, newest first (pass next_cursor back as cursor for the next page)"""
+    try:
+        patients, next_cursor = await adb.get_user_patients(current_user["user_id"], limit=limit, after=cursor)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"success": True, "patients": patients, "next_cursor": next_cursor}
+
+@app.get("/api/patients/search")
+async def search_patients(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """Search the current user's patients by name or phone, best match first (typos tolerated)"""
+    patients, next_offset = await adb.search_patients(current_user["user_id"], q, limit=limit, offset=offset)
+    return {"success": True, "patients": patients, "next_offset": next_offset}
 
 @app.get("/api/patients/{patient_id}")
 async def get_patient(patient_id: int, current_user: dict = Depends(get_current_user)):
     """Get a specific patient"""
-    patient = db.get_patient(patient_id, current_user["user_id"])
+    patient = await adb.get_patient(patient_id, current_user["user_id"])
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     return {"success": True, "patient": patient}
 
 @app.get("/api/patients/{patient_id}/prescriptions")
-async def get_patient_prescriptions(patient_id: int, current_user: dict = Depends(get_current_user)):
-    """Get all prescriptions for a patient"""
-    prescriptions = db.get_patient_prescriptions(patient_id, current_user["user_id"])
-    return {"success": True, "prescriptions": prescriptions}
+async def get_patient_prescriptions(
+    patient_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get prescriptions for a patient, newest first (pass next_cursor back as cursor for the next page)"""
+    try:
+        prescriptions, next_cursor = await adb.get_patient_prescriptions(
+            patient_id, current_user["user_id"], limit=limit, after=cursor
+        )
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"success": True, "prescriptions": prescriptions, "next_cursor": next_cursor}
 
 # Prescription endpoints
 @app.post("/api/prescriptions")
 async def create_prescription(prescription: PrescriptionCreate, current_user: dict = Depends(get_current_user)):
     """Save a prescription"""
     # Verify patient belongs to user
-    patient = db.get_patient(prescription.patient_id, current_user["user_id"])
+    patient = await adb.get_patient(prescription.patient_id, current_user["user_id"])
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    prescription_id = db.create_prescription(
+    prescription_id = await adb.create_prescription(
         user_id=current_user["user_id"],
         patient_id=prescription.patient_id,
         symptoms=prescription.symptoms,
@@ -261,14 +436,168 @@ async def create_prescription(prescription: PrescriptionCreate, current_user: di
         notes=prescription.notes
     )
 
-    prescription_data = db.get_prescription(prescription_id, current_user["user_id"])
+    prescription_data = await adb.get_prescription(prescription_id, current_user["user_id"])
     return {"success": True, "prescription": prescription_data}
 
 @app.get("/api/prescriptions")
-async def get_prescriptions(current_user: dict = Depends(get_current_user)):
-    """Get recent prescriptions for current user"""
-    prescriptions = db.get_user_prescriptions(current_user["user_id"])
-    return {"success": True, "prescriptions": prescriptions}
+async def get_prescriptions(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get recent prescriptions for current user (pass next_cursor back as cursor for the next page)"""
+    try:
+        prescriptions, next_cursor = await adb.get_user_prescriptions(current_user["user_id"], limit=limit, after=cursor)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"success": True, "prescriptions": prescriptions, "next_cursor": next_cursor}
+
+TARGET_MEDICINE_COUNT = 8
+
+EMPTY_DIAGNOSIS = {
+    "primary_condition": "",
+    "secondary_conditions": [],
+    "ayurvedic_analysis": ""
+}
+
+def extract_historical_medicines(similar_prescriptions: List[dict]) -> List[dict]:
+    """Unique medicines from similar past prescriptions, best match first"""
+    historical_medicines = []
+    seen_medicine_names = set()
+
+    for prescription in similar_prescriptions:
+        for med in prescription['medicines']:
+            med_name = med.get('medicine_name', '')
+            # Avoid duplicates
+            if med_name and med_name not in seen_medicine_names:
+                seen_medicine_names.add(med_name)
+                historical_medicines.append({
+                    "name": med_name,
+                    "description": f"Previously prescribed for similar symptoms (Match: {prescription['symptom_matches']} symptoms, {prescription['condition_matches']} conditions)",
+                    "recommended_dosage": med.get('dosage', ''),
+                    "timing": med.get('timing', ''),
+                    "precautions": None,
+                    "source": "historical",
+                    "similarity_score": prescription['similarity_score']
+                })
+    return historical_medicines
+
+def historical_diagnosis(similar_prescriptions: List[dict]) -> Optional[dict]:
+    """Diagnosis of the best matching past prescription, if it recorded one"""
+    if similar_prescriptions and similar_prescriptions[0].get('diagnosis_primary'):
+        return {
+            "primary_condition": similar_prescriptions[0]['diagnosis_primary'],
+            "secondary_conditions": similar_prescriptions[0]['diagnosis_secondary'],
+            "ayurvedic_analysis": similar_prescriptions[0].get('diagnosis_ayurvedic', '')
+        }
+    return None
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Stored prescription documents
+DOCUMENT_MEDIA_TYPES = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+# A stored document never changes, so clients may reuse it for a day and then revalidate by ETag
+DOCUMENT_CACHE_CONTROL = "private, max-age=86400"
+# Absolute origin of the static stylesheet for HTML handed to clients without a base URL (the app prints
+# prescription_html as is); unset, that HTML keeps the stylesheet inlined
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+
+def document_fields(prescription: Dict) -> Dict:
+    """Render inputs for a prescription row from get_printable_prescription"""
+    return {
+        "patient_name": prescription["patient_name"],
+        "patient_age": prescription["patient_age"],
+        "patient_gender": prescription["patient_gender"],
+        "symptoms": prescription["symptoms"],
+        "health_conditions": prescription["health_conditions"] or [],
+        "medicines": prescription["medicines"],
+        "doctor_name": prescription["doctor_name"],
+        "doctor_registration": prescription["doctor_registration"],
+    }
+
+async def load_document(prescription_id: int, user_id: int, fmt: str) -> Optional[Dict]:
+    """Stored document for a prescription, rendering and storing it first if it was never generated"""
+    document = await adb.get_prescription_document(prescription_id, user_id, fmt)
+    if document:
+        return document
+
+    prescription = await adb.get_printable_prescription(prescription_id, user_id)
+    if not prescription:
+        return None
+    created_at = prescription["created_at"]
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    if fmt == "pdf":
+        _, content = await prescription_pdf({**document_fields(prescription), "date": str(created_at)})
+    else:
+        content = render_prescription(**document_fields(prescription), now=created_at).encode("utf-8")
+    return await adb.save_prescription_document(prescription_id, user_id, fmt, content)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names this entity tag (weak comparison)"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == f'"{etag}"':
+            return True
+    return False
+
+@app.get("/api/prescriptions/{prescription_id}/document")
+async def get_prescription_document(
+    prescription_id: int,
+    fmt: str = Query("html", alias="format", pattern="^(html|pdf)$"),
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Stored prescription document (HTML or PDF) with ETag revalidation"""
+    document = await load_document(prescription_id, current_user["user_id"], fmt)
+    if not document:
+        raise HTTPException(status_code=404, detail="Prescription not found")
+
+    # The stored page inlines its stylesheet; browsers get it linked instead, fetched once and cached
+    etag = document["etag"] if fmt == "pdf" else f'{document["etag"]}-{STYLESHEET_HASH}'
+    headers = {"ETag": f'"{etag}"', "Cache-Control": DOCUMENT_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if fmt == "pdf":
+        headers["Content-Disposition"] = f'inline; filename="prescription-{prescription_id}.pdf"'
+        content = document["content"]
+    else:
+        content = link_stylesheet(document["content"].decode("utf-8"))
+    return Response(content=content, media_type=DOCUMENT_MEDIA_TYPES[fmt], headers=headers)
+
+@app.get("/api/prescriptions/{prescription_id}/pdf")
+async def get_prescription_pdf(
+    prescription_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Printable PDF of a saved prescription (rendered server-side once, then served from storage)"""
+    return await get_prescription_document(prescription_id, "pdf", if_none_match, current_user)
+
+@app.get("/api/medicines/autocomplete")
+async def autocomplete_medicines(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(AUTOCOMPLETE_MAX_RESULTS, ge=1, le=AUTOCOMPLETE_MAX_RESULTS),
+    current_user: dict = Depends(get_current_user)
+):
+    """Catalog medicine names completing what the doctor has typed, most prescribed first"""
+    return {"success": True, "medicines": await adb.autocomplete_medicines(q, limit)}
+
+@app.get("/api/terms/autocomplete")
+async def autocomplete_terms(
+    q: str = Query(..., min_length=1, max_length=100),
+    kind: Literal["symptom", "condition"] = "symptom",
+    scope: Literal["mine", "all"] = "mine",
+    limit: int = Query(AUTOCOMPLETE_MAX_RESULTS, ge=1, le=AUTOCOMPLETE_MAX_RESULTS),
+    current_user: dict = Depends(get_current_user)
+):
+    """Symptoms or conditions from past prescriptions (this doctor's, or all doctors') completing what was typed"""
+    user_id = current_user["user_id"] if scope == "mine" else None
+    return {"success": True, "terms": await adb.autocomplete_terms(q, kind, user_id, limit)}
 
 @app.post("/api/medicines/search")
 async def search_medicines(request: MedicineRequest, current_user: dict = Depends(get_current_user)):
@@ -278,125 +607,39 @@ async def search_medicines(request: MedicineRequest, current_user: dict = Depend
     """
     try:
         # Step 1: Find similar prescriptions from database
-        similar_prescriptions = db.find_similar_prescriptions(
-            symptoms=request.symptoms,
-            health_conditions=request.health_conditions,
-            user_id=current_user["user_id"],  # Only this doctor's prescriptions
-            limit=5
-        )
+        with request_stage_seconds.time("search_medicines", "similar_prescriptions"):
+            similar_prescriptions = await adb.find_similar_prescriptions(
+                symptoms=request.symptoms,
+                health_conditions=request.health_conditions,
+                user_id=current_user["user_id"],  # Only this doctor's prescriptions
+                limit=5,
+                fuzzy=request.fuzzy,
+                ranking=request.ranking
+            )
 
         # Step 2: Extract medicines from similar prescriptions
-        historical_medicines = []
-        seen_medicine_names = set()
-
-        for prescription in similar_prescriptions:
-            for med in prescription['medicines']:
-                med_name = med.get('medicine_name', '')
-                # Avoid duplicates
-                if med_name and med_name not in seen_medicine_names:
-                    seen_medicine_names.add(med_name)
-                    historical_medicines.append({
-                        "name": med_name,
-                        "description": f"Previously prescribed for similar symptoms (Match: {prescription['symptom_matches']} symptoms, {prescription['condition_matches']} conditions)",
-                        "recommended_dosage": med.get('dosage', ''),
-                        "timing": med.get('timing', ''),
-                        "precautions": None,
-                        "source": "historical",
-                        "similarity_score": prescription['similarity_score']
-                    })
+        with request_stage_seconds.time("search_medicines", "extract_historical"):
+            historical_medicines = extract_historical_medicines(similar_prescriptions)
 
         # Step 3: Use AI only if we don't have enough historical data
-        target_count = 8
+        target_count = TARGET_MEDICINE_COUNT
         diagnosis = None
         ai_medicines = []
 
         if len(historical_medicines) < target_count:
-            # Not enough historical data, use AI
-            # Create prompt for OpenAI
-            prompt = f"""You are an expert Ayurvedic doctor. Based on the following patient information, first diagnose the possible disease(s), then suggest appropriate Ayurvedic medicines.
-
-Symptoms: {', '.join(request.symptoms)}
-Health Conditions: {', '.join(request.health_conditions)}
-
-STEP 1: DIAGNOSIS
-Based on the symptoms, provide:
-1. Primary possible disease/condition (most likely)
-2. Secondary possible diseases (if applicable)
-3. Brief explanation in Ayurvedic terms (Vata/Pitta/Kapha imbalance if relevant)
-
-STEP 2: MEDICINE RECOMMENDATIONS
-Please provide EXACTLY 8 Ayurvedic medicines (both proprietary branded and classical formulations) that would be appropriate for the diagnosed condition and symptoms.
-
-IMPORTANT GUIDELINES:
-- Include PROPRIETARY BRANDED medicines from companies like:
-  * Acharya Shushruta (e.g vahinil)
-  * Himalaya (e.g., Liv.52, Mentat, Brahmi, Ashvagandha)
-  * Dabur (e.g., Chyawanprash, Honitus, Stresscom)
-  * Baidyanath (e.g., Kesari Kalp, Ashwagandharishta, Brahmi Vati)
-  * Patanjali (e.g., Divya medicines)
-  * Zandu (e.g., Pancharishta, Chyawanprash)
-  * Other well-known brands
-- Also include CLASSICAL Ayurvedic formulations (e.g., Triphala, Dashamularishta, Ashwagandharishta)
-- Each medicine should be a POLYHERBAL/MULTI-INGREDIENT FORMULATION (combination of multiple herbs/drugs)
-- Include the brand name AND main constituent herbs/drugs in the description
-- Focus on medicines commonly prescribed and easily available in the market
-- Provide a good mix of different dosage forms: tablets, syrups, churnas (powders), capsules, etc.
-
-For each medicine, provide:
-1. Brand/Product name with company if proprietary (e.g., "Himalaya Liv.52", "Dabur Chyawanprash", or "Triphala Churna")
-2. Brief description including main herbs/constituents and what it treats
-3. Recommended dosage with specific form (tablets, syrup, churna, capsules)
-4. Best timing to take (e.g., "Before meals", "After meals", "Before bedtime")
-5. Any important precautions or contraindications
-
-Format your response as a JSON object with diagnosis and medicines:
-{{
-  "diagnosis": {{
-    "primary_condition": "Primary disease/condition name",
-    "secondary_conditions": ["Secondary condition 1", "Secondary condition 2"],
-    "ayurvedic_analysis": "Brief explanation of dosha imbalance and Ayurvedic perspective"
-  }},
-  "medicines": [
-    {{
-      "name": "Brand/Company Name + Product Name (if branded)",
-      "description": "What it treats, benefits, and key ingredients/herbs",
-      "recommended_dosage": "Specific dosage with form (e.g., 2 tablets, 10ml syrup, 3g churna)",
-      "timing": "When to take",
-      "precautions": "Important precautions if any"
-    }}
-  ]
-}}
-
-IMPORTANT: Return ONLY the JSON object with diagnosis and EXACTLY {target_count - len(historical_medicines)} medicines, no additional text."""
-
-            # Call OpenAI API
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are an expert Ayurvedic doctor. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-
-            # Parse the response
-            import json
-            response_text = response.choices[0].message.content
-
-            # Extract JSON from response
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            json_text = response_text[start_idx:end_idx]
-
-            result = json.loads(json_text)
+            # Not enough historical data, use AI (cached per symptom/condition set)
+            with request_stage_seconds.time("search_medicines", "ai_suggestion"):
+                suggestion = await suggest_medicines(
+                    request.symptoms,
+                    request.health_conditions,
+                    target_count - len(historical_medicines)
+                )
 
             # Get diagnosis and medicines from AI
-            diagnosis = result.get("diagnosis", {})
-            ai_medicines_raw = result.get("medicines", [])
+            diagnosis = suggestion["diagnosis"]
 
             # Add source label to AI medicines
-            for med in ai_medicines_raw:
+            for med in suggestion["medicines"]:
                 med['source'] = 'ai'
                 ai_medicines.append(med)
 
@@ -405,19 +648,7 @@ IMPORTANT: Return ONLY the JSON object with diagnosis and EXACTLY {target_count
         combined_medicines = historical_medicines + ai_medicines
 
         # Use diagnosis from historical prescription if available, otherwise from AI
-        if similar_prescriptions and similar_prescriptions[0].get('diagnosis_primary'):
-            diagnosis = {
-                "primary_condition": similar_prescriptions[0]['diagnosis_primary'],
-                "secondary_conditions": similar_prescriptions[0]['diagnosis_secondary'],
-                "ayurvedic_analysis": similar_prescriptions[0].get('diagnosis_ayurvedic', '')
-            }
-        elif not diagnosis:
-            # No historical diagnosis and no AI diagnosis
-            diagnosis = {
-                "primary_condition": "",
-                "secondary_conditions": [],
-                "ayurvedic_analysis": ""
-            }
+        diagnosis = historical_diagnosis(similar_prescriptions) or diagnosis or dict(EMPTY_DIAGNOSIS)
 
         return {
             "success": True,
@@ -436,294 +667,172 @@ IMPORTANT: Return ONLY the JSON object with diagnosis and EXACTLY {target_count
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error searching medicines: {str(e)}")
 
+@app.post("/api/medicines/search/stream")
+async def search_medicines_stream(request: MedicineRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Streaming variant of /api/medicines/search (Server-Sent Events)
+
+    Events, in order:
+      historical - {"diagnosis", "medicines"}: past-prescription matches, sent immediately
+      diagnosis  - AI diagnosis (only when no historical diagnosis was found)
+      medicine   - one AI-suggested medicine, sent as soon as the model has finished it
+      done       - {"diagnosis", "source_info"}: final summary
+      error      - {"detail"}: the AI step failed; historical results already sent stand
+    """
+    try:
+        similar_prescriptions = await adb.find_similar_prescriptions(
+            symptoms=request.symptoms,
+            health_conditions=request.health_conditions,
+            user_id=current_user["user_id"],  # Only this doctor's prescriptions
+            limit=5,
+            fuzzy=request.fuzzy,
+            ranking=request.ranking
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching medicines: {str(e)}")
+
+    historical_medicines = extract_historical_medicines(similar_prescriptions)
+    target_count = TARGET_MEDICINE_COUNT
+
+    async def events():
+        diagnosis = historical_diagnosis(similar_prescriptions)
+        yield sse_event("historical", {
+            "diagnosis": diagnosis,
+            "medicines": historical_medicines[:target_count]
+        })
+
+        ai_medicines = []
+        if len(historical_medicines) < target_count:
+            try:
+                async for kind, value in stream_medicine_suggestions(
+                    request.symptoms,
+                    request.health_conditions,
+                    target_count - len(historical_medicines)
+                ):
+                    if kind == "diagnosis":
+                        if diagnosis is None:
+                            diagnosis = value
+                            yield sse_event("diagnosis", value)
+                    else:
+                        value['source'] = 'ai'
+                        ai_medicines.append(value)
+                        yield sse_event("medicine", value)
+            except Exception as e:
+                import traceback
+                print(f"ERROR in search_medicines_stream: {str(e)}")
+                print(traceback.format_exc())
+                yield sse_event("error", {"detail": f"Error searching medicines: {str(e)}"})
+                return
+
+        yield sse_event("done", {
+            "diagnosis": diagnosis or dict(EMPTY_DIAGNOSIS),
+            "source_info": {
+                "historical_count": len(historical_medicines),
+                "ai_count": len(ai_medicines),
+                "total_count": len(historical_medicines) + len(ai_medicines)
+            }
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get(STYLESHEET_PATH, include_in_schema=False)
+async def prescription_stylesheet():
+    """Prescription stylesheet (content-hashed URL, so clients may cache it forever)"""
+    return Response(
+        content=PRESCRIPTION_CSS,
+        media_type="text/css",
+        headers={"Cache-Control": STYLESHEET_CACHE_CONTROL, "ETag": f'"{STYLESHEET_HASH}"'}
+    )
+
+def prescription_medicines(request: GeneratePrescriptionRequest) -> List[Dict]:
+    """Medicines of a generate request in the format stored with the prescription"""
+    return [
+        {
+            "medicine_name": med.medicine_name,
+            "dosage": med.dosage,
+            "timing": med.timing,
+            "duration": med.duration or ""
+        }
+        for med in request.medicines
+    ]
+
+def prescription_diagnosis(request: GeneratePrescriptionRequest) -> Dict:
+    """Diagnosis from the request, or an empty one if not provided"""
+    if request.diagnosis:
+        return {
+            "primary_condition": request.diagnosis.primary_condition or "",
+            "secondary_conditions": request.diagnosis.secondary_conditions or [],
+            "ayurvedic_analysis": request.diagnosis.ayurvedic_analysis or ""
+        }
+    return {
+        "primary_condition": "",
+        "secondary_conditions": [],
+        "ayurvedic_analysis": ""
+    }
+
+def render_fields(request: GeneratePrescriptionRequest, medicines: List[Dict]) -> Dict:
+    """render_prescription arguments for a generate request"""
+    return {
+        "patient_name": request.patient_name,
+        "patient_age": request.patient_age,
+        "patient_gender": request.patient_gender,
+        "symptoms": request.symptoms,
+        "health_conditions": request.health_conditions,
+        "medicines": medicines,
+        "doctor_name": request.doctor_name,
+        "doctor_registration": request.doctor_registration,
+    }
+
 @app.post("/api/prescription/generate")
 async def generate_prescription(request: GeneratePrescriptionRequest, current_user: dict = Depends(get_current_user)):
     """
     Generate a formatted prescription document and save to database
     """
     try:
-        # Step 1: Check if patient exists (by name, age, gender for this user)
-        existing_patients = db.get_user_patients(current_user["user_id"])
-        patient = None
-        for p in existing_patients:
-            if (p['name'].lower() == request.patient_name.lower() and
-                p['age'] == request.patient_age and
-                p['gender'].lower() == request.patient_gender.lower()):
-                patient = p
-                break
-
-        # Step 2: Create patient if doesn't exist
-        if not patient:
-            patient_id = db.create_patient(
+        # Step 1: Find the patient (by name, age, gender for this user) or create it
+        with request_stage_seconds.time("generate_prescription", "find_patient"):
+            patient, _ = await adb.find_or_create_patient(
                 user_id=current_user["user_id"],
                 name=request.patient_name,
                 age=request.patient_age,
                 gender=request.patient_gender,
                 phone=None
             )
-            patient = db.get_patient(patient_id, current_user["user_id"])
-
-        # Step 3: Save prescription to database
-        # Convert medicines list to dict format for database
-        medicines_data = [
-            {
-                "medicine_name": med.medicine_name,
-                "dosage": med.dosage,
-                "timing": med.timing,
-                "duration": med.duration or ""
-            }
-            for med in request.medicines
-        ]
-
-        # Use diagnosis from request or create empty dict if not provided
-        if request.diagnosis:
-            diagnosis = {
-                "primary_condition": request.diagnosis.primary_condition or "",
-                "secondary_conditions": request.diagnosis.secondary_conditions or [],
-                "ayurvedic_analysis": request.diagnosis.ayurvedic_analysis or ""
-            }
-        else:
-            diagnosis = {
-                "primary_condition": "",
-                "secondary_conditions": [],
-                "ayurvedic_analysis": ""
-            }
 
-        prescription_id = db.create_prescription(
-            user_id=current_user["user_id"],
-            patient_id=patient["id"],
-            symptoms=request.symptoms,
-            health_conditions=request.health_conditions,
-            diagnosis=diagnosis,
-            medicines=medicines_data,
-            notes=None
-        )
+        # Step 2: Convert medicines and diagnosis to dict format for database
+        medicines_data = prescription_medicines(request)
+        diagnosis = prescription_diagnosis(request)
 
-        # Step 4: Generate HTML prescription
-        # Create HTML prescription format
-        prescription_html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        @media print {{
-            body {{ margin: 0; padding: 20px; }}
-        }}
-        body {{
-            font-family: 'Arial', sans-serif;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-            background: white;
-        }}
-        .header {{
-            text-align: center;
-            border-bottom: 3px solid #297691;
-            padding-bottom: 20px;
-            margin-bottom: 30px;
-        }}
-        .header h1 {{
-            color: #297691;
-            margin: 0;
-            font-size: 28px;
-        }}
-        .header p {{
-            color: #4B95AF;
-            margin: 5px 0;
-        }}
-        .section {{
-            margin-bottom: 25px;
-        }}
-        .section-title {{
-            background: #297691;
-            color: white;
-            padding: 10px 15px;
-            margin-bottom: 15px;
-            font-weight: bold;
-            font-size: 16px;
-        }}
-        .patient-info {{
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 10px;
-            padding: 0 15px;
-        }}
-        .info-item {{
-            padding: 8px 0;
-        }}
-        .info-label {{
-            color: #19647F;
-            font-weight: bold;
-            display: inline-block;
-            width: 120px;
-        }}
-        .medicines-table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 10px;
-        }}
-        .medicines-table th {{
-            background: #4B95AF;
-            color: white;
-            padding: 12px;
-            text-align: left;
-            font-weight: bold;
-        }}
-        .medicines-table td {{
-            padding: 12px;
-            border-bottom: 1px solid #6DB4CD;
-        }}
-        .medicines-table tr:nth-child(even) {{
-            background: #f8f9fa;
-        }}
-        .symptoms-list, .conditions-list {{
-            padding: 0 15px;
-        }}
-        .symptoms-list ul, .conditions-list ul {{
-            list-style: none;
-            padding: 0;
-        }}
-        .symptoms-list li, .conditions-list li {{
-            padding: 5px 0;
-            color: #053445;
-        }}
-        .symptoms-list li:before, .conditions-list li:before {{
-            content: "• ";
-            color: #297691;
-            font-weight: bold;
-            margin-right: 8px;
-        }}
-        .footer {{
-            margin-top: 50px;
-            padding-top: 20px;
-            border-top: 2px solid #6DB4CD;
-            text-align: right;
-        }}
-        .signature {{
-            margin-top: 60px;
-        }}
-        .doctor-name {{
-            font-weight: bold;
-            color: #297691;
-        }}
-        .print-button {{
-            background: #297691;
-            color: white;
-            border: none;
-            padding: 12px 30px;
-            font-size: 16px;
-            cursor: pointer;
-            border-radius: 5px;
-            margin: 20px auto;
-            display: block;
-        }}
-        .print-button:hover {{
-            background: #19647F;
-        }}
-        @media print {{
-            .print-button {{
-                display: none;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>🌿 AYURVEDIC PRESCRIPTION 🌿</h1>
-        <p>Traditional Medicine for Modern Wellness</p>
-        <p>Date: {__import__('datetime').datetime.now().strftime('%B %d, %Y')}</p>
-    </div>
-
-    <div class="section">
-        <div class="section-title">PATIENT INFORMATION</div>
-        <div class="patient-info">
-            <div class="info-item">
-                <span class="info-label">Name:</span>
-                <span>{request.patient_name}</span>
-            </div>
-            <div class="info-item">
-                <span class="info-label">Age:</span>
-                <span>{request.patient_age} years</span>
-            </div>
-            <div class="info-item">
-                <span class="info-label">Gender:</span>
-                <span>{request.patient_gender}</span>
-            </div>
-            <div class="info-item">
-                <span class="info-label">Date:</span>
-                <span>{__import__('datetime').datetime.now().strftime('%d/%m/%Y')}</span>
-            </div>
-        </div>
-    </div>
-
-    <div class="section">
-        <div class="section-title">SYMPTOMS</div>
-        <div class="symptoms-list">
-            <ul>
-                {''.join([f'<li>{symptom}</li>' for symptom in request.symptoms])}
-            </ul>
-        </div>
-    </div>
-
-    <div class="section">
-        <div class="section-title">HEALTH CONDITIONS</div>
-        <div class="conditions-list">
-            <ul>
-                {''.join([f'<li>{condition}</li>' for condition in request.health_conditions]) if request.health_conditions else '<li>None reported</li>'}
-            </ul>
-        </div>
-    </div>
-
-    <div class="section">
-        <div class="section-title">PRESCRIBED MEDICINES</div>
-        <table class="medicines-table">
-            <thead>
-                <tr>
-                    <th style="width: 5%">#</th>
-                    <th style="width: 35%">Medicine Name</th>
-                    <th style="width: 30%">Dosage</th>
-                    <th style="width: 30%">Timing</th>
-                </tr>
-            </thead>
-            <tbody>
-                {''.join([f'''
-                <tr>
-                    <td>{idx + 1}</td>
-                    <td><strong>{med.medicine_name}</strong></td>
-                    <td>{med.dosage}</td>
-                    <td>{med.timing}</td>
-                </tr>
-                ''' for idx, med in enumerate(request.medicines)])}
-            </tbody>
-        </table>
-    </div>
-
-    <div class="footer">
-        <div class="signature">
-            <p class="doctor-name">Dr. {request.doctor_name}</p>
-            {f'<p>Registration No: {request.doctor_registration}</p>' if request.doctor_registration else ''}
-            <p style="color: #4B95AF; margin-top: 5px;">Ayurvedic Practitioner</p>
-        </div>
-    </div>
-
-    <button class="print-button" onclick="window.print()">🖨️ Print Prescription</button>
-
-    <script>
-        // Auto-focus for printing
-        window.onload = function() {{
-            // Optional: Auto-print on load (uncomment if needed)
-            // window.print();
-        }}
-    </script>
-</body>
-</html>
-"""
+        # Step 3: Generate HTML prescription (stylesheet inlined, so the stored copy is self-contained wherever it is opened)
+        with request_stage_seconds.time("generate_prescription", "render"):
+            prescription_html = render_prescription(
+                **render_fields(request, medicines_data)
+            )
+
+        # Step 4: Save prescription and its document together
+        with request_stage_seconds.time("generate_prescription", "save"):
+            prescription_id = await adb.create_prescription(
+                user_id=current_user["user_id"],
+                patient_id=patient["id"],
+                symptoms=request.symptoms,
+                health_conditions=request.health_conditions,
+                diagnosis=diagnosis,
+                medicines=medicines_data,
+                notes=None,
+                document_html=prescription_html
+            )
 
+        if PUBLIC_BASE_URL:
+            prescription_html = link_stylesheet(prescription_html, PUBLIC_BASE_URL + STYLESHEET_PATH)
         return {
             "success": True,
             "prescription_html": prescription_html,
             "prescription_id": prescription_id,
+            "document_url": f"/api/prescriptions/{prescription_id}/document",
             "patient_id": patient["id"],
             "patient_name": patient["name"]
         }
@@ -731,6 +840,63 @@ async def generate_prescription(request: GeneratePrescriptionRequest, current_us
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating prescription: {str(e)}")
 
+@app.post("/api/prescription/generate/batch")
+async def generate_prescriptions_batch(batch: BatchGeneratePrescriptionRequest,
+                                       current_user: dict = Depends(get_current_user)):
+    """
+    Generate and save many prescriptions at once (all-or-nothing in the database, results per item)
+    """
+    medicines = [prescription_medicines(item) for item in batch.items]
+
+    # Step 1: Render the documents in parallel across the render worker processes
+    fields = [render_fields(item, meds) for item, meds in zip(batch.items, medicines)]
+    chunk_size = -(-len(fields) // PDF_RENDER_WORKERS)
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(render_executor(), render_prescriptions, fields[start:start + chunk_size])
+        for start in range(0, len(fields), chunk_size)
+    ))
+    rendered = [result for chunk in chunks for result in chunk]
+
+    # Step 2: Save the items that rendered in one transaction
+    results = [None] * len(batch.items)
+    to_save = []
+    for idx, (item, meds, (html, error)) in enumerate(zip(batch.items, medicines, rendered)):
+        if error is not None:
+            results[idx] = {"index": idx, "success": False, "error": f"Error rendering prescription: {error}"}
+            continue
+        to_save.append((idx, {
+            "patient_name": item.patient_name,
+            "patient_age": item.patient_age,
+            "patient_gender": item.patient_gender,
+            "symptoms": item.symptoms,
+            "health_conditions": item.health_conditions,
+            "diagnosis": prescription_diagnosis(item),
+            "medicines": meds,
+            "document_html": html,
+        }))
+    try:
+        saved = await adb.create_prescriptions_batch(current_user["user_id"], [data for _, data in to_save])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving prescriptions: {str(e)}")
+
+    for (idx, _), created in zip(to_save, saved):
+        results[idx] = {
+            "index": idx,
+            "success": True,
+            "prescription_id": created["prescription_id"],
+            "document_url": f"/api/prescriptions/{created['prescription_id']}/document",
+            "patient_id": created["patient"]["id"],
+            "patient_name": created["patient"]["name"]
+        }
+
+    return {
+        "success": True,
+        "created": len(saved),
+        "failed": len(results) - len(saved),
+        "results": results
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
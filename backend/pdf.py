@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from cache import SingleFlight, TTLCache
+from profiling import record_offloaded
+
+# Rendering is CPU-bound, so it runs in worker processes and never blocks the event loop
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "256"))
+PDF_CACHE_TTL = float(os.getenv("PDF_CACHE_TTL", "604800"))
+
+# Bump when the layout changes so cached documents are not served for the old one
+PDF_LAYOUT_VERSION = 1
+
+# A4 in points, with a 40pt margin all round
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 40
+
+PRIMARY = (0.161, 0.463, 0.569)    # #297691
+ACCENT = (0.294, 0.584, 0.686)     # #4B95AF
+LABEL = (0.098, 0.392, 0.498)      # #19647F
+RULE = (0.427, 0.706, 0.804)       # #6DB4CD
+TEXT = (0.020, 0.204, 0.271)       # #053445
+STRIPE = (0.973, 0.976, 0.980)     # #f8f9fa
+WHITE = (1, 1, 1)
+
+# Helvetica advance widths (1/1000 em) for ASCII 32..126; other characters use the width of "n"
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_BOLD_FACTOR = 1.06  # Helvetica-Bold runs about this much wider
+
+def text_width(text: str, size: float, bold: bool = False) -> float:
+    """Width of `text` in points when set in Helvetica at `size`"""
+    units = sum(_HELVETICA_WIDTHS[ord(ch) - 32] if 32 <= ord(ch) < 127 else 556 for ch in text)
+    return units * size / 1000 * (_BOLD_FACTOR if bold else 1)
+
+def wrap_text(text: str, size: float, width: float, bold: bool = False) -> List[str]:
+    """Greedy word wrap to lines no wider than `width` (overlong words are split)"""
+    lines = []
+    line = ""
+    for word in str(text).split():
+        candidate = f"{line} {word}" if line else word
+        if text_width(candidate, size, bold) <= width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        while text_width(word, size, bold) > width and len(word) > 1:
+            cut = len(word) - 1
+            while cut > 1 and text_width(word[:cut], size, bold) > width:
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        line = word
+    if line or not lines:
+        lines.append(line)
+    return lines
+
+def _pdf_string(text: str) -> bytes:
+    # The standard fonts only cover WinAnsi (cp1252); anything else prints as "?"
+    raw = str(text).encode("cp1252", "replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+class PdfDocument:
+    """Minimal PDF writer: Helvetica text, filled rectangles and lines on A4 pages, y measured from the top"""
+
+    def __init__(self):
+        self.pages: List[List[bytes]] = []
+        self.add_page()
+
+    def add_page(self):
+        self.pages.append([])
+
+    def _emit(self, op: str):
+        self.pages[-1].append(op.encode("ascii"))
+
+    def text(self, x: float, y: float, text: str, size: float = 11, bold: bool = False, color=TEXT):
+        """Draw one line of text with its baseline at `y`"""
+        font = "F2" if bold else "F1"
+        self._emit(f"{color[0]:.3f} {color[1]:.3f} {color[2]:.3f} rg BT /{font} {size:g} Tf {x:.2f} {PAGE_HEIGHT - y:.2f} Td")
+        self.pages[-1].append(_pdf_string(text) + b" Tj ET")
+
+    def rect(self, x: float, y: float, width: float, height: float, color):
+        """Fill a rectangle whose top-left corner is (x, y)"""
+        self._emit(f"{color[0]:.3f} {color[1]:.3f} {color[2]:.3f} rg {x:.2f} {PAGE_HEIGHT - y - height:.2f} {width:.2f} {height:.2f} re f")
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, color, width: float = 1):
+        self._emit(f"{color[0]:.3f} {color[1]:.3f} {color[2]:.3f} RG {width:g} w {x1:.2f} {PAGE_HEIGHT - y1:.2f} m {x2:.2f} {PAGE_HEIGHT - y2:.2f} l S")
+
+    def to_bytes(self) -> bytes:
+        """Serialize the document (content streams are Flate-compressed)"""
+        page_count = len(self.pages)
+        # Objects: 1 catalog, 2 page tree, 3-4 fonts, then a (page, content) pair per page
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                " ".join(f"{5 + 2 * i} 0 R" for i in range(page_count)), page_count
+            )).encode("ascii"),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ]
+        for i, ops in enumerate(self.pages):
+            stream = zlib.compress(b"\n".join(ops))
+            objects.append((
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {6 + 2 * i} 0 R >>"
+            ).encode("ascii"))
+            objects.append(
+                f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode("ascii") + stream + b"\nendstream"
+            )
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += f"{number} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+        xref = len(out)
+        out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+        for offset in offsets:
+            out += f"{offset:010d} 00000 n \n".encode("ascii")
+        out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii")
+        return bytes(out)
+
+class _Layout:
+    """Top-to-bottom cursor over a PdfDocument that starts a new page when content would not fit"""
+
+    def __init__(self, doc: PdfDocument):
+        self.doc = doc
+        self.y = MARGIN
+
+    def ensure(self, height: float):
+        if self.y + height > PAGE_HEIGHT - MARGIN:
+            self.doc.add_page()
+            self.y = MARGIN
+
+    def section(self, title: str):
+        self.ensure(60)
+        self.y += 10
+        self.doc.rect(MARGIN, self.y, PAGE_WIDTH - 2 * MARGIN, 24, PRIMARY)
+        self.doc.text(MARGIN + 12, self.y + 16, title, size=12, bold=True, color=WHITE)
+        self.y += 36
+
+    def bullets(self, items: List[str]):
+        width = PAGE_WIDTH - 2 * MARGIN - 40
+        for item in items:
+            lines = wrap_text(item, 11, width)
+            self.ensure(16 * len(lines))
+            self.doc.text(MARGIN + 12, self.y + 11, "•", size=11, bold=True, color=PRIMARY)
+            for line in lines:
+                self.doc.text(MARGIN + 28, self.y + 11, line)
+                self.y += 16
+        self.y += 6
+
+def _format_date(value, fmt: str) -> str:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.strftime(fmt)
+
+def render_pdf(data: Dict) -> bytes:
+    """Lay out a prescription (same fields as renderer.render_prescription, dated by `date`) as PDF bytes"""
+    doc = PdfDocument()
+    layout = _Layout(doc)
+    content_width = PAGE_WIDTH - 2 * MARGIN
+    center = PAGE_WIDTH / 2
+
+    # Step 1: Header
+    for text, size, bold, color in (
+        ("AYURVEDIC PRESCRIPTION", 22, True, PRIMARY),
+        ("Traditional Medicine for Modern Wellness", 11, False, ACCENT),
+        (f"Date: {_format_date(data['date'], '%B %d, %Y')}", 11, False, ACCENT),
+    ):
+        layout.y += size + 6
+        doc.text(center - text_width(text, size, bold) / 2, layout.y, text, size=size, bold=bold, color=color)
+    layout.y += 14
+    doc.line(MARGIN, layout.y, PAGE_WIDTH - MARGIN, layout.y, PRIMARY, width=3)
+    layout.y += 16
+
+    # Step 2: Patient information in two columns
+    layout.section("PATIENT INFORMATION")
+    age = data.get("patient_age")
+    fields = [
+        ("Name:", data.get("patient_name") or ""),
+        ("Age:", f"{age} years" if age is not None else ""),
+        ("Gender:", data.get("patient_gender") or ""),
+        ("Date:", _format_date(data["date"], "%d/%m/%Y")),
+    ]
+    column_width = content_width / 2
+    for row in range(0, len(fields), 2):
+        for col, (label, value) in enumerate(fields[row:row + 2]):
+            x = MARGIN + 12 + col * column_width
+            doc.text(x, layout.y + 11, label, bold=True, color=LABEL)
+            doc.text(x + 70, layout.y + 11, wrap_text(value, 11, column_width - 90)[0])
+        layout.y += 22
+    layout.y += 4
+
+    # Step 3: Symptoms and conditions
+    layout.section("SYMPTOMS")
+    layout.bullets(data.get("symptoms") or [])
+    layout.section("HEALTH CONDITIONS")
+    layout.bullets(data.get("health_conditions") or ["None reported"])
+
+    # Step 4: Medicines table (header repeated on every page it spans)
+    columns = [("#", 0.05), ("Medicine Name", 0.35), ("Dosage", 0.30), ("Timing", 0.30)]
+    widths = [content_width * share for _, share in columns]
+
+    def table_header():
+        doc.rect(MARGIN, layout.y, content_width, 24, ACCENT)
+        x = MARGIN
+        for (title, _), width in zip(columns, widths):
+            doc.text(x + 6, layout.y + 16, title, size=11, bold=True, color=WHITE)
+            x += width
+        layout.y += 24
+
+    layout.section("PRESCRIBED MEDICINES")
+    table_header()
+    for idx, med in enumerate(data.get("medicines") or []):
+        cells = [
+            [str(idx + 1)],
+            wrap_text(med.get("medicine_name") or "", 11, widths[1] - 12, bold=True),
+            wrap_text(med.get("dosage") or "", 11, widths[2] - 12),
+            wrap_text(med.get("timing") or "", 11, widths[3] - 12),
+        ]
+        height = 14 * max(len(cell) for cell in cells) + 12
+        if layout.y + height > PAGE_HEIGHT - MARGIN:
+            doc.add_page()
+            layout.y = MARGIN
+            table_header()
+        if idx % 2 == 1:
+            doc.rect(MARGIN, layout.y, content_width, height, STRIPE)
+        x = MARGIN
+        for col, (cell, width) in enumerate(zip(cells, widths)):
+            for n, line in enumerate(cell):
+                doc.text(x + 6, layout.y + 18 + 14 * n, line, bold=(col == 1))
+            x += width
+        layout.y += height
+        doc.line(MARGIN, layout.y, PAGE_WIDTH - MARGIN, layout.y, RULE, width=0.75)
+
+    # Step 5: Signature block, right aligned
+    layout.ensure(120)
+    layout.y += 30
+    doc.line(MARGIN, layout.y, PAGE_WIDTH - MARGIN, layout.y, RULE, width=2)
+    layout.y += 50
+    right = PAGE_WIDTH - MARGIN
+    signature = [(f"Dr. {data.get('doctor_name') or ''}", True, PRIMARY)]
+    if data.get("doctor_registration"):
+        signature.append((f"Registration No: {data['doctor_registration']}", False, TEXT))
+    signature.append(("Ayurvedic Practitioner", False, ACCENT))
+    for text, bold, color in signature:
+        layout.y += 16
+        doc.text(right - text_width(text, 11, bold), layout.y, text, bold=bold, color=color)
+
+    return doc.to_bytes()
+
+def document_digest(data: Dict) -> str:
+    """Content address of a prescription document: hash of everything that affects its rendering"""
+    canonical = json.dumps({"layout": PDF_LAYOUT_VERSION, **data}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# digest -> PDF bytes; reprints of an unchanged prescription are served from here
+pdf_cache = TTLCache(maxsize=PDF_CACHE_MAX_ENTRIES, ttl=PDF_CACHE_TTL)
+# Double-tapped print buttons share one render
+pdf_flight = SingleFlight()
+_executor: Optional[ProcessPoolExecutor] = None
+
+def render_executor() -> ProcessPoolExecutor:
+    """Worker processes for CPU-bound document rendering (PDFs and batch HTML)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS)
+    return _executor
+
+async def _render_and_cache(digest: str, data: Dict) -> bytes:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    pdf = await loop.run_in_executor(render_executor(), render_pdf, data)
+    record_offloaded("render_pdf", time.perf_counter() - started)
+    pdf_cache.set(digest, pdf)
+    return pdf
+
+async def prescription_pdf(data: Dict) -> Tuple[str, bytes]:
+    """(digest, PDF bytes) for a prescription, rendered in the worker pool on a cache miss"""
+    digest = document_digest(data)
+    pdf = pdf_cache.get(digest)
+    if pdf is None:
+        pdf = await pdf_flight.do(digest, _render_and_cache, digest, data)
+    return digest, pdf
+
+def shutdown():
+    """Stop the render worker processes"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
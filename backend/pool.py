@@ -0,0 +1,246 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection becomes free before the checkout timeout"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of reusable DB-API connections"""
+
+    def __init__(self, connect: Callable, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 30.0, max_idle: float = 300.0,
+                 validate: Optional[Callable] = None, validate_after: float = 30.0,
+                 reap_interval: float = 60.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+
+        self._connect = connect
+        self._validate = validate
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.validate_after = validate_after
+
+        # Idle connections as (conn, released_at); the most recently used sits on the right
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "exhausted": 0,
+            "created": 0,
+            "closed": 0,
+            "health_check_failures": 0,
+            "reaped": 0,
+        }
+
+        for _ in range(min_size):
+            conn = self._open()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+        self._reaper = None
+        if reap_interval and reap_interval > 0:
+            self._reaper = threading.Thread(
+                target=self._reap_loop, args=(reap_interval,), name="db-pool-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def acquire(self):
+        """Check a connection out of the pool, blocking up to `timeout` seconds"""
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        conn = None
+        released_at = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolExhaustedError("Connection pool is closed")
+                if self._idle:
+                    # LIFO keeps a few hot connections busy and lets the rest go idle for reaping
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot now and open the connection outside the lock
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["exhausted"] += 1
+                    raise PoolExhaustedError(
+                        f"No database connection available within {self.timeout}s (max_size={self.max_size})"
+                    )
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._stats["waits"] += 1
+                self._cond.wait(remaining)
+
+            if waited_since is not None:
+                self._stats["wait_seconds"] += time.monotonic() - waited_since
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif not self._is_healthy(conn, released_at):
+                self._discard(conn)
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                conn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """Return a connection to the pool (or close it if it is broken)"""
+        if not discard and getattr(conn, "closed", 0):
+            discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard or self._closed:
+            self._discard(conn)
+
+    def reap(self) -> int:
+        """Close connections idle for longer than `max_idle`, keeping `min_size` open"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            # Oldest idle connections are on the left
+            while (self._idle and self._size > self.min_size
+                   and now - self._idle[0][1] > self.max_idle):
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                expired.append(conn)
+            self._stats["reaped"] += len(expired)
+
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def close(self):
+        """Close every idle connection and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict:
+        """Snapshot of pool occupancy and exhaustion counters"""
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                **self._stats,
+            }
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["closed"] += 1
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if getattr(conn, "closed", 0):
+            return False
+        # Only ping connections that sat idle long enough for the server or a proxy to drop them
+        if self._validate is None or time.monotonic() - released_at < self.validate_after:
+            return True
+        try:
+            self._validate(conn)
+            return True
+        except Exception:
+            return False
+
+    def _reap_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            if self._closed:
+                return
+            try:
+                self.reap()
+            except Exception:
+                pass
+
+
+class ThreadLocalConnection:
+    """One reusable connection per thread (for SQLite, whose connections are thread-bound)"""
+
+    def __init__(self, connect: Callable):
+        self._connect = connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"checkouts": 0, "created": 0, "closed": 0}
+
+    def acquire(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        with self._lock:
+            self._stats["checkouts"] += 1
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._stats["created"] += 1
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """Keep the connection for the next call on this thread unless it is broken"""
+        if discard:
+            self._local.conn = None
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._stats["closed"] += 1
+
+    def close(self):
+        """Close the calling thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self.release(conn, discard=True)
+
+    def stats(self) -> Dict:
+        """Checkout counters (there is no shared capacity to exhaust)"""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,289 @@
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+# Share of requests profiled, optionally only those whose path matches a regex; adjustable at runtime
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_ROUTE_PATTERN = os.getenv("PROFILING_ROUTE_PATTERN", "")
+# Where profiles (and the runtime switch, shared by all workers) are kept; the oldest beyond the limit are deleted
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_SETTINGS_CHECK_SECONDS = 1.0
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class RequestProfile:
+    """cProfile of one sampled request, plus the work it waited on away from the event loop thread"""
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.profiler = cProfile.Profile()
+        self._thread_profilers: List[cProfile.Profile] = []
+        # what -> {"calls", "seconds"}, for time cProfile on the event loop cannot see
+        self._offloaded: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def run_in_thread(self, what: str, func: Callable):
+        """Call `func` under a profiler of the current worker thread, merged into this profile when saved"""
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return func()
+        finally:
+            profiler.disable()
+            self.add_offloaded(what, time.perf_counter() - started, profiler)
+
+    def add_offloaded(self, what: str, seconds: float, profiler: cProfile.Profile = None):
+        with self._lock:
+            entry = self._offloaded.setdefault(what, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            if profiler is not None:
+                self._thread_profilers.append(profiler)
+
+    def stats(self) -> pstats.Stats:
+        """The event loop thread's profile merged with every worker thread profile"""
+        stats = pstats.Stats(self.profiler)
+        with self._lock:
+            for profiler in self._thread_profilers:
+                stats.add(profiler)
+        return stats
+
+    def offloaded(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                what: {"calls": entry["calls"], "seconds": round(entry["seconds"], 6)}
+                for what, entry in sorted(self._offloaded.items(), key=lambda item: -item[1]["seconds"])
+            }
+
+
+# Profile of the request being handled, if it was sampled
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+def record_offloaded(what: str, seconds: float):
+    """Note time the current request spent waiting on another process or service (no-op unless it is profiled)"""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add_offloaded(what, seconds)
+
+
+class RequestProfiler:
+    """Samples requests for profiling and keeps their profiles, as pstats files, in `directory`
+
+    The switch is written to settings.json in the same directory, so every worker process
+    follows it. Only one request per process is profiled at a time: cProfile hooks the whole
+    event loop thread, so other requests interleaved with it show up in its profile too.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, sample_rate: float = PROFILING_SAMPLE_RATE,
+                 route_pattern: str = PROFILING_ROUTE_PATTERN, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._settings_path = os.path.join(directory, "settings.json")
+        self._defaults = {"sample_rate": sample_rate, "route_pattern": route_pattern}
+        self._apply(self._defaults)
+        self._settings_mtime = None
+        self._checked_at = float("-inf")
+        self._active = False
+        self._lock = threading.Lock()
+        self._stats = {"profiled": 0, "skipped_busy": 0, "saved": 0, "errors": 0}
+
+    def _apply(self, settings: Dict):
+        self._settings = {"sample_rate": float(settings["sample_rate"]), "route_pattern": settings["route_pattern"]}
+        self._pattern = re.compile(settings["route_pattern"]) if settings["route_pattern"] else None
+
+    def _reload_settings(self):
+        """Pick up a switch flipped through another worker (checked at most once a second)"""
+        now = time.monotonic()
+        if now - self._checked_at < PROFILE_SETTINGS_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._settings_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._settings_mtime:
+            return
+        self._settings_mtime = mtime
+        try:
+            if mtime is None:
+                self._apply(self._defaults)
+            else:
+                with open(self._settings_path) as f:
+                    self._apply(json.load(f))
+        except (OSError, ValueError, KeyError, re.error) as e:
+            print(f"WARNING: could not load profiling settings: {str(e)}")
+
+    def settings(self) -> Dict:
+        self._reload_settings()
+        return dict(self._settings)
+
+    def configure(self, sample_rate: float, route_pattern: str = "") -> Dict:
+        """Set the switch for every worker (ValueError for a rate outside 0-1 or an invalid pattern)"""
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        try:
+            re.compile(route_pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid route pattern: {e}")
+        settings = {"sample_rate": sample_rate, "route_pattern": route_pattern}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._settings_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(settings, f)
+        os.replace(tmp_path, self._settings_path)
+        self._apply(settings)
+        self._settings_mtime = os.stat(self._settings_path).st_mtime_ns
+        return dict(self._settings)
+
+    def start(self, method: str, path: str) -> Optional[RequestProfile]:
+        """A started profile if this request is sampled, else None"""
+        self._reload_settings()
+        sample_rate = self._settings["sample_rate"]
+        if sample_rate <= 0 or (self._pattern is not None and not self._pattern.search(path)):
+            return None
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return None
+        if self._active:
+            self._stats["skipped_busy"] += 1
+            return None
+        self._active = True
+        self._stats["profiled"] += 1
+        profile = RequestProfile(uuid.uuid4().hex, method, path)
+        profile.profiler.enable()
+        return profile
+
+    def finish(self, profile: RequestProfile, route: str, status: Optional[int], duration: float):
+        """Stop profiling and write the profile (on a worker thread, so the event loop is not held up)"""
+        profile.profiler.disable()
+        self._active = False
+        metadata = {
+            "request_id": profile.request_id,
+            "route": route,
+            "method": profile.method,
+            "path": profile.path,
+            "status": status,
+            "started_at": profile.started_at,
+            "duration_ms": round(duration * 1000, 3),
+            "offloaded": profile.offloaded(),
+        }
+        asyncio.get_running_loop().run_in_executor(None, self._save, profile, metadata)
+
+    def _save(self, profile: RequestProfile, metadata: Dict):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.stats().dump_stats(os.path.join(self.directory, f"{profile.request_id}.prof"))
+            with open(os.path.join(self.directory, f"{profile.request_id}.json"), "w") as f:
+                json.dump(metadata, f)
+            with self._lock:
+                self._stats["saved"] += 1
+                self._prune()
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            print(f"WARNING: could not save profile {profile.request_id}: {str(e)}")
+
+    def _prune(self):
+        """Delete the oldest profiles beyond max_files"""
+        for request_id, _ in self._stored()[self.max_files:]:
+            for ext in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, request_id + ext))
+                except FileNotFoundError:
+                    pass
+
+    def _stored(self) -> List:
+        """(request_id, mtime) of every stored profile, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        stored = []
+        for name in names:
+            request_id, ext = os.path.splitext(name)
+            if ext == ".json" and _PROFILE_ID.match(request_id):
+                try:
+                    stored.append((request_id, os.stat(os.path.join(self.directory, name)).st_mtime))
+                except FileNotFoundError:
+                    continue
+        stored.sort(key=lambda item: item[1], reverse=True)
+        return stored
+
+    def profiles(self, route: str = None, limit: int = 50) -> List[Dict]:
+        """Metadata of stored profiles, newest first, optionally only those of one route"""
+        found = []
+        for request_id, _ in self._stored():
+            try:
+                with open(os.path.join(self.directory, f"{request_id}.json")) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if route is None or metadata.get("route") == route:
+                found.append(metadata)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def profile_path(self, request_id: str) -> Optional[str]:
+        """Path of a stored pstats file, or None (also for ids that are not ours)"""
+        if not _PROFILE_ID.match(request_id):
+            return None
+        path = os.path.join(self.directory, f"{request_id}.prof")
+        return path if os.path.exists(path) else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"active": self._active, **self._stats}
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests RequestProfiler samples; the rest pass straight through
+
+    A profiled response carries its profile id in the X-Profile-Id header.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = self.profiler.start(scope["method"], scope["path"])
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = {}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", profile.request_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            current_profile.reset(token)
+            # The router records the matched route template (e.g. /api/patients/{patient_id}) in the scope
+            route = getattr(scope.get("route"), "path", scope["path"])
+            self.profiler.finish(profile, route, status.get("code"), time.perf_counter() - started)
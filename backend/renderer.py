@@ -0,0 +1,307 @@
+import hashlib
+from datetime import datetime
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+# Served once as a cacheable static asset to pages viewed over HTTP; inlined into the stored, self-contained copy
+PRESCRIPTION_CSS = """\
+@media print {
+    body { margin: 0; padding: 20px; }
+}
+body {
+    font-family: 'Arial', sans-serif;
+    max-width: 800px;
+    margin: 0 auto;
+    padding: 20px;
+    background: white;
+}
+.header {
+    text-align: center;
+    border-bottom: 3px solid #297691;
+    padding-bottom: 20px;
+    margin-bottom: 30px;
+}
+.header h1 {
+    color: #297691;
+    margin: 0;
+    font-size: 28px;
+}
+.header p {
+    color: #4B95AF;
+    margin: 5px 0;
+}
+.section {
+    margin-bottom: 25px;
+}
+.section-title {
+    background: #297691;
+    color: white;
+    padding: 10px 15px;
+    margin-bottom: 15px;
+    font-weight: bold;
+    font-size: 16px;
+}
+.patient-info {
+    display: grid;
+    grid-template-columns: 1fr 1fr;
+    gap: 10px;
+    padding: 0 15px;
+}
+.info-item {
+    padding: 8px 0;
+}
+.info-label {
+    color: #19647F;
+    font-weight: bold;
+    display: inline-block;
+    width: 120px;
+}
+.medicines-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin-top: 10px;
+}
+.medicines-table th {
+    background: #4B95AF;
+    color: white;
+    padding: 12px;
+    text-align: left;
+    font-weight: bold;
+}
+.medicines-table td {
+    padding: 12px;
+    border-bottom: 1px solid #6DB4CD;
+}
+.medicines-table tr:nth-child(even) {
+    background: #f8f9fa;
+}
+.symptoms-list, .conditions-list {
+    padding: 0 15px;
+}
+.symptoms-list ul, .conditions-list ul {
+    list-style: none;
+    padding: 0;
+}
+.symptoms-list li, .conditions-list li {
+    padding: 5px 0;
+    color: #053445;
+}
+.symptoms-list li:before, .conditions-list li:before {
+    content: "• ";
+    color: #297691;
+    font-weight: bold;
+    margin-right: 8px;
+}
+.footer {
+    margin-top: 50px;
+    padding-top: 20px;
+    border-top: 2px solid #6DB4CD;
+    text-align: right;
+}
+.signature {
+    margin-top: 60px;
+}
+.doctor-name {
+    font-weight: bold;
+    color: #297691;
+}
+.print-button {
+    background: #297691;
+    color: white;
+    border: none;
+    padding: 12px 30px;
+    font-size: 16px;
+    cursor: pointer;
+    border-radius: 5px;
+    margin: 20px auto;
+    display: block;
+}
+.print-button:hover {
+    background: #19647F;
+}
+@media print {
+    .print-button {
+        display: none;
+    }
+}
+"""
+
+# Content-addressed URL, so the asset can be cached forever and a changed stylesheet gets a new URL
+STYLESHEET_HASH = hashlib.sha256(PRESCRIPTION_CSS.encode("utf-8")).hexdigest()[:12]
+STYLESHEET_PATH = f"/static/prescription-{STYLESHEET_HASH}.css"
+STYLESHEET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+PRESCRIPTION_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    {stylesheet}
+</head>
+<body>
+    <div class="header">
+        <h1>🌿 AYURVEDIC PRESCRIPTION 🌿</h1>
+        <p>Traditional Medicine for Modern Wellness</p>
+        <p>Date: {long_date}</p>
+    </div>
+
+    <div class="section">
+        <div class="section-title">PATIENT INFORMATION</div>
+        <div class="patient-info">
+            <div class="info-item">
+                <span class="info-label">Name:</span>
+                <span>{patient_name}</span>
+            </div>
+            <div class="info-item">
+                <span class="info-label">Age:</span>
+                <span>{patient_age} years</span>
+            </div>
+            <div class="info-item">
+                <span class="info-label">Gender:</span>
+                <span>{patient_gender}</span>
+            </div>
+            <div class="info-item">
+                <span class="info-label">Date:</span>
+                <span>{short_date}</span>
+            </div>
+        </div>
+    </div>
+
+    <div class="section">
+        <div class="section-title">SYMPTOMS</div>
+        <div class="symptoms-list">
+            <ul>
+                {symptoms}
+            </ul>
+        </div>
+    </div>
+
+    <div class="section">
+        <div class="section-title">HEALTH CONDITIONS</div>
+        <div class="conditions-list">
+            <ul>
+                {health_conditions}
+            </ul>
+        </div>
+    </div>
+
+    <div class="section">
+        <div class="section-title">PRESCRIBED MEDICINES</div>
+        <table class="medicines-table">
+            <thead>
+                <tr>
+                    <th style="width: 5%">#</th>
+                    <th style="width: 35%">Medicine Name</th>
+                    <th style="width: 30%">Dosage</th>
+                    <th style="width: 30%">Timing</th>
+                </tr>
+            </thead>
+            <tbody>
+                {medicines}
+            </tbody>
+        </table>
+    </div>
+
+    <div class="footer">
+        <div class="signature">
+            <p class="doctor-name">Dr. {doctor_name}</p>
+            {doctor_registration}
+            <p style="color: #4B95AF; margin-top: 5px;">Ayurvedic Practitioner</p>
+        </div>
+    </div>
+
+    <button class="print-button" onclick="window.print()">🖨️ Print Prescription</button>
+
+    <script>
+        // Auto-focus for printing
+        window.onload = function() {{
+            // Optional: Auto-print on load (uncomment if needed)
+            // window.print();
+        }}
+    </script>
+</body>
+</html>
+"""
+
+MEDICINE_ROW = """
+                <tr>
+                    <td>{}</td>
+                    <td><strong>{}</strong></td>
+                    <td>{}</td>
+                    <td>{}</td>
+                </tr>
+                """
+
+# Parsed once at import: alternating literal text and field names, rendered with a single join
+_COMPILED_TEMPLATE = [
+    (literal, field) for literal, field, _, _ in Formatter().parse(PRESCRIPTION_TEMPLATE)
+]
+
+_INLINE_STYLESHEET = f"<style>\n{PRESCRIPTION_CSS}</style>"
+
+_HTML_ESCAPES = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;",
+})
+
+def escape(value) -> str:
+    """HTML-escape text and attribute values in one pass over the string"""
+    if value is None:
+        return ""
+    return str(value).translate(_HTML_ESCAPES)
+
+def render_prescription(patient_name: str, patient_age: Optional[int], patient_gender: str,
+                        symptoms: List[str], health_conditions: List[str], medicines: List[Dict],
+                        doctor_name: str, doctor_registration: Optional[str] = None,
+                        stylesheet_url: Optional[str] = None, now: Optional[datetime] = None) -> str:
+    """Render the printable prescription page (medicines are dicts with medicine_name, dosage and timing)
+
+    The stylesheet is inlined unless `stylesheet_url` is given, in which case it is linked.
+    """
+    now = now or datetime.now()
+    fields = {
+        "stylesheet": (
+            f'<link rel="stylesheet" href="{escape(stylesheet_url)}">' if stylesheet_url else _INLINE_STYLESHEET
+        ),
+        "long_date": now.strftime("%B %d, %Y"),
+        "short_date": now.strftime("%d/%m/%Y"),
+        "patient_name": escape(patient_name),
+        "patient_age": escape(patient_age),
+        "patient_gender": escape(patient_gender),
+        "symptoms": "".join(f"<li>{escape(symptom)}</li>" for symptom in symptoms),
+        "health_conditions": (
+            "".join(f"<li>{escape(condition)}</li>" for condition in health_conditions)
+            if health_conditions else "<li>None reported</li>"
+        ),
+        "medicines": "".join(
+            MEDICINE_ROW.format(idx + 1, escape(med.get("medicine_name")), escape(med.get("dosage")), escape(med.get("timing")))
+            for idx, med in enumerate(medicines)
+        ),
+        "doctor_name": escape(doctor_name),
+        "doctor_registration": (
+            f"<p>Registration No: {escape(doctor_registration)}</p>" if doctor_registration else ""
+        ),
+    }
+    parts = []
+    for literal, field in _COMPILED_TEMPLATE:
+        parts.append(literal)
+        if field is not None:
+            parts.append(fields[field])
+    return "".join(parts)
+
+def link_stylesheet(html: str, stylesheet_url: str = STYLESHEET_PATH) -> str:
+    """Swap a rendered page's inlined stylesheet for a link (a page inlining an older stylesheet is returned as is)"""
+    return html.replace(_INLINE_STYLESHEET, f'<link rel="stylesheet" href="{escape(stylesheet_url)}">', 1)
+
+def render_prescriptions(items: List[Dict]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Render many prescriptions (render_prescription keyword dicts) as (html, error) pairs"""
+    results = []
+    for item in items:
+        try:
+            results.append((render_prescription(**item), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.pop("DATABASE_URL", None)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["DB_VERIFY_QUERY_PLANS"] = "false"
+# database.py opens vidhya.db in the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="vidhya-tests-"))
+
+import database  # noqa: E402
+
+# Tables as created by init_db before versioned migrations
+BASELINE_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT,
+        registration_number TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE patients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        age INTEGER,
+        gender TEXT,
+        phone TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+    CREATE TABLE prescriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        symptoms TEXT NOT NULL,
+        health_conditions TEXT,
+        diagnosis_primary TEXT,
+        diagnosis_secondary TEXT,
+        diagnosis_ayurvedic TEXT,
+        medicines TEXT NOT NULL,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (patient_id) REFERENCES patients(id)
+    );
+"""
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A freshly migrated SQLite database"""
+    database_ = database.Database(db_path=str(tmp_path / "fresh.db"))
+    yield database_
+    database_.close()
+
+
+@pytest.fixture
+def baseline_path(tmp_path):
+    """Path of a SQLite database with only the pre-migration tables (seed it, then open it with Database)"""
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    return path
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+import cache
+from cache import SingleFlight, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_get_and_set():
+    entries = TTLCache(maxsize=4)
+    entries.set("a", 1)
+    assert entries.get("a") == 1
+    assert entries.get("b", "missing") == "missing"
+    assert entries.stats()["hits"] == 1 and entries.stats()["misses"] == 1
+
+
+def test_entries_expire(clock):
+    entries = TTLCache(maxsize=4, ttl=10)
+    entries.set("a", 1)
+    entries.set("b", 2, ttl=30)
+    clock.now += 10
+    assert entries.get("a") is None
+    assert entries.get("b") == 2
+    assert entries.values() == [2]
+    assert entries.stats()["expirations"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    entries = TTLCache(maxsize=2)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+    entries.set("c", 3)
+    assert entries.get("b") is None
+    assert entries.values() == [1, 3]
+    assert entries.stats()["evictions"] == 1
+
+
+def test_peek_does_not_count_or_refresh():
+    entries = TTLCache(maxsize=2)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    assert entries.peek("a") == 1
+    entries.set("c", 3)
+    assert entries.peek("a") is None
+    stats = entries.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 0)
+
+
+def test_invalidate_and_clear():
+    entries = TTLCache(maxsize=4)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.invalidate("a")
+    entries.invalidate("missing")
+    assert len(entries) == 1
+    entries.clear()
+    assert len(entries) == 0
+
+
+def test_maxsize_must_be_positive():
+    with pytest.raises(ValueError):
+        TTLCache(maxsize=0)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fetch, 21) for _ in range(5)))
+
+    assert asyncio.run(run()) == [42] * 5
+    assert calls == [21]
+    assert flight.stats() == {"in_flight": 0, "calls": 5, "executions": 1, "coalesced": 4}
+
+
+def test_single_flight_shares_errors_and_runs_again_afterwards():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        return results, await flight.do("key", ok)
+
+    results, after = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert after == "ok"
+    assert flight.stats()["executions"] == 2
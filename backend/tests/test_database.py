@@ -0,0 +1,73 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def user_id(db):
+    return db.create_user("dr@example.com", "x", "Dr A")
+
+
+def test_find_or_create_patient_matches_case_insensitively(db, user_id):
+    patient, created = db.find_or_create_patient(user_id, "Asha", 30, "F")
+    again, created_again = db.find_or_create_patient(user_id, "asha", 30, "f")
+    assert created and not created_again
+    assert again["id"] == patient["id"]
+
+
+def test_find_or_create_patient_records_a_missing_phone(db, user_id):
+    patient, _ = db.find_or_create_patient(user_id, "Asha", 30, "F")
+    again, created = db.find_or_create_patient(user_id, "Asha", 30, "F", phone="111")
+    assert not created and again["id"] == patient["id"]
+    assert db.get_patient(patient["id"], user_id)["phone"] == "111"
+
+
+def test_find_or_create_patient_keeps_a_different_phone_apart(db, user_id):
+    first, _ = db.find_or_create_patient(user_id, "Asha", 30, "F", phone="111")
+    second, created = db.find_or_create_patient(user_id, "Asha", 30, "F", phone="222")
+    assert created and second["id"] != first["id"]
+    assert db.find_or_create_patient(user_id, "Asha", 30, "F", phone="222")[0]["id"] == second["id"]
+    # Without a phone there is no telling the two apart, so a third record is made
+    third, created = db.find_or_create_patient(user_id, "Asha", 30, "F")
+    assert created and third["id"] not in (first["id"], second["id"])
+
+
+def test_patient_pages_follow_the_cursor(db, user_id):
+    ids = [db.find_or_create_patient(user_id, f"Patient {i}", 30, "F")[0]["id"] for i in range(5)]
+    seen, cursor = [], None
+    while True:
+        page, cursor = db.get_user_patients(user_id, limit=2, after=cursor)
+        seen.extend(patient["id"] for patient in page)
+        if cursor is None:
+            break
+    # Created within the same second, so the id breaks the tie: newest first, nothing repeated
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_invalid_cursor_is_rejected(db, user_id):
+    with pytest.raises(database.InvalidCursorError):
+        db.get_user_patients(user_id, after="not-a-cursor")
+    with pytest.raises(database.InvalidCursorError):
+        database.decode_cursor(database.encode_cursor({"created_at": None, "id": 1}))
+
+
+def test_cursor_round_trip():
+    cursor = database.encode_cursor({"created_at": "2024-01-01 00:00:00", "id": 7})
+    assert database.decode_cursor(cursor) == ("2024-01-01 00:00:00", 7)
+
+
+def test_medicine_catalog_counts_survive_a_rebuild(db, user_id, monkeypatch):
+    patient, _ = db.find_or_create_patient(user_id, "Asha", 30, "F")
+    db.create_prescription(user_id, patient["id"], ["fever"], [], {"primary": "Fever"}, [{"name": "Tulsi"}])
+    assert db.autocomplete_medicines("tul")[0]["prescription_count"] == 1
+
+    db.create_prescription(user_id, patient["id"], ["fever"], [], {"primary": "Fever"}, [{"name": "Tulsi"}])
+    db.record_ai_medicines(["Tulsi"])
+    assert db.autocomplete_medicines("tul")[0]["prescription_count"] == 2
+
+    # A rebuild reads the table, which already holds the prescriptions counted in memory
+    monkeypatch.setattr(database, "MEDICINE_CATALOG_REFRESH_SECONDS", 0)
+    hit = db.autocomplete_medicines("tul")[0]
+    assert (hit["prescription_count"], hit["ai_suggestion_count"]) == (2, 1)
+    db.create_prescription(user_id, patient["id"], ["fever"], [], {"primary": "Fever"}, [{"name": "Tulsi"}])
+    assert db.autocomplete_medicines("tul")[0]["prescription_count"] == 3
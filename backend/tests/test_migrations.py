@@ -0,0 +1,99 @@
+import json
+import sqlite3
+
+import database
+
+
+def seed(path, patients, prescriptions):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (email, password, name) VALUES ('dr@example.com', 'x', 'Dr A')")
+    conn.executemany("INSERT INTO patients (user_id, name, age, gender, phone) VALUES (1, ?, ?, ?, ?)", patients)
+    conn.executemany(
+        "INSERT INTO prescriptions (user_id, patient_id, symptoms, health_conditions, diagnosis_primary, "
+        "diagnosis_secondary, medicines) VALUES (1, ?, ?, ?, 'Fever', '[]', ?)",
+        [
+            (patient_id, json.dumps(symptoms), json.dumps(conditions),
+             json.dumps([{"name": name} for name in medicines]))
+            for patient_id, symptoms, conditions, medicines in prescriptions
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+def query(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def test_upgrades_baseline_database(baseline_path):
+    seed(baseline_path, [("Asha", 30, "F", None)], [(1, ["fever", "cough"], ["asthma"], ["Tulsi"])])
+    db = database.Database(db_path=baseline_path)
+    try:
+        versions = [version for version, _, _ in db._migrations()]
+        assert query(baseline_path, "SELECT version FROM schema_migrations ORDER BY version") == [
+            (version,) for version in versions
+        ]
+        prescription = db.get_prescription(1, 1)
+        assert prescription["symptoms"] == ["fever", "cough"]
+        assert [hit["name"] for hit in db.autocomplete_medicines("tul")] == ["Tulsi"]
+        assert db.autocomplete_medicines("tul")[0]["prescription_count"] == 1
+        assert [hit["term"] for hit in db.autocomplete_terms("co", "symptom")] == ["cough"]
+    finally:
+        db.close()
+
+
+def test_merges_duplicate_patients(baseline_path, capsys):
+    seed(
+        baseline_path,
+        [
+            ("Asha", 30, "F", "111"),
+            ("asha", 30, "f", "111"),
+            ("ASHA", 30, "F", None),
+            ("Ravi", 40, "M", None),
+        ],
+        [(1, ["fever"], [], []), (2, ["cough"], [], []), (3, ["cold"], [], []), (4, ["fever"], [], [])]
+    )
+    database.Database(db_path=baseline_path).close()
+
+    assert query(baseline_path, "SELECT id, phone FROM patients ORDER BY id") == [(1, "111"), (4, None)]
+    assert query(baseline_path, "SELECT id, patient_id FROM prescriptions ORDER BY id") == [
+        (1, 1), (2, 1), (3, 1), (4, 4)
+    ]
+    output = capsys.readouterr().out
+    assert "Merging duplicate patient 2 into patient 1" in output
+    assert "Merging duplicate patient 3 into patient 1" in output
+
+
+def test_keeps_patients_with_different_phones_apart(baseline_path, capsys):
+    seed(
+        baseline_path,
+        [("Asha", 30, "F", "111"), ("Asha", 30, "F", "222"), ("Asha", 30, "F", None)],
+        [(1, ["fever"], [], []), (2, ["cough"], [], []), (3, ["cold"], [], [])]
+    )
+    database.Database(db_path=baseline_path).close()
+
+    # The record without a phone cannot tell which of the two it is, so nothing is merged
+    assert query(baseline_path, "SELECT id, phone FROM patients ORDER BY id") == [(1, "111"), (2, "222"), (3, None)]
+    assert query(baseline_path, "SELECT id, patient_id FROM prescriptions ORDER BY id") == [(1, 1), (2, 2), (3, 3)]
+    output = capsys.readouterr().out
+    assert "Keeping patient 2 (phone 222) apart from patient 1" in output
+    assert "Merging" not in output
+
+
+def test_reopening_applies_nothing(baseline_path, capsys):
+    seed(baseline_path, [("Asha", 30, "F", None), ("Asha", 30, "F", None)], [(2, ["fever"], [], ["Tulsi"])])
+    database.Database(db_path=baseline_path).close()
+    capsys.readouterr()
+    before = query(baseline_path, "SELECT * FROM prescription_terms ORDER BY prescription_id, term_id")
+
+    db = database.Database(db_path=baseline_path)
+    try:
+        assert "Applied database migration" not in capsys.readouterr().out
+        assert query(baseline_path, "SELECT * FROM prescription_terms ORDER BY prescription_id, term_id") == before
+        assert db.autocomplete_medicines("tul")[0]["prescription_count"] == 1
+    finally:
+        db.close()
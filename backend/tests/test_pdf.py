@@ -0,0 +1,42 @@
+from pdf import render_pdf, text_width, wrap_text
+
+
+def test_short_text_stays_on_one_line():
+    assert wrap_text("Take twice daily", 10, 500) == ["Take twice daily"]
+
+
+def test_wraps_at_word_boundaries():
+    text = "Take one tablet after food twice daily for five days"
+    lines = wrap_text(text, 10, 100)
+    assert len(lines) > 1
+    assert " ".join(lines) == text
+    assert all(text_width(line, 10) <= 100 for line in lines)
+
+
+def test_splits_overlong_words():
+    word = "Ashwagandharishta" * 3
+    lines = wrap_text(word, 12, 60)
+    assert "".join(lines) == word
+    assert all(text_width(line, 12) <= 60 for line in lines)
+
+
+def test_bold_text_wraps_sooner():
+    text = "Ashwagandha churna with warm milk at bedtime"
+    width = text_width(text, 10) + 1
+    assert wrap_text(text, 10, width) == [text]
+    assert len(wrap_text(text, 10, width, bold=True)) == 2
+
+
+def test_empty_text_is_one_empty_line():
+    assert wrap_text("", 10, 100) == [""]
+    assert wrap_text("   ", 10, 100) == [""]
+
+
+def test_render_pdf():
+    content = render_pdf({
+        "date": "2024-01-01 10:00:00",
+        "patient_name": "Asha",
+        "symptoms": ["fever"],
+        "medicines": [{"name": "Tulsi", "dosage": "5 ml", "frequency": "twice daily"}],
+    })
+    assert content.startswith(b"%PDF-") and content.rstrip().endswith(b"%%EOF")
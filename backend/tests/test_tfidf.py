@@ -0,0 +1,110 @@
+import pytest
+
+from tfidf import TfidfEngine, TfidfIndex
+
+FEVER, COUGH, RASH = ('symptom', 1), ('symptom', 2), ('symptom', 3)
+ASTHMA = ('condition', 1)
+
+
+def rows(documents):
+    return [(pid, term_id, kind) for pid, features in documents for kind, term_id in features]
+
+
+DOCUMENTS = [
+    (1, [FEVER, COUGH]),
+    (2, [FEVER]),
+    (3, [RASH]),
+    (4, [FEVER, COUGH, ASTHMA]),
+]
+
+
+def test_rank_orders_by_similarity():
+    index = TfidfIndex()
+    index.add(DOCUMENTS)
+    ranked = index.rank({FEVER: 1, COUGH: 1}, limit=10)
+    assert [pid for pid, _, _, _ in ranked] == [1, 4, 2]
+    assert ranked[0][1] == pytest.approx(1.0)
+    assert ranked[1][2:] == (2, 0)
+    assert index.rank({RASH: 1}, limit=10)[0][:1] == (3,)
+
+
+def test_rank_counts_matched_conditions():
+    index = TfidfIndex()
+    index.add(DOCUMENTS)
+    pid, _, symptom_hits, condition_hits = index.rank({ASTHMA: 1}, limit=1)[0]
+    assert (pid, symptom_hits, condition_hits) == (4, 0, 1)
+
+
+def test_rank_limit_and_unknown_terms():
+    index = TfidfIndex()
+    assert index.rank({FEVER: 1}, limit=5) == []
+    index.add(DOCUMENTS)
+    assert len(index.rank({FEVER: 1}, limit=2)) == 2
+    assert index.rank({FEVER: 1}, limit=0) == []
+    assert index.rank({('symptom', 99): 1}, limit=5) == []
+
+
+def test_ties_put_the_newest_first():
+    index = TfidfIndex()
+    index.add([(1, [FEVER]), (2, [FEVER]), (3, [FEVER])])
+    assert [pid for pid, _, _, _ in index.rank({FEVER: 1}, limit=2)] == [3, 2]
+
+
+def test_add_rows_matches_add():
+    added, bulk = TfidfIndex(), TfidfIndex()
+    added.add(DOCUMENTS)
+    assert bulk.add_rows(rows(DOCUMENTS)) == 4
+    assert len(bulk) == len(added) == 4
+    query = {FEVER: 1, ASTHMA: 1}
+    assert bulk.rank(query, 10) == pytest.approx(added.rank(query, 10))
+
+
+def test_prescriptions_are_added_once():
+    index = TfidfIndex()
+    index.add(DOCUMENTS[:2])
+    assert index.add_rows(rows(DOCUMENTS)) == 4
+    index.add(DOCUMENTS)
+    assert len(index) == 4
+    assert index.add_rows([]) == 0
+
+
+def test_engine_loads_then_catches_up():
+    documents = list(DOCUMENTS[:2])
+    loads = []
+
+    def load(user_id, after_id):
+        loads.append((user_id, after_id))
+        return rows([document for document in documents if document[0] > after_id])
+
+    engine = TfidfEngine(load, refresh_interval=0)
+    assert len(engine.index(1)) == 2
+    documents.extend(DOCUMENTS[2:])
+    assert len(engine.index(1)) == 4
+    assert loads == [(1, 0), (1, 2)]
+
+
+def test_engine_adds_to_loaded_indexes_only():
+    engine = TfidfEngine(lambda user_id, after_id: [], refresh_interval=60)
+    engine.add(1, DOCUMENTS[:1])
+    assert engine.stats()["indexes"] == 0
+    engine.index(1)
+    engine.add(1, DOCUMENTS)
+    assert len(engine.index(1)) == 4
+    assert engine.stats()["prescriptions"] == 4
+
+
+def test_engine_drops_least_recently_searched():
+    loads = []
+
+    def load(user_id, after_id):
+        loads.append(user_id)
+        return []
+
+    engine = TfidfEngine(load, refresh_interval=60, max_indexes=2)
+    engine.index(1)
+    engine.index(2)
+    engine.index(1)
+    engine.index(3)
+    engine.index(1)
+    engine.index(2)
+    assert loads == [1, 2, 3, 2]
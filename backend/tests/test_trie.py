@@ -0,0 +1,101 @@
+import pytest
+
+from trie import PrefixTrie, TermCompleter
+
+
+def test_build_completes_best_first():
+    trie = PrefixTrie.build(
+        [("paracetamol", 5, ["paracetamol"]), ("pantoprazole", 9, ["pantoprazole"]), ("tulsi", 3, ["tulsi"])],
+        k=10
+    )
+    assert trie.complete("pa") == [("pantoprazole", 9), ("paracetamol", 5)]
+    assert trie.complete("par") == [("paracetamol", 5)]
+    assert trie.complete("") == [("pantoprazole", 9), ("paracetamol", 5), ("tulsi", 3)]
+    assert trie.complete("x") == []
+    assert trie.complete("paracetamols") == []
+    assert len(trie) == 3
+
+
+def test_entries_are_found_under_each_key():
+    trie = PrefixTrie.build([("ashwagandha churna", 2, ["ashwagandha churna", "churna"])])
+    assert trie.complete("chu") == [("ashwagandha churna", 2)]
+    assert trie.complete("ash") == [("ashwagandha churna", 2)]
+
+
+def test_keeps_only_top_k():
+    trie = PrefixTrie.build([(f"term {i}", i, [f"term {i}"]) for i in range(20)], k=3)
+    assert [entry for entry, _ in trie.complete("term")] == ["term 19", "term 18", "term 17"]
+    assert len(trie.complete("term", limit=2)) == 2
+    assert len(trie.complete("term", limit=50)) == 3
+
+
+def test_ties_are_ordered_by_entry():
+    trie = PrefixTrie.build([("b", 1, ["b"]), ("a", 1, ["a"]), ("c", 1, ["c"])])
+    assert trie.complete("") == [("a", 1), ("b", 1), ("c", 1)]
+
+
+def test_update_matches_build():
+    items = [("fever", 4, ["fever"]), ("fatigue", 2, ["fatigue"]), ("fainting", 7, ["fainting"]), ("cough", 1, ["cough"])]
+    built = PrefixTrie.build(items, k=2)
+    updated = PrefixTrie(k=2)
+    for entry, score, keys in items:
+        updated.update(entry, score, keys)
+    for prefix in ("", "f", "fa", "fe", "c"):
+        assert updated.complete(prefix) == built.complete(prefix)
+
+
+def test_update_raises_scores_and_splits_edges():
+    trie = PrefixTrie(k=2)
+    trie.update("fever", 1, ["fever"])
+    trie.update("fatigue", 2, ["fatigue"])
+    trie.update("fever", 5)
+    assert trie.score("fever") == 5
+    assert trie.score("missing", 0) == 0
+    assert trie.complete("f") == [("fever", 5), ("fatigue", 2)]
+    assert trie.complete("fe") == [("fever", 5)]
+    with pytest.raises(ValueError):
+        trie.update("fever", 1)
+
+
+def test_tuple_scores():
+    trie = PrefixTrie.build([("a", (0, 3), ["a"]), ("ab", (1, 0), ["ab"])])
+    assert trie.complete("a") == [("ab", (1, 0)), ("a", (0, 3))]
+
+
+def make_completer(counts, since, refresh_interval=30.0):
+    calls = []
+
+    def load_since(user_id, kind, after_id):
+        calls.append(after_id)
+        return [(pid, term) for pid, term in since if pid > after_id]
+
+    completer = TermCompleter(
+        lambda user_id, kind: counts, load_since, lambda term: term.split(), refresh_interval=refresh_interval
+    )
+    return completer, calls
+
+
+def test_term_completer_builds_from_counts():
+    completer, calls = make_completer([("fever", 3, 10), ("high fever", 1, 8)], [])
+    assert completer.complete(1, "symptom", "fe") == [("fever", 3), ("high fever", 1)]
+    assert completer.complete(1, "symptom", "hi") == [("high fever", 1)]
+    assert calls == []
+
+
+def test_term_completer_counts_new_prescriptions_once():
+    since = []
+    completer, calls = make_completer([("fever", 3, 10)], since, refresh_interval=0)
+    completer.complete(1, "symptom", "fe")
+    # Written by this process, then read back from the database by the next refresh
+    completer.add(1, [(11, "symptom", "fever"), (12, "symptom", "cough")])
+    since.extend([(11, "fever"), (12, "cough"), (13, "fever")])
+    assert completer.complete(1, "symptom", "fe") == [("fever", 5)]
+    assert completer.complete(1, "symptom", "co") == [("cough", 1)]
+    assert calls[0] == 10
+
+
+def test_term_completer_ignores_tries_not_built():
+    completer, _ = make_completer([], [])
+    completer.add(1, [(1, "symptom", "fever")])
+    assert completer.stats()["size"] == 0
+    assert completer.complete(1, "symptom", "fe") == []
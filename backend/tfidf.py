@@ -0,0 +1,222 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from cache import TTLCache
+
+# Symptoms weigh double in the query vector, as they do in the overlap scorer
+SYMPTOM_WEIGHT = 2.0
+
+Feature = Tuple[str, int]  # (kind, term_id)
+
+def _grow(array: np.ndarray, needed: int) -> np.ndarray:
+    """Return `array` with capacity for at least `needed` items (doubling, so appends are amortized O(1))"""
+    if needed <= len(array):
+        return array
+    grown = np.zeros(max(needed, 2 * len(array), 64), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class TfidfIndex:
+    """Append-only sparse prescription x term matrix ranked by TF-IDF cosine similarity
+
+    Stored as COO (row, column) pairs of binary term occurrences; IDF weights and row norms are
+    derived at query time, so adding prescriptions never rewrites existing entries.
+    """
+
+    def __init__(self):
+        self.columns: Dict[Feature, int] = {}
+        # Highest prescription id read from the database; rows added by `add` may sit above it
+        self.loaded_upto = 0
+        self.refreshed_at = float("-inf")
+        self._ids = set()
+        self.load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._doc_ids = np.zeros(0, dtype=np.int64)
+        self._docs = 0
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._cols = np.zeros(0, dtype=np.int32)
+        self._nnz = 0
+        self._df = np.zeros(0, dtype=np.float64)
+        self._symptom = np.zeros(0, dtype=bool)
+        # Row norms only depend on the matrix, so they are reused until the next add
+        self._norms = None
+
+    def __len__(self) -> int:
+        return self._docs
+
+    def add(self, documents: Iterable[Tuple[int, Iterable[Feature]]]):
+        """Append (prescription_id, features) rows, ignoring prescriptions already in the index"""
+        with self._lock:
+            for prescription_id, features in documents:
+                if prescription_id in self._ids:
+                    continue
+                self._ids.add(prescription_id)
+                cols = []
+                for feature in set(features):
+                    col = self.columns.get(feature)
+                    if col is None:
+                        col = len(self.columns)
+                        self.columns[feature] = col
+                        self._df = _grow(self._df, col + 1)
+                        self._symptom = _grow(self._symptom, col + 1)
+                        self._symptom[col] = feature[0] == 'symptom'
+                    cols.append(col)
+
+                row = self._docs
+                self._doc_ids = _grow(self._doc_ids, row + 1)
+                self._doc_ids[row] = prescription_id
+                self._docs += 1
+                if cols:
+                    end = self._nnz + len(cols)
+                    self._rows = _grow(self._rows, end)
+                    self._cols = _grow(self._cols, end)
+                    self._rows[self._nnz:end] = row
+                    self._cols[self._nnz:end] = cols
+                    self._nnz = end
+                    self._df[cols] += 1
+            self._norms = None
+
+    def add_rows(self, rows: Iterable[Tuple[int, int, str]]) -> int:
+        """Bulk form of add over (prescription_id, term_id, kind) rows ordered by prescription_id
+
+        Returns the highest prescription id seen (0 if there were no rows).
+        """
+        with self._lock:
+            known = self._ids
+            row_ids, row_cols = [], []
+            prescription_id = 0
+            for prescription_id, term_id, kind in rows:
+                if prescription_id in known:
+                    continue
+                col = self.columns.get((kind, term_id))
+                if col is None:
+                    col = self.columns[(kind, term_id)] = len(self.columns)
+                row_ids.append(prescription_id)
+                row_cols.append(col)
+            if not row_ids:
+                return prescription_id
+
+            ids = np.array(row_ids, dtype=np.int64)
+            cols = np.array(row_cols, dtype=np.int32)
+            starts = np.empty(len(ids), dtype=bool)
+            starts[0] = True
+            np.not_equal(ids[1:], ids[:-1], out=starts[1:])
+            new_ids = ids[starts]
+            known.update(new_ids.tolist())
+
+            docs, nnz, ncols = self._docs + len(new_ids), self._nnz + len(ids), len(self.columns)
+            self._doc_ids = _grow(self._doc_ids, docs)
+            self._doc_ids[self._docs:docs] = new_ids
+            self._rows = _grow(self._rows, nnz)
+            self._rows[self._nnz:nnz] = self._docs + np.cumsum(starts) - 1
+            self._cols = _grow(self._cols, nnz)
+            self._cols[self._nnz:nnz] = cols
+            self._df = _grow(self._df, ncols)
+            self._df[:ncols] += np.bincount(cols, minlength=ncols)
+            self._symptom = _grow(self._symptom, ncols)
+            self._symptom[:ncols] = [kind == 'symptom' for kind, _ in self.columns]
+            self._docs, self._nnz = docs, nnz
+            self._norms = None
+        return prescription_id
+
+    def rank(self, query: Dict[Feature, float], limit: int) -> List[Tuple[int, float, int, int]]:
+        """Top `limit` (prescription_id, cosine score, symptom matches, condition matches), best first"""
+        with self._lock:
+            docs = self._docs
+            rows = self._rows[:self._nnz]
+            cols = self._cols[:self._nnz]
+            ncols = len(self.columns)
+            df = self._df[:ncols]
+            symptom = self._symptom[:ncols]
+            doc_ids = self._doc_ids[:docs]
+            query_cols = [(self.columns[feature], weight) for feature, weight in query.items() if feature in self.columns]
+            if not docs or not query_cols or limit <= 0:
+                return []
+
+            # Smoothed IDF, as in scikit-learn: rare, diagnostic terms dominate common ones
+            idf = np.log((1.0 + docs) / (1.0 + df)) + 1.0
+            if self._norms is None:
+                self._norms = np.sqrt(np.bincount(rows, weights=idf[cols] ** 2, minlength=docs))
+            norms = self._norms
+
+        q = np.zeros(ncols)
+        for col, weight in query_cols:
+            q[col] = weight * idf[col] * (SYMPTOM_WEIGHT if symptom[col] else 1.0)
+
+        # Sparse matrix-vector product over the non-zeros: X @ q with X[i, j] = idf[j] for each occurrence
+        hits = q[cols]
+        dots = np.bincount(rows, weights=hits * idf[cols], minlength=docs)
+        candidates = np.flatnonzero(dots > 0)
+        if not len(candidates):
+            return []
+        scores = dots[candidates] / (norms[candidates] * np.linalg.norm(q))
+
+        # Keep everything tied with the limit-th score, then order by score and newest first
+        if len(candidates) > limit:
+            kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            keep = scores >= kth
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((-doc_ids[candidates], -scores))[:limit]
+        top = candidates[order]
+
+        matched = hits > 0
+        in_top = np.isin(rows, top)
+        symptom_hits = np.bincount(rows[in_top], weights=(matched & symptom[cols])[in_top], minlength=docs)
+        condition_hits = np.bincount(rows[in_top], weights=(matched & ~symptom[cols])[in_top], minlength=docs)
+        return [
+            (int(doc_ids[row]), float(score), int(symptom_hits[row]), int(condition_hits[row]))
+            for row, score in zip(top, scores[order])
+        ]
+
+class TfidfEngine:
+    """One TfidfIndex per doctor (None = all doctors), built lazily and kept current
+
+    `load(user_id, after_id)` returns (prescription_id, term_id, kind) rows ordered by
+    prescription_id. Writes in this process are added immediately through `add`; writes made
+    by other workers are picked up every `refresh_interval` seconds (a row another worker
+    commits after a higher id has already been read is only seen when the process restarts).
+    Beyond `max_indexes` the least recently searched index is dropped, and loaded again from
+    the database by its next search.
+    """
+
+    def __init__(self, load: Callable[[Optional[int], int], Iterable[Tuple[int, int, str]]],
+                 refresh_interval: float = 60.0, max_indexes: int = 256):
+        self._load = load
+        self.refresh_interval = refresh_interval
+        self._indexes = TTLCache(maxsize=max_indexes, ttl=float("inf"))
+        self._lock = threading.Lock()
+
+    def index(self, user_id: Optional[int]) -> TfidfIndex:
+        """The index for a doctor (or all doctors), loading or catching it up as needed"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = TfidfIndex()
+                self._indexes.set(user_id, index)
+        # Concurrent searches wait for the one loading, rather than ranking a half-built index
+        with index.load_lock:
+            if time.monotonic() - index.refreshed_at < self.refresh_interval:
+                return index
+            started = time.monotonic()
+            last_id = index.add_rows(self._load(user_id, index.loaded_upto))
+            index.loaded_upto = max(index.loaded_upto, last_id)
+            index.refreshed_at = started
+        return index
+
+    def add(self, user_id: int, documents: List[Tuple[int, List[Feature]]]):
+        """Add newly committed prescriptions to the doctor's and the all-doctors index, if loaded"""
+        for key in (user_id, None):
+            index = self._indexes.peek(key)
+            if index is not None:
+                index.add(documents)
+
+    def stats(self) -> Dict:
+        """Loaded indexes with their size, and how often a search found its index loaded"""
+        indexes = self._indexes.values()
+        return {
+            "indexes": len(indexes),
+            "prescriptions": sum(len(index) for index in indexes),
+            "terms": sum(len(index.columns) for index in indexes),
+            "cache": self._indexes.stats(),
+        }
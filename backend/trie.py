@@ -0,0 +1,232 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from cache import TTLCache
+
+
+class _Node:
+    __slots__ = ("label", "children", "top")
+
+    def __init__(self, label: str, top: List[Hashable]):
+        self.label = label
+        self.children: Dict[str, "_Node"] = {}
+        self.top = top
+
+
+class PrefixTrie:
+    """Thread-safe radix trie that keeps each prefix's `k` best-scoring entries precomputed
+
+    An entry is reachable under several keys (e.g. every word of a medicine name), and a
+    lookup just walks the prefix, so it costs O(len(prefix)) whatever the vocabulary size.
+    Scores may only grow: a raised score is pushed into the lists along the entry's keys,
+    but nothing is ever demoted.
+    """
+
+    def __init__(self, k: int = 10):
+        self.k = k
+        self._root = _Node("", [])
+        self._scores: Dict[Hashable, Any] = {}
+        self._keys: Dict[Hashable, Tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[Hashable, Any, Iterable[str]]], k: int = 10) -> "PrefixTrie":
+        """A trie of (entry, score, keys) items, much faster than calling update for each"""
+        trie = cls(k)
+        for entry, score, keys in items:
+            trie._scores[entry] = score
+            trie._keys[entry] = tuple(dict.fromkeys(keys))
+        # Best first, so each node's list just fills up in order and never needs sorting
+        ranked = sorted(trie._scores)
+        ranked.sort(key=trie._scores.__getitem__, reverse=True)
+        for entry in ranked:
+            for key in trie._keys[entry]:
+                trie._insert(key, entry, trie._append)
+        return trie
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def score(self, entry: Hashable, default: Any = None) -> Any:
+        """Current score of an entry, or `default` if it was never added"""
+        return self._scores.get(entry, default)
+
+    def update(self, entry: Hashable, score: Any, keys: Iterable[str] = ()):
+        """Add an entry under `keys`, or raise the score of one already added (its keys are kept)"""
+        with self._lock:
+            previous = self._scores.get(entry)
+            if previous is not None and score < previous:
+                raise ValueError("PrefixTrie scores may only grow")
+            self._scores[entry] = score
+            if entry not in self._keys:
+                self._keys[entry] = tuple(dict.fromkeys(keys))
+            for key in self._keys[entry]:
+                self._insert(key, entry)
+
+    def complete(self, prefix: str, limit: int = None) -> List[Tuple[Hashable, Any]]:
+        """(entry, score) for the best entries with a key starting with `prefix`, best first"""
+        limit = self.k if limit is None else min(limit, self.k)
+        with self._lock:
+            node, i = self._root, 0
+            while i < len(prefix):
+                child = node.children.get(prefix[i])
+                if child is None:
+                    return []
+                rest = prefix[i:]
+                if rest.startswith(child.label):
+                    i += len(child.label)
+                elif not child.label.startswith(rest):
+                    return []
+                else:
+                    i = len(prefix)
+                node = child
+            return [(entry, self._scores[entry]) for entry in node.top[:limit]]
+
+    def _insert(self, key: str, entry: Hashable, offer=None):
+        offer = offer or self._offer
+        node, i = self._root, 0
+        offer(node, entry)
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                node.children[key[i]] = _Node(key[i:], [entry])
+                return
+            label = child.label
+            if key.startswith(label, i):
+                common = len(label)
+            else:
+                common = 1
+                while common < len(label) and i + common < len(key) and label[common] == key[i + common]:
+                    common += 1
+                # Split the edge: the shared part becomes a node holding what the child held
+                middle = _Node(label[:common], list(child.top))
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[key[i]] = middle
+                child = middle
+            i += common
+            node = child
+            offer(node, entry)
+
+    def _offer(self, node: _Node, entry: Hashable):
+        """Merge an entry into a node's top-k list (highest score first, then entry order)"""
+        top = node.top
+        if entry not in top:
+            if len(top) >= self.k and not self._rank(entry) < self._rank(top[-1]):
+                return
+            top.append(entry)
+        top.sort(key=self._rank)
+        del top[self.k:]
+
+    def _append(self, node: _Node, entry: Hashable):
+        """_offer for entries arriving best first (an entry's keys are inserted back to back)"""
+        top = node.top
+        if len(top) < self.k and (not top or top[-1] != entry):
+            top.append(entry)
+
+    def _rank(self, entry: Hashable):
+        return (_Descending(self._scores[entry]), entry)
+
+
+class _Descending:
+    """Sort key wrapper that inverts the order of any comparable score (numbers or tuples)"""
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: "_Descending") -> bool:
+        return self.value == other.value
+
+
+class _TermIndex:
+    __slots__ = ("trie", "loaded_upto", "applied", "refreshed_at", "lock")
+
+    def __init__(self):
+        self.trie = None
+        # Highest prescription id read from the database, and ids above it counted through `add`
+        self.loaded_upto = 0
+        self.applied = set()
+        self.refreshed_at = float("-inf")
+        self.lock = threading.Lock()
+
+
+class TermCompleter:
+    """Usage-ranked PrefixTries of terms per (doctor, kind), user_id None meaning all doctors
+
+    `load_counts(user_id, kind)` returns (term, uses, last_prescription_id) rows for the first
+    build and `load_since(user_id, kind, after_id)` the (prescription_id, term) rows written
+    after that. This process's own writes are counted at once through `add`; other workers'
+    are read every `refresh_interval` seconds, so no trie ever has to be rebuilt.
+    """
+
+    def __init__(self, load_counts: Callable[[Optional[int], str], Iterable[Tuple[str, int, int]]],
+                 load_since: Callable[[Optional[int], str, int], Iterable[Tuple[int, str]]],
+                 keys: Callable[[str], Iterable[str]], refresh_interval: float = 30.0,
+                 max_indexes: int = 512, k: int = 10):
+        self._load_counts = load_counts
+        self._load_since = load_since
+        self._keys = keys
+        self.refresh_interval = refresh_interval
+        self.k = k
+        # Least recently used tries are dropped beyond max_indexes
+        self._indexes = TTLCache(maxsize=max_indexes, ttl=float("inf"))
+        self._lock = threading.Lock()
+
+    def complete(self, user_id: Optional[int], kind: str, prefix: str, limit: int = None) -> List[Tuple[str, int]]:
+        """(term, uses) completing `prefix`, most used first"""
+        return self._index(user_id, kind).trie.complete(prefix, limit)
+
+    def add(self, user_id: int, rows: List[Tuple[int, str, str]]):
+        """Count newly committed (prescription_id, kind, term) rows in the tries already built"""
+        for key in (user_id, None):
+            for kind in {kind for _, kind, _ in rows}:
+                # peek: only autocomplete lookups count towards the hit ratio and recency
+                index = self._indexes.peek((key, kind))
+                if index is None:
+                    continue
+                with index.lock:
+                    if index.trie is not None:
+                        self._count(index, [(pid, term) for pid, row_kind, term in rows if row_kind == kind])
+
+    def stats(self) -> Dict:
+        """How many tries are held, and how often a lookup found its trie already built"""
+        return self._indexes.stats()
+
+    def _index(self, user_id: Optional[int], kind: str) -> _TermIndex:
+        with self._lock:
+            index = self._indexes.get((user_id, kind))
+            if index is None:
+                index = _TermIndex()
+                self._indexes.set((user_id, kind), index)
+        # Concurrent lookups wait for the one loading, rather than completing from a partial trie
+        with index.lock:
+            started = time.monotonic()
+            if index.trie is None:
+                counts = list(self._load_counts(user_id, kind))
+                index.trie = PrefixTrie.build(
+                    ((term, uses, self._keys(term)) for term, uses, _ in counts), k=self.k
+                )
+                index.loaded_upto = max((last_id for _, _, last_id in counts), default=0)
+                index.refreshed_at = started
+            elif started - index.refreshed_at >= self.refresh_interval:
+                rows = list(self._load_since(user_id, kind, index.loaded_upto))
+                self._count(index, rows)
+                index.loaded_upto = max([index.loaded_upto] + [pid for pid, _ in rows])
+                index.applied = {pid for pid in index.applied if pid > index.loaded_upto}
+                index.refreshed_at = started
+        return index
+
+    def _count(self, index: _TermIndex, rows: List[Tuple[int, str]]):
+        """Add one use per new (prescription_id, term), skipping prescriptions already counted"""
+        uses = {}
+        for pid, term in rows:
+            if pid <= index.loaded_upto or pid in index.applied:
+                continue
+            uses[term] = uses.get(term, 0) + 1
+        index.applied.update(pid for pid, _ in rows if pid > index.loaded_upto)
+        for term, count in uses.items():
+            index.trie.update(term, index.trie.score(term, 0) + count, self._keys(term))